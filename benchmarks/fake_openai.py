@@ -0,0 +1,152 @@
+import re
+import time
+import random
+import threading
+
+# words with their leading whitespace, punctuation, backtick runs and newlines, roughly the pieces the API streams
+_TOKEN_RE = re.compile(r"\n|[^\S\n]*\w+|[^\S\n]*`+|[^\S\n]*[^\w\s]|[^\S\n]+")
+
+_WORDS = "the a model token stream response latency render terminal voice context request cache " \
+         "value buffer line code block function result error time first each chunk".split()
+
+
+def split_tokens(text):
+    return _TOKEN_RE.findall(text)
+
+
+class FakeEncoding:
+    """
+    Stand-in for a tiktoken encoding (see gpterm.tokens.use_encoding): the tokens are the pieces of split_tokens
+    """
+    def encode(self, text, disallowed_special=()):
+        return split_tokens(text)
+
+    def decode(self, tokens):
+        return ''.join(tokens)
+
+
+def sample_response(paragraphs=3, code_blocks=1, code_lines=12, language="python", seed=0):
+    """
+    Deterministic response text with prose paragraphs and fenced code blocks
+    """
+    rng = random.Random(seed)
+    parts = []
+    for idx in range(paragraphs):
+        sentences = []
+        for _ in range(rng.randint(2, 4)):
+            words = [rng.choice(_WORDS) for _ in range(rng.randint(6, 14))]
+            sentences.append(' '.join(words).capitalize() + '.')
+        parts.append(' '.join(sentences))
+        if idx < code_blocks:
+            lines = []
+            for line_idx in range(code_lines):
+                indent = "    " * (line_idx % 3)
+                name, other = rng.choice(_WORDS), rng.choice(_WORDS)
+                lines.append(f"{indent}{name}_{line_idx} = {other}({line_idx}, '{name}')  # {other}")
+            parts.append(f"```{language}\n" + '\n'.join(lines) + "\n```")
+    return '\n\n'.join(parts)
+
+
+class FakeCompletionStream:
+    """
+    Streams the chunks of a response, paced like the API. close() stops the stream like it does a real one
+    """
+    def __init__(self, backend, deltas, is_chat):
+        self.backend = backend
+        self.deltas = deltas
+        self.is_chat = is_chat
+        self.closed = False
+
+    def __iter__(self):
+        from gpterm.cache import chunk_for_delta
+        from openai.util import convert_to_openai_object
+        backend = self.backend
+        if self.is_chat:
+            yield convert_to_openai_object({"choices": [{"delta": {"role": "assistant"}}]})
+        time.sleep(backend.first_token_delay)
+        interval = backend.chunk_size / backend.tokens_per_second if backend.tokens_per_second else 0
+        next_time = time.monotonic()
+        for idx, delta in enumerate(self.deltas):
+            if self.closed:
+                return
+            if backend.fail_after_chunks is not None and idx == backend.fail_after_chunks:
+                import openai
+                raise openai.error.APIConnectionError("fake backend: connection dropped")
+            if interval:
+                next_time += interval
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            yield chunk_for_delta(delta, self.is_chat)
+        if self.is_chat:
+            yield convert_to_openai_object({"choices": [{"delta": {}, "finish_reason": "stop"}]})
+
+    def close(self):
+        self.closed = True
+
+
+class FakeOpenAI:
+    """
+    Local stand-in for the OpenAI completion endpoints, for benchmarks and offline runs.
+    install() replaces openai.ChatCompletion.create and openai.Completion.create until uninstall()
+
+    response: text of every response (or a function of the request kwargs that returns it)
+    tokens_per_second: pace of the stream (0 for as fast as possible), chunk_size: tokens per chunk
+    fail_requests: number of first requests that fail with a rate limit error
+    fail_after_chunks: drop the connection after that many chunks of each stream
+    """
+    def __init__(self, response=None, tokens_per_second=50, chunk_size=1, first_token_delay=0.2, connect_delay=0.05,
+                 fail_requests=0, fail_after_chunks=None):
+        self.response = sample_response() if response is None else response
+        self.tokens_per_second = tokens_per_second
+        self.chunk_size = chunk_size
+        self.first_token_delay = first_token_delay
+        self.connect_delay = connect_delay
+        self.fail_requests = fail_requests
+        self.fail_after_chunks = fail_after_chunks
+        self.lock = threading.Lock()
+        self.requests = []  # kwargs of each request
+        self._originals = None
+
+    def response_text(self, kwargs):
+        return self.response(kwargs) if callable(self.response) else self.response
+
+    def deltas(self, text):
+        tokens = split_tokens(text)
+        return [''.join(tokens[idx:idx + self.chunk_size]) for idx in range(0, len(tokens), self.chunk_size)]
+
+    def create(self, is_chat, kwargs):
+        import openai
+        with self.lock:
+            self.requests.append(kwargs)
+            num_requests = len(self.requests)
+        time.sleep(self.connect_delay)
+        if num_requests <= self.fail_requests:
+            raise openai.error.RateLimitError("fake backend: rate limited", headers={"retry-after": "0.1"})
+        text = self.response_text(kwargs)
+        if kwargs.get('stream'):
+            deltas = self.deltas(text)
+            if not is_chat:
+                deltas = ['\n'] + deltas  # text completions start with a newline
+            return FakeCompletionStream(self, deltas, is_chat)
+        from openai.util import convert_to_openai_object
+        choice = {"message": {"role": "assistant", "content": text}} if is_chat else {"text": text}
+        prompt = kwargs.get('prompt') or ''.join(message['content'] for message in kwargs.get('messages', []))
+        prompt_tokens, completion_tokens = len(split_tokens(prompt)), len(split_tokens(text))
+        return convert_to_openai_object({"choices": [choice],
+                                         "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                                   "total_tokens": prompt_tokens + completion_tokens}})
+
+    def install(self):
+        import openai
+        if self._originals is None:
+            self._originals = (openai.ChatCompletion.create, openai.Completion.create)
+        openai.ChatCompletion.create = lambda **kwargs: self.create(True, kwargs)
+        openai.Completion.create = lambda **kwargs: self.create(False, kwargs)
+        return self
+
+    def uninstall(self):
+        import openai
+        if self._originals is not None:
+            openai.ChatCompletion.create, openai.Completion.create = self._originals
+            self._originals = None
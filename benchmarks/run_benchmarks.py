@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the response path against the fake OpenAI backend (no API key or network needed)
+
+    python benchmarks/run_benchmarks.py [--quick] [--results-dir benchmarks/results]
+
+Results are saved as json per run, and compared with the previous run so regressions show up between versions
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import glob
+import platform
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpterm.gpt_terminal import GptTerminal  # noqa: E402
+from gpterm.config import Config  # noqa: E402
+from gpterm.tokens import use_encoding  # noqa: E402
+from fake_openai import FakeOpenAI, FakeEncoding, sample_response  # noqa: E402
+from gpterm.utils import gpterm_version  # noqa: E402
+from gpterm.metrics import percentile  # noqa: E402
+
+ROUNDS = 5  # timings are the best of a few rounds, to keep the noise below the threshold
+
+
+def higher_is_better(name):
+    return name.endswith("_per_s")  # rates, the rest are times
+
+
+def make_gpterm(model="gpt-3.5-turbo"):
+    """
+    A GptTerminal that doesn't read the user's config, touch the network or write any files:
+    default settings, a local stand-in tokenizer and no connection warm up
+    """
+    from rich.console import Console
+    use_encoding(FakeEncoding())
+    cfg = Config(os.devnull)
+    cfg.model = model
+    cfg.use_voice = False
+    cfg.use_cache = False
+    cfg.use_code_format = False
+    cfg.context_summary = False
+    cfg.save_sessions = False
+    cfg.track_usage = False
+    gpterm = GptTerminal(config=cfg, warm_up_connection=False)
+    gpterm._console = Console(file=io.StringIO(), force_terminal=True, width=100, color_system="truecolor")
+    gpterm.reset_context(prompt="", submit=False)
+    return gpterm
+
+
+def best_time(run, rounds=ROUNDS):
+    """
+    Shortest time of run() over a few rounds. run may return a setup-free timing of its own
+    """
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        elapsed = run()
+        times.append(elapsed if elapsed is not None else time.perf_counter() - start)
+    return min(times)
+
+
+def bench_render(quick):
+    """
+    Chunks per second through handle_completion, with the stream as fast as possible
+    """
+    results = {}
+    size = 20 if quick else 100
+    responses = {
+        "prose": sample_response(paragraphs=size, code_blocks=0, seed=1),
+        "code": sample_response(paragraphs=2, code_blocks=1, code_lines=size * 5, seed=2),
+    }
+    for name, response in responses.items():
+        fake = FakeOpenAI(response=response, tokens_per_second=0, first_token_delay=0, connect_delay=0)
+        num_chunks = len(fake.deltas(response))
+
+        def run():
+            gpterm = make_gpterm()
+            completion = fake.create(True, {"stream": True})
+            start = time.perf_counter()
+            gpterm.handle_completion(completion)
+            return time.perf_counter() - start
+        results[f"render_{name}_chunks_per_s"] = num_chunks / best_time(run)
+    return results
+
+
+def bench_token_accounting(quick):
+    """
+    Cost of adding a response chunk and of building the prompt, for growing conversation lengths
+    """
+    results = {}
+    turn_text = sample_response(paragraphs=1, code_blocks=0, seed=3)
+    chunk = " token"
+    for num_turns in ([10, 100] if quick else [10, 100, 1000]):
+        gpterm = make_gpterm()
+        for idx in range(num_turns):
+            gpterm.add_to_conversation(f"\n{turn_text}\n", is_response=idx % 2 == 1)
+        repeats = 2000
+
+        def add_chunks():
+            for _ in range(repeats):
+                gpterm.add_to_conversation(chunk, is_response=True)
+
+        def build_prompt():
+            for _ in range(repeats):
+                gpterm.calc_max_tokens()
+                gpterm.conversation.messages()
+        results[f"tokens_add_chunk_us_{num_turns}_turns"] = best_time(add_chunks) / repeats * 1e6
+        results[f"tokens_build_prompt_us_{num_turns}_turns"] = best_time(build_prompt) / repeats * 1e6
+    return results
+
+
+def bench_end_to_end(quick):
+    """
+    submit_prompt against a backend paced like the API. Overhead is the time added on top of the backend's own
+    """
+    connect_delay, first_token_delay, tokens_per_second = 0.05, 0.2, 200
+    response = sample_response(paragraphs=2, code_blocks=1, code_lines=10, seed=4)
+    fake = FakeOpenAI(response=response, tokens_per_second=tokens_per_second, first_token_delay=first_token_delay,
+                      connect_delay=connect_delay).install()
+    try:
+        gpterm = make_gpterm()
+        num_chunks = len(fake.deltas(response))
+        for idx in range(3 if quick else 10):
+            gpterm.reset_context(prompt="", submit=False)
+            gpterm.submit_prompt(f"question {idx}")
+    finally:
+        fake.uninstall()
+    records = list(gpterm.metrics.records)
+    errors = [record['error'] for record in records if record['error']]
+    if errors:
+        raise RuntimeError(f"end to end requests failed: {errors[0]}")
+    backend_ms = (connect_delay + first_token_delay + num_chunks / tokens_per_second) * 1000
+    total_ms = percentile([record['total_ms'] for record in records], 50)
+    return {
+        "e2e_ttft_ms": percentile([record['ttft_ms'] for record in records], 50),
+        "e2e_total_ms": total_ms,
+        "e2e_overhead_ms": total_ms - backend_ms,
+    }
+
+
+def previous_results(results_dir, quick):
+    for path in sorted(glob.glob(os.path.join(results_dir, "*.json")), reverse=True):
+        with open(path) as fp:
+            run = json.load(fp)
+        if run.get('quick') == quick:
+            return run
+    return None
+
+
+def compare(results, previous, threshold):
+    lines = []
+    for name, value in results.items():
+        old = previous['results'].get(name)
+        if not old:
+            lines.append(f"  {name:40} {value:12.2f}")
+            continue
+        change = (value - old) / old
+        worse = -change if higher_is_better(name) else change
+        # a few ms either way is noise for the end to end timings
+        noise = name.endswith("_ms") and abs(value - old) < 5
+        flag = "  REGRESSION" if worse > threshold and not noise else ""
+        lines.append(f"  {name:40} {value:12.2f}  ({change:+.1%} vs {old:.2f}){flag}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the gpterm response path against a fake OpenAI backend")
+    parser.add_argument("--quick", action="store_true", help="Smaller inputs, for a fast check")
+    parser.add_argument("--results-dir", type=str,
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "results"))
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative change from the previous run that is reported as a regression")
+    parser.add_argument("--no-save", action="store_true", help="Don't save the results")
+    args = parser.parse_args()
+
+    results = {}
+    for bench in [bench_render, bench_token_accounting, bench_end_to_end]:
+        print(f"running {bench.__name__}...", file=sys.stderr)
+        results.update(bench(args.quick))
+
+    previous = previous_results(args.results_dir, args.quick)
+    run = {
+        "version": gpterm_version(),
+        "time": datetime.datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "results": results,
+    }
+    if previous:
+        print(f"gpterm {run['version']} (previous run: {previous['version']} at {previous['time']})")
+        lines = compare(results, previous, args.threshold)
+    else:
+        print(f"gpterm {run['version']}")
+        lines = [f"  {name:40} {value:12.2f}" for name, value in results.items()]
+    print('\n'.join(lines))
+
+    if not args.no_save:
+        os.makedirs(args.results_dir, exist_ok=True)
+        version = re.sub(r'[^\w.]', '', run['version'])
+        filename = f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{version}.json"
+        with open(os.path.join(args.results_dir, filename), 'w') as fp:
+            json.dump(run, fp, indent=2)
+    return 1 if any(line.endswith("REGRESSION") for line in lines) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
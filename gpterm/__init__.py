@@ -0,0 +1,3 @@
+import time
+
+startup_time = time.perf_counter()  # for --startup-profile, taken before any other gpterm module is imported
@@ -0,0 +1,161 @@
+import os
+import mmap
+import codecs
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from gpterm.tokens import encoding_for_model
+
+
+def _split_tokens(encoding, tokens, max_tokens):
+    """
+    The text of each full max_tokens piece of tokens, and the last piece (1 to max_tokens tokens) left over
+    """
+    end = (len(tokens) - 1) // max_tokens * max_tokens
+    return [encoding.decode(tokens[idx:idx + max_tokens]) for idx in range(0, end, max_tokens)], tokens[end:]
+
+
+def iter_file_chunks(path, model, max_tokens, window=1 << 20):
+    """
+    Yield the text of a file in chunks of at most max_tokens tokens, split at line ends where possible.
+    The file is memory mapped and decoded a window of bytes at a time, so only the current window and chunk
+    are held in memory, also when the file has no line ends
+    """
+    encoding = encoding_for_model(model)
+    with open(path, 'rb') as fp:
+        size = os.fstat(fp.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            lines, num_tokens = [], 0
+            rest = ''  # the start of a line that continues in the next window
+            for pos in range(0, size, window):
+                final = pos + window >= size
+                text = rest + decoder.decode(mapped[pos:pos + window], final=final)
+                cut = len(text) if final else text.rfind('\n') + 1
+                rest = text[cut:]
+                for line in text[:cut].splitlines(keepends=True):
+                    tokens = encoding.encode(line, disallowed_special=())
+                    if num_tokens + len(tokens) > max_tokens and lines:
+                        yield ''.join(lines)
+                        lines, num_tokens = [], 0
+                    if len(tokens) > max_tokens:
+                        # a line longer than a chunk (minified code, a binary file) is split by tokens
+                        pieces, tokens = _split_tokens(encoding, tokens, max_tokens)
+                        yield from pieces
+                        line = encoding.decode(tokens)
+                    lines.append(line)
+                    num_tokens += len(tokens)
+                if len(rest) >= window:
+                    # a line longer than a window is split by tokens as it's read
+                    if lines:
+                        yield ''.join(lines)
+                        lines, num_tokens = [], 0
+                    pieces, tokens = _split_tokens(encoding, encoding.encode(rest, disallowed_special=()), max_tokens)
+                    yield from pieces
+                    rest = encoding.decode(tokens)
+            if lines:
+                yield ''.join(lines)
+
+
+class FileMapReduce:
+    """
+    Answers a question about a file too large for the chat context: each chunk of the file is sent on its own
+    (map), a few at a time, for notes relevant to the question, and the notes are then combined into the answer
+    (reduce). Notes that don't fit a single request are combined in rounds
+    """
+    def __init__(self, gpterm, path, question, workers=4, chunk_tokens=1500, notes_tokens=256):
+        self.gpterm = gpterm
+        self.path = path
+        self.question = question or "Summarize the content of the file"
+        self.workers = workers
+        self.notes_tokens = notes_tokens
+        model = gpterm.cfg.model
+        directive_tokens = gpterm.text_to_tokens(self.map_prompt(1, ""))
+        self.chunk_tokens = min(chunk_tokens, gpterm.tokens_per_model() - notes_tokens - directive_tokens - 50)
+        if self.chunk_tokens <= 0:
+            raise ValueError(f"{model} context is too small to split a file into chunks")
+
+    def map_prompt(self, idx, chunk):
+        name = os.path.basename(self.path)
+        return f"This is part {idx} of the file {name}. Write short notes of everything in it that is relevant " \
+               f"to the question below (or 'nothing relevant'), keeping exact names, numbers and code.\n" \
+               f"Question: {self.question}\n\n{chunk}"
+
+    def combine_prompt(self, notes):
+        return f"Combine these notes, taken from parts of a file, into shorter notes relevant to the question " \
+               f"below. Keep exact names, numbers and code.\nQuestion: {self.question}\n\n{notes}"
+
+    def reduce_prompt(self, notes):
+        return f"These are notes taken from the parts of the file {os.path.basename(self.path)}, in order.\n\n" \
+               f"{notes}\n\nUsing these notes, answer: {self.question}"
+
+    def _notes(self, prompt):
+        return self.gpterm.get_single_completion(prompt, max_tokens=self.notes_tokens, temperature=0).strip()
+
+    def _run_bounded(self, prompts, progress, task):
+        """
+        Run the prompts (an iterator) through the worker pool, with at most 2 prompts per worker
+        queued at a time. Returns the notes in prompt order
+        """
+        results = {}
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            pending = set()
+            for idx, prompt in enumerate(prompts):
+                if len(pending) >= self.workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect(done, results, progress, task)
+                future = pool.submit(self._notes, prompt)
+                future.idx = idx
+                pending.add(future)
+                progress.update(task, total=idx + 1)
+            done, _ = wait(pending)
+            self._collect(done, results, progress, task)
+        except BaseException:
+            # on Ctrl+C or a failed request, don't wait for the queued prompts, they would still be sent (and billed)
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
+        return [results[idx] for idx in sorted(results)]
+
+    @staticmethod
+    def _collect(done, results, progress, task):
+        for future in done:
+            results[future.idx] = future.result()
+            progress.advance(task)
+
+    def _fit_notes(self, notes, progress):
+        """
+        Combine notes in rounds until they fit a single request
+        """
+        budget = self.gpterm.tokens_per_model() - self.gpterm.cfg.response_tokens - 50
+        while self.gpterm.text_to_tokens(self.reduce_prompt('\n\n'.join(notes))) > budget and len(notes) > 1:
+            groups, group, group_tokens = [], [], 0
+            for note in notes:
+                note_tokens = self.gpterm.text_to_tokens(note)
+                if group and group_tokens + note_tokens > self.chunk_tokens:
+                    groups.append(group)
+                    group, group_tokens = [], 0
+                group.append(note)
+                group_tokens += note_tokens
+            groups.append(group)
+            task = progress.add_task("combining notes", total=len(groups))
+            notes = self._run_bounded((self.combine_prompt('\n\n'.join(group)) for group in groups), progress, task)
+        return notes
+
+    def run(self):
+        """
+        Returns the prompt for the final answer
+        """
+        from rich.progress import Progress
+        gpterm = self.gpterm
+        with Progress(console=gpterm.console, transient=True) as progress:
+            task = progress.add_task(f"reading {os.path.basename(self.path)}", total=None)
+            chunks = iter_file_chunks(self.path, gpterm.cfg.model, self.chunk_tokens)
+            prompts = (self.map_prompt(idx, chunk) for idx, chunk in enumerate(chunks, start=1))
+            notes = self._run_bounded(prompts, progress, task)
+            if not notes:
+                raise ValueError(f"{self.path} is empty")
+            gpterm.console.print(f"[{gpterm.colors.cinfo}]read {len(notes)} parts of {self.path}[/]")
+            notes = self._fit_notes(notes, progress)
+        return self.reduce_prompt('\n\n'.join(notes))
@@ -0,0 +1,88 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+def read_prompts(prompts_path):
+    """
+    Read prompts from a jsonl file. Each line is a json string or an object with a 'prompt' and an optional 'id'
+    (the line number is used as id otherwise). Lines that are not json are taken as the prompt text
+    """
+    prompts = []
+    with open(prompts_path) as fp:
+        for line_idx, line in enumerate(fp, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = line
+            if isinstance(item, dict):
+                prompts.append((str(item.get('id', line_idx)), item['prompt']))
+            else:
+                prompts.append((str(line_idx), str(item)))
+    return prompts
+
+
+def read_completed_ids(out_path):
+    completed = set()
+    if not os.path.exists(out_path):
+        return completed
+    with open(out_path, 'rb') as fp:
+        for line in fp:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            if not isinstance(result, dict) or 'error' in result or result.get('id') is None:
+                continue  # a failed prompt, or a line that isn't a result (hand edited or from another tool)
+            completed.add(result['id'])
+    return completed
+
+
+def _ensure_ends_with_newline(out_path):
+    if not os.path.exists(out_path) or os.path.getsize(out_path) == 0:
+        return
+    with open(out_path, 'rb+') as fp:
+        fp.seek(-1, os.SEEK_END)
+        if fp.read(1) != b'\n':
+            fp.write(b'\n')
+
+
+class BatchRunner:
+    """
+    Runs a file of prompts through a GptTerminal concurrently and appends the results, tagged with the prompt ids,
+    to a jsonl file as they complete. Prompts that already have a result in the output file are skipped,
+    so an interrupted run can be resumed
+    """
+    def __init__(self, gpterm, concurrency=4):
+        self.gpterm = gpterm
+        self.concurrency = concurrency
+
+    def run(self, prompts_path, out_path):
+        prompts = read_prompts(prompts_path)
+        completed = read_completed_ids(out_path)
+        pending = [(prompt_id, prompt) for prompt_id, prompt in prompts if prompt_id not in completed]
+        console = self.gpterm.console
+        console.print(f"[{self.gpterm.colors.cinfo}]{len(prompts)} prompts, {len(prompts) - len(pending)} already "
+                      f"completed in {out_path}. Running {len(pending)} with concurrency {self.concurrency}[/]")
+        _ensure_ends_with_newline(out_path)
+        num_errors = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool, open(out_path, 'a') as fp:
+            futures = {pool.submit(self.gpterm.complete_prompt, prompt): (prompt_id, prompt)
+                       for prompt_id, prompt in pending}
+            for idx, future in enumerate(as_completed(futures), start=1):
+                prompt_id, prompt = futures[future]
+                result = {"id": prompt_id, "model": self.gpterm.cfg.model, "prompt": prompt}
+                try:
+                    result["response"] = future.result()
+                    status = "done"
+                except Exception as e:
+                    result["error"] = str(e)
+                    status = f"[bold red]error: {e}[/]"
+                    num_errors += 1
+                fp.write(json.dumps(result) + "\n")
+                fp.flush()
+                console.print(f"[{idx}/{len(pending)}] {prompt_id}: {status}")
+        return num_errors
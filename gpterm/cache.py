@@ -0,0 +1,421 @@
+import os
+import re
+import json
+import time
+import heapq
+import random
+import hashlib
+from collections import OrderedDict
+from gpterm.streams import TeeStream
+
+
+def chunk_for_delta(delta, is_chat):
+    from openai.util import convert_to_openai_object
+    if is_chat:
+        return convert_to_openai_object({"choices": [{"delta": {"content": delta} if delta is not None else {}}]})
+    return convert_to_openai_object({"choices": [{"text": delta}]})
+
+
+class ReplayedStream:
+    """
+    Plays back recorded response deltas as completion chunks, so they go through the same handle_completion path
+    """
+    def __init__(self, deltas, is_chat):
+        self.deltas = deltas
+        self.is_chat = is_chat
+
+    def __iter__(self):
+        for delta in self.deltas:
+            yield chunk_for_delta(delta, self.is_chat)
+
+    def close(self):
+        pass
+
+
+class ResponseCache:
+    """
+    On disk cache of responses, one json file per request. Least recently used entries are evicted
+    when it holds more than max_entries or max_mb
+    """
+    def __init__(self, path, max_entries=1000, max_mb=50):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.entries = None  # key -> size, least recently used first
+        self.total_bytes = 0
+
+    def _load_index(self):
+        if self.entries is not None:
+            return
+        entries = []
+        if os.path.exists(self.path):
+            for entry in os.scandir(self.path):
+                if entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+        entries.sort()
+        self.entries = OrderedDict((key, size) for _, key, size in entries)
+        self.total_bytes = sum(self.entries.values())
+
+    @staticmethod
+    def key(model, temperature, messages):
+        normalized = [{"role": message["role"], "content": message["content"].strip()} for message in messages]
+        data = json.dumps({"model": model, "temperature": temperature, "messages": normalized}, sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _file_path(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key):
+        stream = self.read(key)
+        if stream is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return stream
+
+    def read(self, key):
+        """
+        The cached response for key, without counting a lookup
+        """
+        self._load_index()
+        if key not in self.entries:
+            return None
+        file_path = self._file_path(key)
+        try:
+            with open(file_path) as fp:
+                entry = json.load(fp)
+            os.utime(file_path)
+        except (OSError, ValueError):
+            self.total_bytes -= self.entries.pop(key, 0)
+            return None
+        self.entries.move_to_end(key)
+        return ReplayedStream(entry['deltas'], entry['chat'])
+
+    def put(self, key, deltas, is_chat):
+        self._load_index()
+        file_path = self._file_path(key)
+        tmp_path = f"{file_path}.tmp"
+        try:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            with open(tmp_path, 'w') as fp:
+                json.dump({"chat": is_chat, "deltas": deltas}, fp, separators=(',', ':'))
+            os.replace(tmp_path, file_path)
+        except OSError:
+            return  # a response that can't be cached is still a valid response
+        self.total_bytes -= self.entries.get(key, 0)
+        self.entries[key] = os.path.getsize(file_path)
+        self.entries.move_to_end(key)
+        self.total_bytes += self.entries[key]
+        self._evict()
+
+    def record(self, key, completion, get_response, is_chat, on_put=None):
+        """
+        Pass a completion stream through and cache its response deltas if the stream wasn't aborted
+        """
+        deltas = []
+
+        def on_end():
+            self.put(key, deltas, is_chat)
+            if on_put:
+                on_put()
+        return TeeStream(completion, lambda obj: deltas.append(get_response(obj)), on_end=on_end)
+
+    def _evict(self):
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self._file_path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        self._load_index()
+        for key in list(self.entries):
+            try:
+                os.remove(self._file_path(key))
+            except OSError:
+                pass
+        self.entries.clear()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        self._load_index()
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0
+        size_kb = self.total_bytes / 1024
+        return f"Response cache: {len(self.entries)} entries ({size_kb:.1f} KB) at {self.path}\n" \
+               f"Hits: {self.hits} / {lookups} lookups ({hit_rate:.0f}%)"
+
+
+def normalize_prompt(text):
+    """
+    Lower case words without punctuation, separated by single spaces
+    """
+    return ' '.join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+# words that only shape a question ("how can I", "what's the") and not its subject, left out of the shingles
+# so differently worded questions about the same thing match. Negations are kept
+STOPWORDS = frozenset("""
+a an the i me my we our you your it its is are was were be been being am do does did can could would should will
+shall may might must please how what which who whom whose when where why there here this that these those to of
+in on at for with by from about as into onto and or so if then than just also some any tell show give explain help
+want need know like get let make write s re ll ve d m
+""".split())
+
+
+def content_words(normalized):
+    """
+    The words of a normalized prompt without the stop words, with a plural or third person s dropped.
+    All its words if it has only stop words
+    """
+    words = []
+    for word in normalized.split():
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return words or normalized.split()
+
+
+class MinHash:
+    """
+    MinHash signatures of the word shingles of a normalized text: its content words and each pair of adjacent
+    content words, so rewording the question matches while another subject or a different word order doesn't.
+    The fraction of equal values of two signatures estimates the Jaccard similarity of their shingle sets.
+    Signatures are split in bands for an LSH lookup: texts that share a band are the candidates for a similarity
+    check. A long text is represented by a sample of its shingles, the max_shingles with the smallest hashes,
+    so its signature costs the same as a short one's and a change anywhere in it still lowers the similarity
+    """
+    PRIME = (1 << 61) - 1
+
+    def __init__(self, num_hashes=64, bands=16, max_shingles=1000, seed=1):
+        rng = random.Random(seed)
+        self.params = [(rng.randrange(1, self.PRIME), rng.randrange(0, self.PRIME)) for _ in range(num_hashes)]
+        self.bands = bands
+        self.rows = num_hashes // bands
+        self.max_shingles = max_shingles
+
+    @staticmethod
+    def shingles(text):
+        words = content_words(text)
+        return set(words) | {f"{word} {next_word}" for word, next_word in zip(words, words[1:])}
+
+    def signature(self, text):
+        hashes = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'little')
+                  for shingle in self.shingles(text)]
+        if len(hashes) > self.max_shingles:
+            hashes = heapq.nsmallest(self.max_shingles, hashes)
+        prime = self.PRIME
+        return [min((a * value + b) % prime for value in hashes) for a, b in self.params]
+
+    def band_keys(self, signature):
+        rows = self.rows
+        return [(idx, tuple(signature[idx * rows:(idx + 1) * rows])) for idx in range(self.bands)]
+
+    @staticmethod
+    def similarity(signature, other):
+        return sum(1 for value, other_value in zip(signature, other) if value == other_value) / len(signature)
+
+
+class SimilarPrompt:
+    __slots__ = ('key', 'prompt', 'similarity')
+
+    def __init__(self, key, prompt, similarity):
+        self.key = key
+        self.prompt = prompt
+        self.similarity = similarity
+
+
+class SimilarPromptCache:
+    """
+    Second cache tier, for prompts that ask the same as a cached one in other words ("how can I" or "how do I"),
+    or differ from it in case, punctuation, spacing or a few words of a long prompt.
+    Each entry maps the MinHash signature of a normalized prompt to the key of its response in the ResponseCache.
+    Entries are scoped by model, temperature and the preceding context, so only a near duplicate question
+    asked in the same context is matched. Entries expire after ttl seconds, and the least recently used
+    are evicted past max_entries. The index is kept in a file in the cache folder: a journal of json lines that
+    entries are appended to (or a removed key), rewritten with just the entries when it grows past twice their count
+    """
+    MIN_PROMPT_CHARS = 16  # shorter prompts ("yes", "go on") say too little to be matched
+    SIGNATURE_VERSION = 2  # entries with signatures of another shingling are dropped when the index is loaded
+
+    def __init__(self, response_cache, threshold=0.8, max_entries=500, ttl=7 * 24 * 3600):
+        self.response_cache = response_cache
+        self.path = os.path.join(response_cache.path, "similar_prompts.index")  # not a .json response entry
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.minhash = MinHash()
+        self.entries = None  # key -> entry, least recently used first
+        self.buckets = {}  # (scope, band) -> keys
+        self.journal_lines = 0
+        self.last_signature = None  # (normalized prompt, signature) of the last lookup, the prompt added next
+        self.lookups = 0
+        self.offered = 0
+        self.used = 0
+
+    @staticmethod
+    def scope(model, temperature, context):
+        return ResponseCache.key(model, temperature, context)
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        self.entries = OrderedDict()
+        self.journal_lines = 0
+        rewrite = False  # so records aren't appended to a line without its line end
+        stale = False
+        try:
+            with open(self.path) as fp:
+                for line in fp:
+                    self.journal_lines += 1
+                    rewrite = not line.endswith("\n")
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    if isinstance(record, list) or \
+                            ('remove' not in record and record.get('version') != self.SIGNATURE_VERSION):
+                        stale = True  # written by an earlier version, its signatures can't be compared
+                    elif 'remove' in record:
+                        if record['remove'] in self.entries:
+                            self._remove(record['remove'])
+                    else:
+                        self._insert(record)
+        except OSError:
+            pass
+        self._expire()
+        if rewrite or stale:
+            self._rewrite()
+
+    def _insert(self, entry):
+        if entry['key'] in self.entries:
+            self._remove(entry['key'])
+        self.entries[entry['key']] = entry
+        for band in self.minhash.band_keys(entry['signature']):
+            self.buckets.setdefault((entry['scope'], band), set()).add(entry['key'])
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        for band in self.minhash.band_keys(entry['signature']):
+            bucket = self.buckets.get((entry['scope'], band))
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[(entry['scope'], band)]
+
+    def _expire(self):
+        expired = time.time() - self.ttl
+        for key in [key for key, entry in self.entries.items() if entry['time'] < expired]:
+            self._remove(key)
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+
+    def _rewrite(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as fp:
+                for entry in self.entries.values():
+                    fp.write(json.dumps(entry, separators=(',', ':')) + "\n")
+            os.replace(tmp_path, self.path)
+            self.journal_lines = len(self.entries)
+        except OSError:
+            pass
+
+    def _append(self, record):
+        """
+        Add a record to the journal, or rewrite it with the current entries when it has grown too long
+        """
+        try:
+            if not os.path.exists(self.response_cache.path):
+                os.makedirs(self.response_cache.path)
+        except OSError:
+            return
+        if self.journal_lines >= 2 * max(len(self.entries), self.max_entries):
+            self._rewrite()
+            return
+        try:
+            with open(self.path, 'a') as fp:
+                fp.write(json.dumps(record, separators=(',', ':')) + "\n")
+            self.journal_lines += 1
+        except OSError:
+            pass
+
+    def _signature(self, normalized):
+        if self.last_signature is None or self.last_signature[0] != normalized:
+            self.last_signature = (normalized, self.minhash.signature(normalized))
+        return self.last_signature[1]
+
+    def add(self, scope, prompt, key):
+        normalized = normalize_prompt(prompt)
+        if len(normalized) < self.MIN_PROMPT_CHARS:
+            return
+        self._load()
+        entry = {"key": key, "scope": scope, "prompt": prompt.strip()[:200], "time": time.time(),
+                 "version": self.SIGNATURE_VERSION, "signature": self._signature(normalized)}
+        self._insert(entry)
+        self._expire()
+        self._append(entry)
+
+    def lookup(self, scope, prompt):
+        """
+        The most similar cached prompt at or above the threshold, or None
+        """
+        normalized = normalize_prompt(prompt)
+        if len(normalized) < self.MIN_PROMPT_CHARS:
+            return None
+        self._load()
+        self._expire()
+        self.lookups += 1
+        signature = self._signature(normalized)
+        candidates = set()
+        for band in self.minhash.band_keys(signature):
+            candidates |= self.buckets.get((scope, band), set())
+        best = None
+        for key in candidates:
+            entry = self.entries[key]
+            similarity = MinHash.similarity(signature, entry['signature'])
+            if similarity >= self.threshold and (best is None or similarity > best.similarity):
+                best = SimilarPrompt(key, entry['prompt'], similarity)
+        if best is not None:
+            self.offered += 1
+        return best
+
+    def get(self, match):
+        """
+        The cached response of a match the user accepted
+        """
+        stream = self.response_cache.read(match.key)
+        if stream is None:
+            self._remove(match.key)  # evicted from the response cache
+            self._append({"remove": match.key})
+            return None
+        self.entries.move_to_end(match.key)
+        self.used += 1
+        return stream
+
+    def clear(self):
+        self._load()
+        self.entries.clear()
+        self.buckets.clear()
+        self.journal_lines = 0
+        self.lookups = self.offered = self.used = 0
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def stats(self):
+        self._load()
+        hit_rate = 100 * self.used / self.lookups if self.lookups else 0
+        return f"Similar prompts: {len(self.entries)} entries, {self.offered} offered and {self.used} used " \
+               f"/ {self.lookups} lookups ({hit_rate:.0f}%)"
@@ -0,0 +1,125 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from gpterm.metrics import RequestMetrics
+from gpterm.utils import alias_for_model
+
+
+class ModelAnswer:
+    """
+    State of one model's streamed answer, written by its worker thread and read by the display
+    """
+    def __init__(self, model, prompt_tokens):
+        self.model = model
+        self.metrics = RequestMetrics(model, prompt_tokens)
+        self.chunks = []
+        self.completion = None
+        self.done = False
+        self.error = None
+
+    def text(self):
+        return ''.join(self.chunks).strip()
+
+
+class ModelComparison:
+    """
+    Sends the same prompt to several models at once and streams their answers side by side, each in its own panel,
+    with the time to first token, total latency and token usage of each model
+    """
+    def __init__(self, gpterm, models, prompt):
+        self.gpterm = gpterm
+        self.models = models
+        self.prompt = prompt
+        self.answers = []
+        self.stopped = threading.Event()
+
+    def _stream(self, answer):
+        gpterm = self.gpterm
+        try:
+            answer.completion = gpterm.create_single_completion(
+                self.prompt, max_tokens=gpterm.max_tokens_for_prompt(self.prompt, answer.model), stream=True,
+                model=answer.model)
+            answer.metrics.on_connected()
+            is_chat = gpterm.is_chat_model(answer.model)
+            for obj in answer.completion:
+                if self.stopped.is_set():
+                    answer.completion.close()
+                    break
+                response = gpterm.get_chat_response(obj) if is_chat else gpterm.get_text_response(obj)
+                if response is None:
+                    continue
+                answer.metrics.on_token()
+                answer.chunks.append(response)
+            answer.metrics.finish()
+        except Exception as e:
+            answer.error = str(e) or type(e).__name__
+            answer.metrics.finish(error=e)
+        finally:
+            answer.done = True
+            if answer.metrics.connected is not None:
+                gpterm.add_usage(answer.model, answer.metrics.prompt_tokens, answer.metrics.num_tokens)
+
+    def _panels(self):
+        from rich.columns import Columns
+        from rich.panel import Panel
+        from rich.text import Text
+        colors = self.gpterm.colors
+        width = max(20, self.gpterm.console.width // len(self.answers) - 1)
+        panels = []
+        for answer in self.answers:
+            if answer.error:
+                body = Text(f"error: {answer.error}", style="bold red")
+            else:
+                body = Text(answer.text() or "...", style=colors.cresponse)
+            panels.append(Panel(body, title=alias_for_model(answer.model), subtitle=self._summary(answer),
+                                width=width, border_style=colors.cinfo))
+        return Columns(panels)
+
+    @staticmethod
+    def _summary(answer):
+        record = answer.metrics.to_dict()
+        if record['ttft_ms'] is None:
+            return "waiting" if not answer.done else ""
+        total = f", total {record['total_ms'] / 1000:.1f}s" if answer.done and record['total_ms'] is not None else ""
+        return f"first token {record['ttft_ms'] / 1000:.2f}s{total}"
+
+    def report(self):
+        from rich.table import Table
+        table = Table(title="Model comparison", title_style=self.gpterm.colors.cinfo)
+        for column in ["model", "first token", "total", "prompt tokens", "completion tokens", "tokens/s"]:
+            table.add_column(column, justify="left" if column == "model" else "right")
+        for answer in self.answers:
+            record = answer.metrics.to_dict()
+            table.add_row(alias_for_model(answer.model), self._seconds(record['ttft_ms']),
+                          self._seconds(record['total_ms']), str(record['prompt_tokens']),
+                          str(record['completion_tokens']),
+                          "-" if record['tokens_per_s'] is None else f"{record['tokens_per_s']:.1f}")
+        return table
+
+    @staticmethod
+    def _seconds(ms):
+        return "-" if ms is None else f"{ms / 1000:.2f}s"
+
+    def run(self):
+        from rich.live import Live
+        gpterm = self.gpterm
+        self.answers = [ModelAnswer(model, gpterm.text_to_tokens(self.prompt, model)) for model in self.models]
+        refresh_per_second = max(1, gpterm.cfg.render_fps)
+        with ThreadPoolExecutor(max_workers=len(self.answers)) as pool:
+            for answer in self.answers:
+                pool.submit(self._stream, answer)
+            try:
+                with Live(self._panels(), console=gpterm.console, refresh_per_second=refresh_per_second,
+                          vertical_overflow="visible") as live:
+                    while not all(answer.done for answer in self.answers):
+                        time.sleep(1 / refresh_per_second)
+                        live.update(self._panels())
+                    live.update(self._panels())
+            except KeyboardInterrupt:
+                self.stopped.set()
+                for answer in self.answers:
+                    if answer.completion is not None:
+                        answer.completion.close()
+                raise
+        gpterm.console.print()
+        gpterm.console.print(self.report())
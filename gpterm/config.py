@@ -2,11 +2,15 @@ import os
 import yaml
 from gpterm.enums import ThemeMode, VoiceStop
 from gpterm.utils import model_from_alias
+from gpterm.models import ModelInfo
 
 
 class Config:
     DEFAULT_CONFIG_PATH = os.path.expanduser("~/.config/gpterm/config.yaml")
     DEFAULT_IMAGE_STORE_PATH = "/var/tmp/gpterm/generated_images"
+    DEFAULT_CACHE_PATH = os.path.expanduser("~/.cache/gpterm/responses")
+    DEFAULT_SESSION_DB_PATH = os.path.expanduser("~/.local/share/gpterm/sessions.db")
+    DEFAULT_USAGE_DB_PATH = os.path.expanduser("~/.local/share/gpterm/usage.db")
 
     def __init__(self, file_path):
         self.file_path = file_path
@@ -17,11 +21,46 @@ class Config:
         self.voice_name = 'Karen'
         self.voice_over = False
         self.voice_stop = VoiceStop.period
+        self.voice_command = None  # speak with this command instead of macOS 'say', e.g. 'espeak'
         self.image_size = 256
         self.image_view = True
         self.image_store = Config.DEFAULT_IMAGE_STORE_PATH
         self.model = model_from_alias('chatgpt')
         self.temperature = 0.75
+        self.response_tokens = 512  # tokens kept free for a response before old messages are dropped
+        self.context_summary = False
+        self.render_fps = 30  # max screen updates per second while streaming a response. 0 to print every chunk
+        self.requests_per_minute = 0  # rate limits of the OpenAI account, requests are spaced to stay within them
+        self.tokens_per_minute = 0  # 0 for no limit
+        self.max_retries = 5  # retries of rate limited or failed requests
+        self.connect_timeout = 10  # seconds
+        self.read_timeout = 180  # seconds to wait for a response, or between chunks of a streamed response
+        self.use_cache = True
+        self.cache_any_temperature = False  # by default only responses for temperature 0 are cached
+        self.cache_path = Config.DEFAULT_CACHE_PATH
+        self.cache_max_entries = 1000
+        self.cache_max_mb = 50
+
+        self.hedge_requests = False  # send a duplicate request when the first token is late, the first to answer is used
+        self.hedge_percentile = 95  # the first token is late past this percentile of recent first token times
+        self.hedge_delay = 3.0  # seconds to wait for the first token before there are enough samples for the percentile
+        self.stream_resumes = 3  # times a dropped response stream is continued with a new request. 0 to disable
+        self.file_workers = 4  # requests run at the same time for the parts of a /file
+        self.file_chunk_tokens = 1500  # max tokens of each part of a /file
+        self.save_sessions = True  # keep chat sessions on disk for /resume
+        self.session_db_path = Config.DEFAULT_SESSION_DB_PATH
+        self.use_retrieval = False  # send only the turns relevant to the prompt (and the most recent ones) instead of the whole context
+        self.retrieval_top_k = 4  # earlier turns picked by relevance to the prompt, each sent with its prompt or response
+        self.retrieval_recent_turns = 4  # most recent turns always sent
+        self.use_similar_cache = True  # offer the cached response of a near duplicate prompt (the cache is used at temperature 0 by default)
+        self.similar_cache_threshold = 0.8  # similarity (0 to 1) of a prompt to a cached one for its response to be offered
+        self.similar_cache_max_entries = 500
+        self.similar_cache_ttl_hours = 168
+        self.models = {}  # model name -> capabilities that differ from gpterm/models.py: context_window, chat, tokenizer, prompt_price, completion_price ($ per 1k tokens), max_output
+        self.track_usage = True  # keep the tokens and cost of each request for /usage
+        self.usage_db_path = Config.DEFAULT_USAGE_DB_PATH
+        self.daily_soft_budget = 0.0  # $ per day: warn when it is passed. 0 for none
+        self.daily_hard_budget = 0.0  # $ per day: requests are blocked once it is reached. 0 for none
 
     def load(self):
         if os.path.exists(self.file_path):
@@ -38,15 +77,71 @@ class Config:
                     self.voice_over = loaded_cfg.get('voice_over', self.voice_over)
                     if 'voice_stop' in loaded_cfg:
                         self.voice_stop = VoiceStop[loaded_cfg['voice_stop']]
+                    self.voice_command = loaded_cfg.get('voice_command', self.voice_command)
                     self.image_size = loaded_cfg.get('image_size', self.image_size)
                     self.image_view = loaded_cfg.get('image_view', self.image_view)
                     self.image_store = loaded_cfg.get('image_store', self.image_store)
                     if 'model' in loaded_cfg:
                         self.model = model_from_alias(loaded_cfg['model'])
                     self.temperature = loaded_cfg.get('temperature', self.temperature)
+                    self.response_tokens = loaded_cfg.get('response_tokens', self.response_tokens)
+                    self.context_summary = loaded_cfg.get('context_summary', self.context_summary)
+                    self.render_fps = loaded_cfg.get('render_fps', self.render_fps)
+                    self.requests_per_minute = loaded_cfg.get('requests_per_minute', self.requests_per_minute)
+                    self.tokens_per_minute = loaded_cfg.get('tokens_per_minute', self.tokens_per_minute)
+                    self.max_retries = loaded_cfg.get('max_retries', self.max_retries)
+                    self.connect_timeout = loaded_cfg.get('connect_timeout', self.connect_timeout)
+                    self.read_timeout = loaded_cfg.get('read_timeout', self.read_timeout)
+                    self.use_cache = loaded_cfg.get('use_cache', self.use_cache)
+                    self.cache_any_temperature = loaded_cfg.get('cache_any_temperature', self.cache_any_temperature)
+                    self.cache_path = loaded_cfg.get('cache_path', self.cache_path)
+                    self.cache_max_entries = loaded_cfg.get('cache_max_entries', self.cache_max_entries)
+                    self.cache_max_mb = loaded_cfg.get('cache_max_mb', self.cache_max_mb)
+                    self.hedge_requests = loaded_cfg.get('hedge_requests', self.hedge_requests)
+                    self.hedge_percentile = loaded_cfg.get('hedge_percentile', self.hedge_percentile)
+                    self.hedge_delay = loaded_cfg.get('hedge_delay', self.hedge_delay)
+                    self.stream_resumes = loaded_cfg.get('stream_resumes', self.stream_resumes)
+                    self.file_workers = loaded_cfg.get('file_workers', self.file_workers)
+                    self.file_chunk_tokens = loaded_cfg.get('file_chunk_tokens', self.file_chunk_tokens)
+                    self.save_sessions = loaded_cfg.get('save_sessions', self.save_sessions)
+                    self.session_db_path = loaded_cfg.get('session_db_path', self.session_db_path)
+                    self.use_retrieval = loaded_cfg.get('use_retrieval', self.use_retrieval)
+                    self.retrieval_top_k = loaded_cfg.get('retrieval_top_k', self.retrieval_top_k)
+                    self.retrieval_recent_turns = loaded_cfg.get('retrieval_recent_turns', self.retrieval_recent_turns)
+                    self.use_similar_cache = loaded_cfg.get('use_similar_cache', self.use_similar_cache)
+                    self.similar_cache_threshold = loaded_cfg.get('similar_cache_threshold', self.similar_cache_threshold)
+                    self.similar_cache_max_entries = loaded_cfg.get('similar_cache_max_entries', self.similar_cache_max_entries)
+                    self.similar_cache_ttl_hours = loaded_cfg.get('similar_cache_ttl_hours', self.similar_cache_ttl_hours)
+                    self.models = self.load_models(loaded_cfg.get('models', self.models))
+                    self.track_usage = loaded_cfg.get('track_usage', self.track_usage)
+                    self.usage_db_path = loaded_cfg.get('usage_db_path', self.usage_db_path)
+                    self.daily_soft_budget = loaded_cfg.get('daily_soft_budget', self.daily_soft_budget)
+                    self.daily_hard_budget = loaded_cfg.get('daily_hard_budget', self.daily_hard_budget)
             except Exception as e:
                 print(f"Error loading {self.file_path}: {e}")
 
+    def load_models(self, models):
+        """
+        The entries of the models section that can be used, an entry with an unknown field is reported and ignored
+        """
+        if not isinstance(models, dict):
+            print(f"Error loading {self.file_path}: models should map model names to their capabilities")
+            return {}
+        fields = set(ModelInfo.__slots__) - {'name'}
+        valid = {}
+        for name, capabilities in models.items():
+            if capabilities is None:
+                capabilities = {}
+            if not isinstance(capabilities, dict):
+                print(f"Error loading {self.file_path}: capabilities of model {name} should be a mapping")
+                continue
+            unknown = set(capabilities) - fields
+            if unknown:
+                print(f"Error loading {self.file_path}: unknown fields for model {name}: {', '.join(sorted(map(str, unknown)))}")
+                continue
+            valid[name] = capabilities
+        return valid
+
     def save(self):
         yaml_dict = {'color_theme': self.color_theme.name,
                      'use_code_format': self.use_code_format,
@@ -55,11 +150,45 @@ class Config:
                      'voice_name': self.voice_name,
                      'voice_over': self.voice_over,
                      'voice_stop': self.voice_stop.name,
+                     'voice_command': self.voice_command,
                      'image_size': self.image_size,
                      'image_view': self.image_view,
                      'image_store': self.image_store,
                      'model': self.model,
                      'temperature': self.temperature,
+                     'response_tokens': self.response_tokens,
+                     'context_summary': self.context_summary,
+                     'render_fps': self.render_fps,
+                     'requests_per_minute': self.requests_per_minute,
+                     'tokens_per_minute': self.tokens_per_minute,
+                     'max_retries': self.max_retries,
+                     'connect_timeout': self.connect_timeout,
+                     'read_timeout': self.read_timeout,
+                     'use_cache': self.use_cache,
+                     'cache_any_temperature': self.cache_any_temperature,
+                     'cache_path': self.cache_path,
+                     'cache_max_entries': self.cache_max_entries,
+                     'cache_max_mb': self.cache_max_mb,
+                     'hedge_requests': self.hedge_requests,
+                     'hedge_percentile': self.hedge_percentile,
+                     'hedge_delay': self.hedge_delay,
+                     'stream_resumes': self.stream_resumes,
+                     'file_workers': self.file_workers,
+                     'file_chunk_tokens': self.file_chunk_tokens,
+                     'save_sessions': self.save_sessions,
+                     'session_db_path': self.session_db_path,
+                     'use_retrieval': self.use_retrieval,
+                     'retrieval_top_k': self.retrieval_top_k,
+                     'retrieval_recent_turns': self.retrieval_recent_turns,
+                     'use_similar_cache': self.use_similar_cache,
+                     'similar_cache_threshold': self.similar_cache_threshold,
+                     'similar_cache_max_entries': self.similar_cache_max_entries,
+                     'similar_cache_ttl_hours': self.similar_cache_ttl_hours,
+                     'models': self.models,
+                     'track_usage': self.track_usage,
+                     'usage_db_path': self.usage_db_path,
+                     'daily_soft_budget': self.daily_soft_budget,
+                     'daily_hard_budget': self.daily_hard_budget,
                      }
 
         cfg_folder = os.path.dirname(self.file_path)
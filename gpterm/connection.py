@@ -0,0 +1,56 @@
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class KeepAliveSession(requests.Session):
+    """
+    A requests session shared by all API calls and image downloads, so connections (and their TLS handshakes)
+    are reused between requests. openai recycles its sessions by closing them every few minutes,
+    so close() keeps the pooled connections open
+    """
+    def __init__(self, connect_timeout=10, read_timeout=180, pool_size=10):
+        super().__init__()
+        self.timeout = (connect_timeout, read_timeout)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.cold_request_ms = None  # request on a new connection
+        self.warm_request_ms = None  # same request on the reused connection
+
+    def request(self, method, url, **kwargs):
+        kwargs['timeout'] = self.timeout
+        return super().request(method, url, **kwargs)
+
+    def close(self):
+        pass
+
+    def close_connections(self):
+        super().close()
+
+    def warm_up(self, url):
+        """
+        Open a connection to url in the background, so the first request doesn't pay for the handshake
+        """
+        thread = threading.Thread(target=self._warm_up, args=(url,), daemon=True)
+        thread.start()
+        return thread
+
+    def _warm_up(self, url):
+        try:
+            start = time.perf_counter()
+            self.head(url)
+            self.cold_request_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            self.head(url)
+            self.warm_request_ms = (time.perf_counter() - start) * 1000
+        except requests.RequestException:
+            pass
+
+    def warm_up_summary(self):
+        if self.cold_request_ms is None or self.warm_request_ms is None:
+            return "connection warm up: not done"
+        saved_ms = self.cold_request_ms - self.warm_request_ms
+        return f"connection warm up: new connection {self.cold_request_ms:.0f} ms, " \
+               f"reused connection {self.warm_request_ms:.0f} ms (~{saved_ms:.0f} ms saved per request)"
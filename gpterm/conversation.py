@@ -0,0 +1,162 @@
+import threading
+from gpterm.enums import Role
+from gpterm.tokens import prompt_overhead
+
+
+class Turn:
+    __slots__ = ('role', 'chunks', 'tokens', 'has_content', 'seq', 'stored')
+
+    def __init__(self, role):
+        self.role = role
+        self.chunks = []
+        self.tokens = 0
+        self.has_content = False  # has text other than whitespace, so it is sent as a message
+        self.seq = None  # position in the stored session, once written to the session store
+        self.stored = False  # all its text is written to the session store
+
+    def text(self):
+        if len(self.chunks) > 1:
+            self.chunks = [''.join(self.chunks)]
+        return self.chunks[0] if self.chunks else ""
+
+
+class Conversation:
+    """
+    The chat context kept as a list of turns. Streamed text is appended to the current turn as chunks,
+    the full text is only joined when a request payload or a rendering is needed
+    """
+    SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+
+    def __init__(self, token_ledger):
+        self.token_ledger = token_ledger
+        self.turns = []
+        self.pinned = 0  # number of leading turns that are never evicted
+        self.summary = ""
+        self.summary_tokens = 0
+        self.num_content_turns = 0  # turns with content, kept up to date so counting messages doesn't walk the turns
+        self.generation = 0  # incremented on reset, so a late summary of a dropped context is ignored
+        self.summary_lock = threading.Lock()
+
+    def reset(self, model=None):
+        self.turns = []
+        self.pinned = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        self.num_content_turns = 0
+        self.generation += 1
+        self.token_ledger.reset(model)
+
+    def add(self, text, role, new_turn=False):
+        """
+        Append text to the last turn if it has the same role, else (or with new_turn) start a turn
+        """
+        if not text:
+            return
+        if new_turn or not self.turns or self.turns[-1].role != role:
+            self.turns.append(Turn(role))
+        turn = self.turns[-1]
+        turn.chunks.append(text)
+        turn.tokens += self.token_ledger.add(text)
+        turn.stored = False
+        if not turn.has_content and not text.isspace():
+            turn.has_content = True
+            self.num_content_turns += 1
+
+    def restore(self, turns, pinned=0):
+        """
+        Replace the context with turns of a stored session, that were already counted: (role, text, tokens, seq)
+        tuples, seq is the position of the turn in the session
+        """
+        self.reset()
+        for role, text, tokens, seq in turns:
+            turn = Turn(role)
+            turn.chunks.append(text)
+            turn.tokens = tokens
+            turn.has_content = bool(text.strip())
+            turn.seq = seq
+            turn.stored = True
+            self.num_content_turns += turn.has_content
+            self.turns.append(turn)
+            self.token_ledger.add_counted(tokens)
+        self.pinned = pinned
+
+    def unstored_turns(self):
+        """
+        Completed turns that were not written to the session store yet, or that had text added since (their seq
+        is set). They are marked as stored by the caller once written.
+        A trailing prompt may still grow (its request failed and the next prompt is added to it), so it waits
+        """
+        end = len(self.turns)
+        if end and self.turns[-1].role == Role.user:
+            end -= 1
+        return [turn for turn in self.turns[:end] if not turn.stored]
+
+    def pin(self):
+        self.pinned = len(self.turns)
+
+    def set_summary(self, summary, generation):
+        if generation != self.generation:
+            return
+        self.summary = summary
+        self.summary_tokens = self.token_ledger.count(self.SUMMARY_HEADER + summary) if summary else 0
+
+    def evict(self, max_prompt_tokens):
+        """
+        Drop the oldest (unpinned) turns until the prompt fits in max_prompt_tokens. The last turn is always kept
+        Returns the dropped turns
+        """
+        end = self.pinned
+        removed_tokens = removed_messages = 0
+        while end < len(self.turns) - 1:
+            # the prompt size without the turns up to end, computed from the running counts
+            num_messages = self.num_messages() - removed_messages
+            prompt_tokens = self.token_ledger.prompt_tokens(num_messages) - removed_tokens + self.summary_tokens
+            # don't leave a response without the prompt it answered
+            if prompt_tokens <= max_prompt_tokens and (end == self.pinned or self.turns[end].role != Role.assistant):
+                break
+            removed_tokens += self.turns[end].tokens
+            removed_messages += self.turns[end].has_content
+            end += 1
+        evicted = self.turns[self.pinned:end]
+        del self.turns[self.pinned:end]
+        self.token_ledger.remove(removed_tokens)
+        self.num_content_turns -= removed_messages
+        return evicted
+
+    def num_messages(self, turns=None):
+        """
+        turns: a selection of the turns to send (see ContextRetriever), all of them by default
+        """
+        if turns is None:
+            num_messages = self.num_content_turns
+        else:
+            num_messages = sum(1 for turn in turns if turn.has_content)
+        return num_messages + (1 if self.summary else 0)
+
+    def prompt_tokens(self, turns=None):
+        if turns is None:
+            return self.token_ledger.prompt_tokens(self.num_messages()) + self.summary_tokens
+        return prompt_overhead(self.token_ledger.model, self.num_messages(turns)) + \
+            sum(turn.tokens for turn in turns) + self.summary_tokens
+
+    def messages(self, turns=None):
+        messages = []
+        if self.summary:
+            messages.append({"role": Role.system.value, "content": self.SUMMARY_HEADER + self.summary})
+        for turn in self.turns if turns is None else turns:
+            content = turn.text().strip()
+            if content:
+                messages.append({"role": turn.role.value, "content": content})
+        return messages
+
+    def text(self, turns=None):
+        text = ''.join(turn.text() for turn in (self.turns if turns is None else turns))
+        if self.summary:
+            text = f"{self.SUMMARY_HEADER}{self.summary}\n{text}"
+        return text
+
+    def __len__(self):
+        return len(self.turns)
+
+    def __str__(self):
+        return self.text()
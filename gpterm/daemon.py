@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import socket
+import socketserver
+
+DEFAULT_SOCKET_PATH = os.path.expanduser("~/.cache/gpterm/daemon.sock")
+
+# Protocol: the client sends one json line {"prompt": ...}, the daemon streams back json lines
+# {"delta": ...} followed by {"done": true}, or {"error": ...}
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return  # a liveness check from connect()
+        try:
+            request = json.loads(line)
+            for delta in self.server.gpterm.stream_prompt(request['prompt']):
+                self.send({"delta": delta})
+            self.send({"done": True})
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client went away
+        except Exception as e:
+            self.send({"error": str(e) or type(e).__name__})
+
+    def send(self, message):
+        self.wfile.write((json.dumps(message) + "\n").encode())
+        self.wfile.flush()
+
+
+class GptermDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Keeps a warm GptTerminal (tokenizer, http session, caches) and serves one-shot prompts over a unix socket
+    """
+    daemon_threads = True
+
+    def __init__(self, gpterm, socket_path=DEFAULT_SOCKET_PATH):
+        self.gpterm = gpterm
+        self.socket_path = socket_path
+        socket_dir = os.path.dirname(socket_path)
+        if socket_dir and not os.path.exists(socket_dir):
+            os.makedirs(socket_dir, mode=0o700)
+        if os.path.exists(socket_path):
+            if connect(socket_path):
+                raise RuntimeError(f"gpterm daemon is already running at {socket_path}")
+            os.remove(socket_path)  # left over from a daemon that didn't shut down cleanly
+        super().__init__(socket_path, DaemonRequestHandler)
+
+    def server_bind(self):
+        super().server_bind()
+        # the socket gives access to the API key, keep it private to the user. Clients can't connect before
+        # the server listens, after this
+        os.chmod(self.socket_path, 0o600)
+
+    def serve(self):
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def connect(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def run_client(prompt, socket_path=DEFAULT_SOCKET_PATH):
+    """
+    Send a prompt to a running daemon and stream the response to stdout
+    Returns the exit code, or None if no daemon is running
+    """
+    sock = connect(socket_path)
+    if sock is None:
+        return None
+    done = False
+    with sock, sock.makefile('rwb') as stream:
+        try:
+            stream.write((json.dumps({"prompt": prompt}) + "\n").encode())
+            stream.flush()
+            for line in stream:
+                message = json.loads(line)
+                if 'delta' in message:
+                    sys.stdout.write(message['delta'])
+                    sys.stdout.flush()
+                elif 'error' in message:
+                    sys.stderr.write(f"gpterm: {message['error']}\n")
+                    return 1
+                elif message.get('done'):
+                    done = True
+                    break
+        except (OSError, ValueError):
+            pass  # reported below, like a connection closed early
+    sys.stdout.write("\n")
+    if not done:
+        sys.stderr.write("gpterm: the daemon closed the connection before the response was complete\n")
+        return 1
+    return 0
+
+
+def run_local(gpterm, prompt):
+    """
+    Same as run_client, without a daemon
+    """
+    try:
+        for delta in gpterm.stream_prompt(prompt):
+            sys.stdout.write(delta)
+            sys.stdout.flush()
+    except Exception as e:
+        sys.stderr.write(f"gpterm: {str(e) or type(e).__name__}\n")
+        return 1
+    sys.stdout.write("\n")
+    return 0
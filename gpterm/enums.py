@@ -35,3 +35,9 @@ class ThemeColors(NamedTuple):
 class VoiceStop(enum.Enum):
     period = 0
     newline = 1
+
+
+class Role(enum.Enum):
+    system = 'system'
+    user = 'user'
+    assistant = 'assistant'
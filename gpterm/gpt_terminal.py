@@ -5,52 +5,82 @@ import sys
 import math
 import time
 import datetime
-import openai
+import threading
 import argparse
-import tiktoken
-import pkg_resources
-from rich.prompt import Prompt
-from rich import print
-from rich.console import Console
-from rich.syntax import Syntax
 from collections import namedtuple
-from urllib import request
+from gpterm import startup_time
 from gpterm.config import Config
 from gpterm.shell import ShellHandler
-from gpterm.enums import ThemeColors, Colors, ThemeMode, VoiceStop
-from gpterm.utils import alias_for_model
+from gpterm.enums import ThemeColors, Colors, ThemeMode, VoiceStop, Role
+from gpterm.utils import alias_for_model, gpterm_version, StartupProfile
+from gpterm.tokens import TokenLedger, prompt_overhead, encoding_for_model
+from gpterm.conversation import Conversation
+from gpterm.retrieval import ContextRetriever
+from gpterm.models import ModelRegistry
+from gpterm.render import StreamRenderer
+from gpterm.voice import VoiceEngine, voice_backend_for_config
+from gpterm.cache import ResponseCache, SimilarPromptCache
+from gpterm.scheduler import RequestScheduler
+from gpterm.hedging import RequestHedger
+from gpterm.resume import ResumableStream
+from gpterm.sessions import SessionStore, HIGHLIGHT_START, HIGHLIGHT_END
+from gpterm.usage import UsageLedger, BudgetExceeded
+from gpterm.metrics import MetricsRecorder
+from gpterm.recording import StreamRecorder, ReplayStream, read_recording
+from gpterm.daemon import GptermDaemon, DEFAULT_SOCKET_PATH, run_client, run_local
 
 
 class GptTerminal:
-    def __init__(self, debug=False, theme=None, api_key=None, api_key_path='~/.openai-api-key'):
+    def __init__(self, debug=False, theme=None, api_key=None, api_key_path='~/.openai-api-key', startup_profile=False,
+                 metrics_path=None, record_path=None, config=None, warm_up_connection=True):
+        """
+        config: a Config to use instead of loading ~/.config/gpterm/config.yaml (benchmarks and tests).
+        warm_up_connection: open the connection to the API in the background at startup
+        """
+        self.startup = StartupProfile(startup_time, enabled=startup_profile)
+        self.startup.mark("gpterm modules imported")
         self.debug = debug
         self.api_key = api_key
         self.api_key_path = os.path.abspath(os.path.expanduser(os.path.expandvars(api_key_path)))
         self.shell = None
-        self.conversation = ""
-        self.conversation_formatted = ""
         self.prompt_idx = 0
         self.resp_line = ""
         self.resp_sentence = ""
         self.resp_start = True
         self.in_code_block = False
+        self.in_code_fence_info = False
         self.prompt = ""
         self.prompt_input = ""
         self.first_sentence = True
         self.in_gpt_response = False
         self.abort_response = False
         self.after_reset = True
-        self.config_file_path = Config.DEFAULT_CONFIG_PATH
-        self.cfg = Config(self.config_file_path)
-        self.cfg.load()
+        if config is None:
+            self.config_file_path = Config.DEFAULT_CONFIG_PATH
+            self.cfg = Config(self.config_file_path)
+            with self.startup.phase("load config"):
+                self.cfg.load()
+        else:
+            self.config_file_path = config.file_path
+            self.cfg = config
+        self.warm_up_connection = warm_up_connection
         if theme:
             self.cfg.color_theme = ThemeMode[theme]
         self.colors = self.get_term_colors()
-        self._setup_openai()
-        self._setup_gpt()
-        self._setup_console()
-        self._setup_code_format()
-        self._setup_voice()
+        self.metrics = MetricsRecorder(metrics_path)
+        self.recorder = StreamRecorder(record_path) if record_path else None
+        # heavy modules (openai, tiktoken, rich, pygments) are imported on first use or in background threads
+        self._console = None
+        self._renderer = None
+        self._code_highlighter = None
+        with self.startup.phase("init"):
+            self._setup_openai()
+            self._setup_gpt()
+            self._setup_cache()
+            self._setup_sessions()
+            self._setup_usage()
+            self._setup_code_format()
+            self._setup_voice()
 
     def get_commands(self, advanced=False):
         Command = namedtuple('Command', ['advanced', 'setting', 'nargs', 'description'])
@@ -59,8 +89,20 @@ class GptTerminal:
             '/exit': Command(False, None, 0, "Exit GPTerm"),
             '/save': Command(False, None, 0, "Save current settings"),
             '/context': Command(False, None, 0, "Print the current chat context (conversation) to screen"),
-            '/reset': Command(False, None, 0, "Reset the chat context"),
+            '/reset': Command(False, None, 0, "Reset the chat context (and start a new session)"),
+            '/sessions': Command(False, None, 0, "List the recent chat sessions"),
+            '/resume': Command(False, None, 1, "Resume a chat session: /resume <id> (default: the last one)"),
+            '/search': Command(False, None, 1, "Search the saved chat sessions: /search <terms> (term* for a prefix)"),
+            '/cache': Command(False, None, 1, "Show response cache hit rates (exact and similar prompts). '/cache clear' to empty it"),
+            '/stats': Command(False, None, 0, "Show latency and throughput of the last request and the session"),
+            '/usage': Command(False, None, 0, "Show the tokens used and their cost today, in the session and per model"),
+            '/compare': Command(True, None, 2, "Send a prompt to several models at once and compare their answers side by side. "
+                                               "format: /compare chatgpt,davinci [prompt] (default: the last prompt)"),
+            '/context-summary': Command(True, self.cfg.context_summary, 0, "Toggle summarizing messages dropped from a full chat context"),
+            '/hedge': Command(True, self.cfg.hedge_requests, 0, "Toggle sending a duplicate request when the first token is late"),
+            '/retrieval': Command(True, self.cfg.use_retrieval, 0, "Toggle sending only the turns relevant to the prompt and the most recent ones"),
             '/block': Command(False, None, 0, "Enter a multi-line input"),
+            '/file': Command(False, None, 2, "Ask about a file of any size: /file <path> [question] (default: summarize it)"),
             '/image': Command(False, None, 0, "Generate an image from a description using a DALL·E model"),
             '/theme': Command(False, self.cfg.color_theme, 0, "Toggle color theme to match background: light or dark"),
             '/code': Command(False, self.cfg.use_code_format, 0, "Toggle code format on/off (toggling will reset context)"),
@@ -72,7 +114,7 @@ class GptTerminal:
             '/voice-name': Command(True, self.cfg.voice_name, 1, "Set the voice to be used"),
             '/voice-over': Command(True, self.cfg.voice_over, 0, "Toggle voice over highlighting"),
             '/voice-stop': Command(True, self.cfg.voice_stop, 0, "Toggle voice stop: period or newline"),
-            '/model': Command(True, self.cfg.model, 1, "GPT Models. Possible options: chatgpt, davinci, curie, babbage, ada (or any custom trained model)"),
+            '/model': Command(True, self.cfg.model, 1, "GPT Models. Possible options: chatgpt, gpt4, davinci, curie, babbage, ada (or any model set up in the config)"),
             '/temperature': Command(True, self.cfg.temperature, 1, "Provide a value between 0 and 1. Higher for more diverse responses. Lower for more deterministic")
         }
         if advanced:
@@ -82,18 +124,48 @@ class GptTerminal:
 
     def _setup_gpt(self):
         self.stream = True
+        self.scheduler = RequestScheduler(requests_per_minute=self.cfg.requests_per_minute,
+                                          tokens_per_minute=self.cfg.tokens_per_minute,
+                                          max_retries=self.cfg.max_retries, on_retry=self.print_retry)
+        self.hedger = RequestHedger(pct=self.cfg.hedge_percentile, default_delay=self.cfg.hedge_delay)
+        self.models = ModelRegistry(self.cfg.models)
+        self.resolve_model()
+        self.token_ledger = TokenLedger(self.cfg.model)
+        threading.Thread(target=self._warm_tokenizer, daemon=True).start()
+        self.conversation = Conversation(self.token_ledger)
+        self.retriever = ContextRetriever(top_k=self.cfg.retrieval_top_k, recent=self.cfg.retrieval_recent_turns)
+        self.context_turns = None  # the turns sent with the current request when retrieval is on
+        self.tokens_saved = 0  # prompt tokens left out of the last request by retrieval
+        self.summary_directive = "Summarize the following conversation in a few sentences. " \
+                                 "Keep any facts, names and code details that may be referred to later"
+        self.summary_max_tokens = 256
+        self.resume_directive = "Your last message was cut off. Continue it exactly where it stopped, without repeating any of it"
         self.max_tokens = self.tokens_per_model()
 
+    def _setup_cache(self):
+        self.response_cache = ResponseCache(self.cfg.cache_path, max_entries=self.cfg.cache_max_entries,
+                                            max_mb=self.cfg.cache_max_mb)
+        self.similar_cache = SimilarPromptCache(self.response_cache, threshold=self.cfg.similar_cache_threshold,
+                                                max_entries=self.cfg.similar_cache_max_entries,
+                                                ttl=self.cfg.similar_cache_ttl_hours * 3600)
+
+    def _setup_sessions(self):
+        self.session_store = SessionStore(self.cfg.session_db_path) if self.cfg.save_sessions else None
+        self.session_id = None  # created when the first turn is stored
+        self.session_pinned = 0
+
+    def _setup_usage(self):
+        self.usage = UsageLedger(self.cfg.usage_db_path, soft_budget=self.cfg.daily_soft_budget,
+                                 hard_budget=self.cfg.daily_hard_budget) if self.cfg.track_usage else None
+
     def _setup_code_format(self):
         self.code_format_directive = "\nAny code snippet in your responses must be inside a code block. respond yes if you will comply"
         self.code_lang = "python"
         self.code_syntax_theme = 'github-dark'  # rich.syntax.DEFAULT_THEME
-        self.code_line_numbers = False
         self.code_block_idx = 0
 
     def _setup_voice(self):
-        self.stream_voiced_text = True
-        self.stream_text_delay = 0.005
+        self.voice_engine = VoiceEngine(voice_backend_for_config(self.cfg))
 
     def toggle_advanced(self):
         self.cfg.display_advanced = not self.cfg.display_advanced
@@ -120,19 +192,92 @@ class GptTerminal:
         self.colors = self.get_term_colors()
         return self.cfg.color_theme
 
+    def toggle_context_summary(self):
+        self.cfg.context_summary = not self.cfg.context_summary
+        return self.cfg.context_summary
+
+    def toggle_hedge_requests(self):
+        self.cfg.hedge_requests = not self.cfg.hedge_requests
+        return self.cfg.hedge_requests
+
+    def toggle_retrieval(self):
+        self.cfg.use_retrieval = not self.cfg.use_retrieval
+        self.tokens_saved = 0
+        self.update_shell_prompt()
+        return self.cfg.use_retrieval
+
     def toggle_code(self):
         self.cfg.use_code_format = not self.cfg.use_code_format
         return self.cfg.use_code_format
 
     def _setup_openai(self):
-        if self.api_key:
-            openai.api_key = self.api_key
-        elif os.path.exists(self.api_key_path):
-            openai.api_key_path = self.api_key_path
+        self.http_session = None
+        self.openai_error = None
+        self.openai_ready = threading.Event()
+        threading.Thread(target=self._init_openai, daemon=True).start()
 
-    def _setup_console(self):
-        Prompt.prompt_suffix = ''
-        self.console = Console()
+    def _init_openai(self):
+        try:
+            with self.startup.phase("import openai"):
+                import openai
+                from gpterm.connection import KeepAliveSession
+            if self.api_key:
+                openai.api_key = self.api_key
+            elif os.path.exists(self.api_key_path):
+                openai.api_key_path = self.api_key_path
+            self.http_session = KeepAliveSession(connect_timeout=self.cfg.connect_timeout,
+                                                 read_timeout=self.cfg.read_timeout)
+            openai.requestssession = self.http_session
+        except Exception as e:
+            self.openai_error = e
+        finally:
+            self.openai_ready.set()
+        if self.http_session and self.warm_up_connection:
+            with self.startup.phase("connection warm up"):
+                self.http_session.warm_up(openai.api_base).join()
+
+    @property
+    def openai(self):
+        self.openai_ready.wait()
+        if self.openai_error:
+            raise self.openai_error
+        import openai
+        return openai
+
+    @property
+    def console(self):
+        if self._console is None:
+            from rich.console import Console
+            self._console = Console()
+        return self._console
+
+    @property
+    def renderer(self):
+        if self._renderer is None:
+            self._renderer = StreamRenderer(self.console, fps=self.cfg.render_fps)
+            self._renderer.start()
+        return self._renderer
+
+    @property
+    def code_highlighter(self):
+        if self._code_highlighter is None:
+            from gpterm.highlight import CodeHighlighter
+            self._code_highlighter = CodeHighlighter(self.code_syntax_theme, default_language=self.code_lang)
+        return self._code_highlighter
+
+    def warm_up(self):
+        """
+        Load everything the background threads load at startup, and wait for it
+        """
+        self.openai_ready.wait()
+        self._warm_tokenizer()
+
+    def _warm_tokenizer(self):
+        with self.startup.phase("load tokenizer"):
+            try:
+                encoding_for_model(self.cfg.model)
+            except Exception:
+                pass  # reported when the tokenizer is used
 
     def get_term_colors(self):
         dark_theme = ThemeColors(title=Colors.magenta.value, info=Colors.blue.value, cinfo="#6973f6",
@@ -141,63 +286,109 @@ class GptTerminal:
                                   prompt=Colors.black.value, cmessage="#191846", cinput="bold #000099", cresponse="bold #ad1f98")
         return dark_theme if self.cfg.color_theme == ThemeMode.dark else light_theme
 
-    def tokens_per_model(self):
+    def resolve_model(self):
+        """
+        Look up the capabilities of the current model, when it is set. The response of each stream chunk
+        is read by the handler for its endpoint
+        """
+        self.model_info = self.models.get(self.cfg.model)
+        self.get_response = self.get_chat_response if self.model_info.chat else self.get_text_response
+
+    def get_model_info(self, model=None):
+        if model is None or model == self.model_info.name:
+            return self.model_info
+        return self.models.get(model)
+
+    def tokens_per_model(self, model=None):
         safety_gap = 10
-        model_alias = alias_for_model(self.cfg.model)
-        if model_alias in ['chatgpt', 'davinci']:
-            model_max_tokens = 4096
-        else:
-            model_max_tokens = 2048
-        return model_max_tokens - safety_gap
+        return self.get_model_info(model).context_window - safety_gap
 
-    def is_chat_model(self):
-        model_alias = alias_for_model(self.cfg.model)
-        return model_alias == 'chatgpt'
+    def is_chat_model(self, model=None):
+        return self.get_model_info(model).chat
+
+    def response_max_tokens(self, max_tokens, model=None):
+        max_output = self.get_model_info(model).max_output
+        return min(max_tokens, max_output) if max_output else max_tokens
 
     def calc_max_tokens(self):
         total = self.tokens_per_model()
-        self.max_tokens = total - self.text_to_tokens(self.prompt_input)
+        self.max_tokens = total - self.conversation.prompt_tokens()
 
-    def text_to_tokens(self, text):
-        num_tokens = 0
-        try:
-            encoding = tiktoken.encoding_for_model(self.cfg.model)
-        except KeyError:
-            encoding = tiktoken.get_encoding("cl100k_base")
-
-        if self.cfg.model.startswith('gpt-3.5-') or self.cfg.model.startswith('gpt-4-'):
-            num_tokens += 4 + 2  # tokens for message header ("role": "user", "content": ) + response header (assistant)
-
-        num_tokens += len(encoding.encode(text))
-        return num_tokens
+    def text_to_tokens(self, text, model=None):
+        if model and model != self.cfg.model:
+            return prompt_overhead(model) + len(encoding_for_model(model).encode(text, disallowed_special=()))
+        return prompt_overhead(self.cfg.model) + self.token_ledger.count(text)
 
     def update_max_tokens(self):
         self.calc_max_tokens()
+        if self.max_tokens < self.cfg.response_tokens:
+            # drop oldest messages to keep room for the response
+            evicted = self.conversation.evict(self.tokens_per_model() - self.cfg.response_tokens)
+            if evicted:
+                self.console.print(f"[bold red]*** reached max tokens. dropped {len(evicted)} oldest messages from chat context ***[/]")
+                if self.cfg.context_summary:
+                    self.summarize_context(evicted)
+                self.prompt_input = self.conversation.text()
+                self.calc_max_tokens()
         if self.max_tokens < 0:
             # reset context
             self.console.print(f"[bold red]*** reached max tokens. resetting chat context ***[/]")
             self.reset_context(prompt=self.prompt, submit=False)
         return self.max_tokens
 
+    def select_context(self):
+        """
+        With retrieval on, pick the turns sent with the prompt instead of the whole context
+        """
+        self.context_turns = None
+        self.tokens_saved = 0
+        if not self.cfg.use_retrieval:
+            return
+        turns = self.retriever.select(self.conversation, self.tokens_per_model() - self.cfg.response_tokens)
+        if len(turns) == len(self.conversation):
+            return
+        self.context_turns = turns
+        self.tokens_saved = self.conversation.prompt_tokens() - self.conversation.prompt_tokens(turns)
+        self.prompt_input = self.conversation.text(turns)
+
     def reset_context(self, prompt, submit):
         self.after_reset = True
         self.prompt = prompt
-        current_prompt = f"\n{self.prompt}\n" if self.prompt else ""
-        self.add_to_conversation(current_prompt, is_response=False, reset=True)
+        self.conversation.reset(self.cfg.model)
         if self.cfg.use_code_format:
             self.apply_code_format_directive(prompt=prompt, submit=submit)
-        self.prompt_input = self.conversation
+        elif prompt:
+            self.add_to_conversation(f"\n{prompt}\n", is_response=False)
+        self.prompt_input = self.conversation.text()
         self.calc_max_tokens()
         self.update_shell_prompt()
 
+    def summarize_context(self, evicted):
+        text = ''.join(turn.text() for turn in evicted)
+        thread = threading.Thread(target=self._summarize, args=(text, self.conversation.generation), daemon=True)
+        thread.start()
+
+    def _summarize(self, text, generation):
+        with self.conversation.summary_lock:
+            previous = self.conversation.summary
+            prompt = f"{self.summary_directive}\n\n{previous}\n{text}"
+            try:
+                summary = self.get_single_completion(prompt, max_tokens=self.summary_max_tokens, temperature=0)
+            except Exception as e:
+                if self.debug:
+                    self.console.print(f"[red]failed to summarize chat context: {e}[/]")
+                return
+            self.conversation.set_summary(summary.strip(), generation)
+
     def run(self):
         self.shell = ShellHandler()
-        gpterm_version = pkg_resources.get_distribution('gpterm').version
-        self.gpterm_intro = f"{self.colors.title}## GPTerm {gpterm_version} - Interact with a GPT model via a terminal\n" \
+        self.gpterm_intro = f"{self.colors.title}## GPTerm {gpterm_version()} - Interact with a GPT model via a terminal\n" \
                             f"Type {self.colors.info}/help{self.colors.title} to list available commands.{self.colors.end} " \
                             f"{self.colors.info}/exit{self.colors.title} or {self.colors.info}^C{self.colors.title} to quit.{self.colors.end}\n"
         self.shell.set_gpt_terminal(self)
         self.update_shell_prompt()
+        if self.startup.enabled:
+            self.print_startup_profile()
         while True:
             self.run_cmdloop()
 
@@ -207,21 +398,33 @@ class GptTerminal:
         except KeyboardInterrupt:
             try:
                 if not self.in_gpt_response:
-                    response = Prompt.ask("\nExit GPTerm (y/n)? ")
+                    from rich.prompt import Prompt
+                    response = Prompt.ask("\nExit GPTerm (y/n)? ", console=self.console)
                     if response.lower().startswith('y'):
-                        print()
+                        self.console.print()
                         sys.exit(0)
                     elif not response:
-                        print()
+                        self.console.print()
                 else:
                     self.in_gpt_response = False
-                    print()
-                print()
+                    self.console.print()
+                self.console.print()
             except KeyboardInterrupt:
-                print("\n")
+                self.console.print("\n")
+
+    def print_startup_profile(self):
+        self.startup.mark("prompt ready")
+        # wait for the background phases, so their timings are included
+        self.openai_ready.wait()
+        while self.startup.running:
+            time.sleep(0.01)
+        self.console.print(f"[{self.colors.cinfo}]Startup profile:[/]\n{self.startup.report()}\n", highlight=False)
 
     def update_shell_prompt(self):
-        shell_prompt = f"{self.colors.info}🌴 {self.max_tokens} {self.colors.prompt}>{self.colors.end} "
+        if self.shell is None:
+            return  # headless (batch, daemon, benchmarks)
+        saved = f" (-{self.tokens_saved})" if self.cfg.use_retrieval and self.tokens_saved else ""
+        shell_prompt = f"{self.colors.info}🌴 {self.max_tokens}{saved} {self.colors.prompt}>{self.colors.end} "
         self.shell.set_shell_prompt(shell_prompt)
 
     def apply_code_format_directive(self, prompt="", submit=True):
@@ -234,21 +437,104 @@ class GptTerminal:
         if submit:
             self.submit_prompt(self.prompt)
             self.add_to_conversation("\n", is_response=True, reset=False)
+            self.conversation.pin()
         else:
-            self.add_to_conversation(f"{self.prompt}", is_response=False, reset=False)
+            # only the directive is pinned, the prompt is a turn of its own that can be evicted
+            self.add_to_conversation(f"{self.code_format_directive}\n", is_response=False, reset=False)
+            self.conversation.pin()
+            if prompt:
+                self.conversation.add(f"\n{prompt}\n", Role.user, new_turn=True)
+        self.store_turns()
+
+    def get_completion(self, prompt_tokens):
+        cache_key = self.get_cache_key()
+        similar_scope = None
+        if cache_key:
+            if self.cfg.use_similar_cache:
+                # taken before the response is added to the conversation
+                similar_scope = self.get_similar_scope()
+            cached = self.response_cache.get(cache_key)
+            if not cached and similar_scope:
+                cached = self.get_similar_cached(*similar_scope)
+            if cached:
+                if self.metrics.current:
+                    self.metrics.current.cached = True
+                return cached
+        start = time.perf_counter()
+        model = self.cfg.model
+        get_completion = self.get_chat_completion if self.is_chat_model() else self.get_text_completion
 
-    def get_completion(self):
+        def create():
+            return get_completion(prompt_tokens)
+
+        def on_discard(num_tokens):
+            # the request that lost the race (both if cancelled) was sent and billed all the same, with the tokens
+            # it streamed before it was closed
+            self.add_usage(model, prompt_tokens, num_tokens)
+        if self.cfg.hedge_requests and self.stream:
+            completion = self.hedger.call(create, self.get_response, on_discard=on_discard)
+        else:
+            completion = create()
+        if self.cfg.stream_resumes and self.stream:
+            completion = ResumableStream(completion, self.get_response, self.is_chat_model(), self.resume_completion,
+                                         max_resumes=self.cfg.stream_resumes, on_resume=self.on_stream_resume,
+                                         on_overlap=lambda num_tokens: self.add_usage(model, 0, num_tokens, requests=0))
+        if self.recorder:
+            completion = self.recorder.record(completion, start, self.cfg.model, self.is_chat_model(), self.prompt,
+                                              self.after_reset)
+        if cache_key:
+            on_put = (lambda: self.similar_cache.add(*similar_scope, cache_key)) if similar_scope else None
+            completion = self.response_cache.record(cache_key, completion, self.get_response, self.is_chat_model(),
+                                                    on_put=on_put)
+        return completion
+
+    def get_similar_scope(self):
+        """
+        The context (model, temperature and the messages before the prompt) and the prompt of the request
+        """
+        messages = self.conversation.messages(self.context_turns)
+        if not messages or messages[-1]["role"] != Role.user.value:
+            return None
+        scope = SimilarPromptCache.scope(self.cfg.model, self.cfg.temperature, messages[:-1])
+        return scope, messages[-1]["content"]
+
+    def get_similar_cached(self, scope, prompt):
+        """
+        Second cache tier: offer the cached response of a near duplicate prompt asked in the same context
+        """
+        if self.shell is None:
+            return None  # needs a terminal to confirm
+        match = self.similar_cache.lookup(scope, prompt)
+        if match is None:
+            return None
+        from rich.markup import escape
+        self.console.print(f"[{self.colors.cinfo}]A similar prompt was answered before "
+                           f"({match.similarity:.0%} similar):[/] {escape(match.prompt)}")
+        answer = self.console.input(f"[{self.colors.cinfo}]Use that response? {escape('[y/N]')} [/]")
+        if answer.strip().lower() not in ('y', 'yes'):
+            return None
+        return self.similar_cache.get(match)
+
+    def get_cache_key(self):
+        if not self.cfg.use_cache or not self.stream:
+            return None
+        if self.cfg.temperature != 0 and not self.cfg.cache_any_temperature:
+            return None  # with a temperature above 0 a new response is expected each time
         if self.is_chat_model():
-            return self.get_chat_completion()
+            messages = self.conversation.messages(self.context_turns)
         else:
-            return self.get_text_completion()
+            messages = [{"role": "user", "content": self.prompt_input}]
+        return ResponseCache.key(self.cfg.model, self.cfg.temperature, messages)
 
-    def get_text_completion(self):
-        completion = openai.Completion.create(
+    def get_text_completion(self, prompt_tokens):
+        self.check_budget(self.cfg.model, prompt_tokens)
+        completion = self.scheduler.call(
+            self.openai.Completion.create,
+            tokens=prompt_tokens,
             headers={"source": "gpterm"},
             engine=self.cfg.model,
             prompt=self.prompt_input,
-            max_tokens=self.max_tokens,
+            max_tokens=self.response_max_tokens(self.max_tokens),
             n=1,
             temperature=self.cfg.temperature,
             stop=None,
@@ -258,14 +544,51 @@ class GptTerminal:
         )
         return completion
 
-    def get_chat_completion(self):
-        completion = openai.ChatCompletion.create(
+    def resume_completion(self, partial):
+        """
+        New request for the rest of a response whose stream dropped. The partial response is already in the conversation
+        """
+        self.calc_max_tokens()
+        if self.max_tokens <= 0:
+            return None
+        turns = None
+        if self.context_turns is not None:
+            # the selected turns, followed by the partial response
+            last = self.conversation.turns.index(self.context_turns[-1])
+            turns = self.context_turns + self.conversation.turns[last + 1:]
+        if not self.is_chat_model():
+            # a text model simply continues the prompt, which now ends with the partial response
+            self.prompt_input = self.conversation.text(turns)
+            prompt_tokens = self.conversation.prompt_tokens(turns)
+            completion = self.get_text_completion(prompt_tokens)
+        else:
+            messages = self.conversation.messages(turns)
+            prompt_tokens = self.conversation.prompt_tokens(turns)
+            if partial:
+                messages.append({"role": Role.user.value, "content": self.resume_directive})
+                prompt_tokens += self.text_to_tokens(self.resume_directive)
+            completion = self.get_chat_completion(prompt_tokens, messages=messages)
+        # the continuation is a request of its own. Its output is counted with the response's tokens, less the
+        # repeated overlap that ResumableStream drops (see on_overlap)
+        self.add_usage(self.cfg.model, prompt_tokens, 0)
+        return completion
+
+    def on_stream_resume(self, e):
+        if self.metrics.current:
+            self.metrics.current.resumes += 1
+        if self.debug:
+            self.renderer.flush()
+            self.console.print(f"[green]*** stream dropped ({str(e) or type(e).__name__}), resuming ***[/]")
+
+    def get_chat_completion(self, prompt_tokens, messages=None):
+        self.check_budget(self.cfg.model, prompt_tokens)
+        completion = self.scheduler.call(
+            self.openai.ChatCompletion.create,
+            tokens=prompt_tokens,
             headers={"source": "gpterm"},
             model=self.cfg.model,
-            messages=[
-                {"role": "user", "content": self.prompt_input},
-            ],
-            max_tokens=self.max_tokens,
+            messages=messages or self.conversation.messages(self.context_turns),
+            max_tokens=self.response_max_tokens(self.max_tokens),
             n=1,
             temperature=self.cfg.temperature,
             stop=None,
@@ -275,37 +598,350 @@ class GptTerminal:
         )
         return completion
 
+    def create_single_completion(self, prompt, max_tokens, temperature=None, stream=False, model=None):
+        model = model or self.cfg.model
+        temperature = self.cfg.temperature if temperature is None else temperature
+        prompt_tokens = self.text_to_tokens(prompt, model)
+        self.check_budget(model, prompt_tokens)
+        if self.is_chat_model(model):
+            return self.scheduler.call(
+                self.openai.ChatCompletion.create,
+                tokens=prompt_tokens,
+                headers={"source": "gpterm"},
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                n=1,
+                temperature=temperature,
+                stream=stream,
+            )
+        else:
+            return self.scheduler.call(
+                self.openai.Completion.create,
+                tokens=prompt_tokens,
+                headers={"source": "gpterm"},
+                engine=model,
+                prompt=prompt,
+                max_tokens=max_tokens,
+                n=1,
+                temperature=temperature,
+                stream=stream,
+            )
+
+    def get_single_completion(self, prompt, max_tokens, temperature=None):
+        completion = self.create_single_completion(prompt, max_tokens, temperature=temperature)
+        usage = completion.get("usage") or {}
+        self.add_usage(self.cfg.model, usage.get("prompt_tokens") or self.text_to_tokens(prompt),
+                       usage.get("completion_tokens", 0))
+        if self.is_chat_model():
+            return completion.choices[0].message.content
+        else:
+            return completion.choices[0].text
+
+    def max_tokens_for_prompt(self, prompt, model=None):
+        model = model or self.cfg.model
+        prompt_tokens = self.text_to_tokens(prompt, model)
+        max_tokens = self.tokens_per_model(model) - prompt_tokens
+        if max_tokens <= 0:
+            raise ValueError(f"prompt is too long for {model} ({prompt_tokens} tokens)")
+        return self.response_max_tokens(max_tokens, model)
+
+    def complete_prompt(self, prompt):
+        """
+        Get a response for a single prompt, without the chat context (used by batch mode)
+        """
+        return self.get_single_completion(prompt, max_tokens=self.max_tokens_for_prompt(prompt))
+
+    def stream_prompt(self, prompt):
+        """
+        Yield the response deltas for a single prompt, without the chat context (used by one-shot prompts)
+        """
+        completion = self.create_single_completion(prompt, max_tokens=self.max_tokens_for_prompt(prompt), stream=True)
+        started = False
+        num_tokens = 0
+        try:
+            for obj in completion:
+                response = self.get_response(obj)
+                if response is not None:
+                    num_tokens += 1
+                if not response or (not started and response.isspace()):
+                    continue
+                started = True
+                yield response
+        finally:
+            completion.close()
+            self.add_usage(self.cfg.model, self.text_to_tokens(prompt), num_tokens)
+
     def submit_prompt(self, prompt):
+        record = None
         try:
             self.prompt = prompt
             self.add_to_conversation(f"\n{self.prompt}\n", is_response=False)
-            self.prompt_input = self.conversation
+            self.prompt_input = self.conversation.text()
 
             if self.debug:
-                print(f"[green]{self.prompt_input}[/]", end='')
+                self.openai_ready.wait()
+                if self.prompt_idx == 0 and self.http_session is not None:
+                    self.console.print(f"[green]{self.http_session.warm_up_summary()}[/]")
+                self.console.print(f"[green]{self.prompt_input}[/]", end='')
 
             self.update_max_tokens()
+            self.select_context()
             self.update_shell_prompt()
-            completion = self.get_completion()
+            prompt_tokens = self.conversation.prompt_tokens(self.context_turns)
+            metrics = self.metrics.start(self.cfg.model, prompt_tokens)
+            completion = self.get_completion(prompt_tokens)
+            metrics.on_connected()
             self.handle_completion(completion)
+            record = self.metrics.finish()
             self.prompt_idx += 1
+            self.calc_max_tokens()
+            self.update_shell_prompt()
+        except Exception as e:
+            record = self.metrics.finish(error=e)
+            self.print_error(e)
+        finally:
+            self.context_turns = None
+            self.store_turns()
+            self.record_usage(record)  # after the turns are stored, so a new session has its id
+
+    def submit_file(self, path, question):
+        """
+        Answer a question about a file, however large, by map-reduce over its parts. The question and the answer
+        are added to the chat context
+        """
+        from gpterm.attachments import FileMapReduce
+        self.in_gpt_response = True
+        record = None
+        try:
+            map_reduce = FileMapReduce(self, path, question, workers=self.cfg.file_workers,
+                                       chunk_tokens=self.cfg.file_chunk_tokens)
+            prompt = map_reduce.run()
+            self.prompt = f"[{os.path.basename(path)}] {map_reduce.question}"
+            self.add_to_conversation(f"\n{self.prompt}\n", is_response=False)
+            self.update_max_tokens()
+            max_tokens = min(self.max_tokens_for_prompt(prompt), max(self.max_tokens, 1))
+            metrics = self.metrics.start(self.cfg.model, self.text_to_tokens(prompt))
+            completion = self.create_single_completion(prompt, max_tokens=max_tokens, stream=True)
+            metrics.on_connected()
+            self.handle_completion(completion)
+            record = self.metrics.finish()
+            self.calc_max_tokens()
+            self.update_shell_prompt()
         except Exception as e:
+            record = self.metrics.finish(error=e)
             self.print_error(e)
+        finally:
+            self.in_gpt_response = False
+            self.store_turns()
+            self.record_usage(record)
+
+    def check_budget(self, model, prompt_tokens):
+        """
+        Before a request is sent: raises BudgetExceeded past the daily hard budget, warns past the soft one
+        """
+        if self.usage is None or not (self.usage.soft_budget or self.usage.hard_budget):
+            return
+        try:
+            warning = self.usage.check(self.get_model_info(model).cost(prompt_tokens, 0))
+        except BudgetExceeded:
+            raise
+        except Exception as e:
+            # like recording usage, a ledger that can't be read must not block the request
+            if self.debug:
+                self.console.print(f"[red]failed to check the budget: {e}[/]")
+            return
+        if warning:
+            self.console.print(f"[bold red]*** {warning} ***[/]")
+
+    def add_usage(self, model, prompt_tokens, completion_tokens, requests=1):
+        self.scheduler.charge(completion_tokens)  # the prompt tokens were reserved when the request was made
+        if self.usage is None:
+            return
+        cost = self.get_model_info(model).cost(prompt_tokens, completion_tokens)
+        try:
+            self.usage.add(model, self.session_id, prompt_tokens, completion_tokens, cost, requests=requests)
+        except Exception as e:
+            # like the metrics, the ledger must never break a response
+            if self.debug:
+                self.console.print(f"[red]failed to record usage: {e}[/]")
+
+    def record_usage(self, record):
+        """
+        Add a request to the usage ledger from its metrics record, if it was sent and not served from the cache
+        """
+        if record is None or record["cached"] or record["connect_ms"] is None:
+            return
+        self.add_usage(record["model"], record["prompt_tokens"], record["completion_tokens"])
+
+    def format_usage(self):
+        if self.usage is None:
+            return "Usage is not tracked (track_usage in the config)"
+        return self.usage.report(self.session_id)
+
+    def store_turns(self):
+        if self.session_store is None:
+            return
+        turns = self.conversation.unstored_turns()
+        pinned = self.conversation.pinned
+        # turns are marked as stored only once written, so turns that failed to be written are retried next time
+        changed = [turn for turn in turns if turn.seq is not None]
+        new = [turn for turn in turns if turn.seq is None]
+        try:
+            if changed:
+                self.session_store.update_turns(self.session_id,
+                                                [(turn.seq, turn.text(), turn.tokens) for turn in changed])
+                for turn in changed:
+                    turn.stored = True
+            if new:
+                if self.session_id is None:
+                    self.session_id = self.session_store.create_session(self.cfg.model)
+                first_seq = self.session_store.append_turns(self.session_id,
+                                                            [(turn.role, turn.text(), turn.tokens) for turn in new],
+                                                            pinned=pinned)
+                for seq, turn in enumerate(new, start=first_seq):
+                    turn.seq = seq
+                    turn.stored = True
+            elif self.session_id is not None and pinned != self.session_pinned:
+                self.session_store.set_pinned(self.session_id, pinned)
+            self.session_pinned = pinned
+        except Exception as e:
+            # the session store is a convenience, it must never break the chat
+            if self.debug:
+                self.console.print(f"[red]failed to store the session: {e}[/]")
+
+    def new_session(self):
+        self.store_turns()
+        self.session_id = None
+        self.session_pinned = 0
+
+    def resume_session(self, session_id=None):
+        """
+        Load the tail of a stored session (the last one by default) that fits the current model's token budget
+        """
+        if self.session_store is None:
+            return "Sessions are not saved (save_sessions is off in the config)"
+        from rich.markup import escape
+        self.store_turns()
+        try:
+            if session_id is None:
+                session_id = self.session_store.last_session_id(exclude=self.session_id)
+                if session_id is None:
+                    return "No saved sessions"
+            session = self.session_store.session(session_id)
+            if session is None:
+                return f"No session {session_id}"
+            pinned, tail = self.session_store.load_tail(session_id, self.tokens_per_model() - self.cfg.response_tokens)
+        except Exception as e:
+            return f"[bold red]Failed to load the session: {escape(str(e))}[/]"
+        self.conversation.restore([(turn.role, turn.content, turn.tokens, turn.seq) for turn in pinned + tail],
+                                  pinned=len(pinned))
+        self.session_id = session_id
+        self.session_pinned = len(pinned)
+        self.after_reset = False
+        self.prompt_input = self.conversation.text()
+        self.calc_max_tokens()
+        self.update_shell_prompt()
+        return f"Resumed session {session_id}: {escape(session.title or '')}\n" \
+               f"loaded the last {len(tail)} of {session.num_turns - session.pinned} messages"
+
+    @staticmethod
+    def short_title(title, max_length):
+        title = ' '.join((title or '').split())
+        return title if len(title) <= max_length else title[:max_length - 1] + "…"
+
+    def format_sessions(self):
+        if self.session_store is None:
+            return "Sessions are not saved (save_sessions is off in the config)"
+        from rich.markup import escape
+        try:
+            sessions = self.session_store.list_sessions()
+        except Exception as e:
+            return f"[bold red]Failed to list the sessions: {escape(str(e))}[/]"
+        if not sessions:
+            return "No saved sessions"
+        lines = []
+        for session in sessions:
+            current = "*" if session.id == self.session_id else " "
+            date = datetime.datetime.fromtimestamp(session.updated).strftime("%Y-%m-%d %H:%M")
+            title = self.short_title(session.title, 50)
+            lines.append(f"{current}{session.id:>5}  {date}  {alias_for_model(session.model):<10} "
+                         f"{session.num_turns - session.pinned:>4} messages  {escape(title)}")
+        return '\n'.join(lines)
+
+    def search_sessions(self, terms):
+        if self.session_store is None:
+            return "Sessions are not saved (save_sessions is off in the config)"
+        from rich.markup import escape
+        start = time.perf_counter()
+        try:
+            results = self.session_store.search(terms)
+        except Exception as e:
+            return f"[bold red]Search failed: {escape(str(e))}[/]"
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if not results:
+            return f"No matches for {escape(terms)}"
+        lines = []
+        for session_id, seq, role, created, title, snippet in results:
+            date = datetime.datetime.fromtimestamp(created).strftime("%Y-%m-%d %H:%M")
+            who = "[GPT]" if role == Role.assistant.value else "[Me]"
+            title = self.short_title(title, 40)
+            snippet = escape(' '.join(snippet.split()))
+            snippet = snippet.replace(HIGHLIGHT_START, "[bold yellow]").replace(HIGHLIGHT_END, "[/]")
+            lines.append(f"[{self.colors.cinfo}]session {session_id} ({escape(title)}) {date}[/] "
+                         f"{escape(who)}\n  {snippet}")
+        lines.append(f"[{self.colors.cinfo}]{len(results)} matches in {elapsed_ms:.0f} ms. /resume <session> to continue one[/]")
+        return '\n'.join(lines)
+
+    def compare_models(self, models, prompt):
+        from gpterm.compare import ModelComparison
+        self.in_gpt_response = True
+        try:
+            ModelComparison(self, models, prompt).run()
+        except Exception as e:
+            self.print_error(e)
+        finally:
+            self.in_gpt_response = False
+
+    def replay(self, recording_path, speed=1.0):
+        """
+        Play back the responses of a --record recording through handle_completion, with their original timing
+        divided by speed (0 for as fast as possible)
+        """
+        for header, chunks, end_event in read_recording(recording_path):
+            self.cfg.model = header['model']
+            self.resolve_model()
+            if 'chat' in header:
+                # the endpoint the response was recorded from, whatever the registry says about the model now
+                self.get_response = self.get_chat_response if header['chat'] else self.get_text_response
+            self.after_reset = header.get('after_reset', False)
+            self.console.print(f"\n[Me]: {header['prompt'].strip()}", style=self.colors.cinput, markup=False)
+            self.add_to_conversation(f"\n{header['prompt']}\n", is_response=False)
+            self.metrics.start(self.cfg.model)
+            try:
+                self.handle_completion(ReplayStream(chunks, end_event, speed=speed))
+                self.metrics.finish()
+            except Exception as e:
+                self.metrics.finish(error=e)
+                self.print_error(e)
 
     def handle_response_line(self, response, end=False):
         self.resp_line += response
         self.resp_sentence += response
         if self.resp_line.strip() == '```':
             self.code_block_idx = 0
-            self.print_chat_response(response.strip() + "\n", force=True)
             self.in_code_block = not self.in_code_block
+            if self.in_code_block:
+                # the rest of an opening fence line is the code language (```bash)
+                self.in_code_fence_info = True
+                self.print_chat_response(response.strip(), force=True)
+            else:
+                self.print_chat_response(response.strip() + "\n", force=True)
             self.resp_line = ""
             return
 
         if not self.in_code_block or response == '``':
             self.print_chat_response(response)
-            if self.cfg.use_voice and self.stream_voiced_text and not self.first_sentence:
-                time.sleep(self.stream_text_delay)
 
         has_nl = '\n' in response
         has_fs = '.' in response
@@ -316,50 +952,71 @@ class GptTerminal:
         if is_eos:
             self.first_sentence = False
             if is_eol:
-                if self.in_code_block:
+                if self.in_code_fence_info:
+                    self.start_code_block()
+                    self.resp_line = ""
+                elif self.in_code_block:
                     self.print_code_response()
                 else:
                     if self.cfg.voice_stop == VoiceStop.newline:
                         self.voice(self.resp_line)
-                self.resp_line = ""
+                    self.resp_line = ""
             if self.cfg.voice_stop == VoiceStop.period:
                 self.voice(self.resp_sentence)
             self.resp_sentence = ""
 
     def add_to_conversation(self, text, is_response=False, reset=False):
         if reset:
-            self.conversation = ""
-            self.conversation_formatted = ""
-        self.conversation += text
-        if is_response:
-            if self.resp_start:
-                text = self.add_gpt_prefix(text)
-            self.conversation_formatted += f"[{self.colors.cresponse}]{text}[/]"
-        else:
-            if text.strip() != '':
-                self.conversation_formatted += f"\n\n[{self.colors.cinput}][Me]: {text.lstrip()}[/]"
+            self.conversation.reset(self.cfg.model)
+        self.conversation.add(text, Role.assistant if is_response else Role.user)
+
+    def format_conversation(self):
+        formatted = []
+        if self.conversation.summary:
+            formatted.append(f"[{self.colors.cmessage}]{self.conversation.SUMMARY_HEADER}{self.conversation.summary}[/]")
+        for turn in self.conversation.turns:
+            text = turn.text()
+            if turn.role == Role.assistant:
+                formatted.append(f"[{self.colors.cresponse}]{self.add_gpt_prefix(text)}[/]")
+            elif text.strip() != '':
+                formatted.append(f"\n\n[{self.colors.cinput}][Me]: {text.lstrip()}[/]")
+        return ''.join(formatted)
 
     def voice(self, text):
-        if not text:
+        if not text or text.isspace():
             return
         if not self.cfg.use_voice:
             return
         if self.in_code_block or text == '```' or text == '``':
             return
-        line_to_speak = text
-        line_to_speak = line_to_speak.replace("\"", "\\\"").replace("`", "")
+        line_to_speak = text.replace("`", "")
         if line_to_speak.startswith('-'):
             line_to_speak = f"\\{line_to_speak}"
-        try:
-            highlight = '-i' if self.cfg.voice_over else ''
-            rc = os.system(f'say {highlight} -v {self.cfg.voice_name} \"{line_to_speak}\"')
-            if rc != 0:
-                self.abort_response = True
-        except Exception as e:
-            err_msg = f"Failed to produce voiced text: {e}\nYou can disable this feature with /voice"
+        self.renderer.flush()
+        start = time.perf_counter()
+        self.voice_engine.speak(line_to_speak)
+        if self.cfg.voice_over:
+            # say prints the text as it speaks it, so don't run ahead of it
+            self.voice_engine.wait()
+        if self.metrics.current:
+            self.metrics.current.on_voice(time.perf_counter() - start)
+        self.check_voice()
+
+    def check_voice(self):
+        if not self.voice_engine.failed:
+            return
+        self.abort_response = True
+        if self.voice_engine.error:
+            err_msg = f"Failed to produce voiced text: {self.voice_engine.error}\nYou can disable this feature with /voice"
+            self.voice_engine.error = None
             self.print_error(err_msg)
 
+    def print_retry(self, e, delay):
+        self.renderer.flush()
+        self.console.print(f"[{self.colors.cmessage}]*** {str(e) or type(e).__name__}. retrying in {delay:.1f}s ***[/]")
+
     def print_error(self, e):
+        self.renderer.flush()
         self.console.print(f"[bold red]*** got error: {str(e)} ***[/]")
 
     def reset_response_state(self):
@@ -367,6 +1024,8 @@ class GptTerminal:
         self.resp_sentence = ""
         self.resp_start = True
         self.in_gpt_response = False
+        self.in_code_block = False
+        self.in_code_fence_info = False
 
     def handle_completion(self, completion):
         if self.stream:
@@ -374,43 +1033,59 @@ class GptTerminal:
             self.first_sentence = True
             self.code_block_idx = 0
             self.abort_response = False
-            for idx, obj in enumerate(completion):
-                self.in_gpt_response = True
-                if self.abort_response:
-                    completion.close()
-                    self.add_to_conversation("\n")
-                    self.reset_response_state()
-                    break
-                response = self.get_response(obj)
-                if self.debug:
-                    print(f"[yellow]{response}[/]", end='')
-
-                if idx == 0 and response == '\n':  # happens at any response from text completion
-                    continue
+            self.voice_engine.reset()
+            metrics = self.metrics.current
+            try:
+                for idx, obj in enumerate(completion):
+                    self.in_gpt_response = True
+                    self.check_voice()
+                    if self.abort_response:
+                        completion.close()
+                        if self.conversation.turns and self.conversation.turns[-1].role == Role.assistant:
+                            self.add_to_conversation("\n", is_response=True)  # ends the partial response
+                        self.reset_response_state()
+                        break
+                    response = self.get_response(obj)
+                    if metrics and response is not None:
+                        metrics.on_token()
+                    if self.debug:
+                        self.console.print(f"[yellow]{response}[/]", end='')
 
-                if self.after_reset:
-                    if idx == 1 and response == '\n\n':  # happens at first response from chat completion
+                    if idx == 0 and response == '\n':  # happens at any response from text completion
                         continue
 
-                if response is not None:
-                    self.add_to_conversation(response, is_response=True)
-                    self.handle_response_line(response)
-                    self.resp_start = False
+                    if self.after_reset:
+                        if idx == 1 and response == '\n\n':  # happens at first response from chat completion
+                            continue
 
-            if self.resp_line:
-                self.handle_response_line('', end=True)
+                    if response is not None:
+                        render_start = time.perf_counter()
+                        voice_blocked = metrics.voice_blocked if metrics else 0
+                        self.add_to_conversation(response, is_response=True)
+                        self.handle_response_line(response)
+                        self.resp_start = False
+                        if metrics:
+                            metrics.on_render(time.perf_counter() - render_start - (metrics.voice_blocked - voice_blocked))
+
+                if self.resp_line:
+                    self.handle_response_line('', end=True)
+                self.renderer.flush()
+                start = time.perf_counter()
+                self.voice_engine.wait()
+                if metrics:
+                    metrics.on_voice(time.perf_counter() - start)
+                self.check_voice()
+            except BaseException:
+                self.voice_engine.stop()
+                raise
+            finally:
+                self.renderer.flush()
 
             self.in_gpt_response = False
             self.after_reset = False
-            print("\n")
-        else:
-            print(completion.choices[0].text)
-
-    def get_response(self, obj):
-        if self.is_chat_model():
-            return self.get_chat_response(obj)
+            self.console.print("\n")
         else:
-            return self.get_text_response(obj)
+            self.console.print(completion.choices[0].text)
 
     def get_text_response(self, obj):
         return obj.choices[0].text
@@ -419,27 +1094,42 @@ class GptTerminal:
         response = obj.choices[0].delta.content if 'content' in obj.choices[0].delta else None
         return response
 
+    def start_code_block(self):
+        self.in_code_fence_info = False
+        language = self.resp_line.strip()
+        self.print_chat_response(f"{language}\n", force=True)
+        self.code_highlighter.start(language)
+
     def print_code_response(self):
-        if self.resp_line == '\n' and self.code_block_idx == 0:
-            return
-        self.code_block_idx += 1
-        if self.resp_line.endswith('\n'):
-            self.resp_line = self.resp_line[:-1]
-        syntax = Syntax(self.resp_line, self.code_lang, line_numbers=self.code_line_numbers, theme=self.code_syntax_theme)
-        self.console.print(syntax, end='')
+        # a chunk may hold a newline together with the indentation of the next line, keep that for the next line
+        lines, _, self.resp_line = self.resp_line.rpartition('\n')
+        if not _:
+            lines, self.resp_line = self.resp_line, ""
+        self.renderer.flush()
+        for line in lines.split('\n'):
+            self.code_block_idx += 1
+            try:
+                text = self.code_highlighter.highlight(line, width=self.console.width)
+            except Exception as e:
+                # highlighting is cosmetic, the code is printed plain rather than losing the response
+                from rich.text import Text
+                if self.debug:
+                    self.console.print(f"[red]failed to highlight code: {e}[/]")
+                text = Text(line)
+            self.console.print(text)
 
     def print_chat_response(self, response, force=False):
         if self.cfg.voice_over and not force:
             return
         if self.resp_start:
             response = self.add_gpt_prefix(response, include_prefix=False)
-        self.console.print(f"[{self.colors.cresponse}]{response}[/]", end='')
+        self.renderer.write(response, style=self.colors.cresponse)
 
     def print_info(self, message):
         self.console.print(f"{message}\n")
 
     def add_gpt_prefix(self, text, include_prefix=True):
-        starting_nl = '\n' if text == '``' else ''
+        starting_nl = '\n' if text.startswith('``') else ''
         prefix = "[GPT]: " if include_prefix else ""
         text = f"{prefix}{starting_nl}{text}"
         return text
@@ -448,7 +1138,8 @@ class GptTerminal:
         size_px = self.cfg.image_size
         self.console.print(f"[{self.colors.cresponse}]Generating Image...[/]")
         try:
-            response = openai.Image.create(
+            response = self.scheduler.call(
+                self.openai.Image.create,
                 prompt=prompt,
                 n=1,
                 size=f"{size_px}x{size_px}"
@@ -463,7 +1154,11 @@ class GptTerminal:
             os.makedirs(self.cfg.image_store)
         image_filename = "img-" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S%f")[:-3] + ".png"
         image_path = os.path.join(self.cfg.image_store, image_filename)
-        request.urlretrieve(image_url, image_path)
+        with self.http_session.get(image_url, stream=True) as response:
+            response.raise_for_status()
+            with open(image_path, 'wb') as fp:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    fp.write(chunk)
         if os.path.exists(image_path):
             self.console.print(f"[{self.colors.cresponse}]Image saved at: {image_path}[/]\n")
             if self.cfg.image_view:
@@ -479,9 +1174,59 @@ def gpterm_main():
                         help="Path to file containing an OpenAI API key")
     parser.add_argument("--theme", type=str, choices=['light', 'dark'],
                         help="Set theme to match background. light or dark")
+    parser.add_argument("--debug", action="store_true", help="Print requests, raw responses and connection timings")
+    parser.add_argument("--startup-profile", action="store_true", help="Print the time taken by each startup phase")
+    parser.add_argument("--metrics", type=str, metavar="PATH",
+                        help="Append latency and throughput metrics of each request to a jsonl file")
+    parser.add_argument("--resume", type=int, nargs='?', const=0, metavar="ID",
+                        help="Resume a saved chat session (the last one without an ID)")
+    parser.add_argument("--record", type=str, metavar="PATH",
+                        help="Append the raw chunks of every streamed response, with their arrival times, to a file "
+                             "that 'gpterm replay' plays back")
+    parser.add_argument("-p", "--prompt", type=str,
+                        help="Print the response to a single prompt and exit ('-' to read it from stdin). "
+                             "Served by the gpterm daemon if one is running")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Run a resident gpterm that serves --prompt calls over a unix socket")
+    parser.add_argument("--socket", type=str, default=DEFAULT_SOCKET_PATH, help="Unix socket path of the gpterm daemon")
+    subparsers = parser.add_subparsers(dest="command")
+    batch_parser = subparsers.add_parser("batch", help="Run a file of prompts concurrently, without the interactive shell")
+    batch_parser.add_argument("prompts_path", type=str,
+                              help="jsonl file with a prompt per line (a json string or {\"id\": ..., \"prompt\": ...})")
+    batch_parser.add_argument("--concurrency", type=int, default=4, help="Number of requests to run at the same time")
+    batch_parser.add_argument("--out", type=str, default="results.jsonl",
+                              help="jsonl file to append results to. Prompts that already have a result are skipped")
+    replay_parser = subparsers.add_parser("replay", help="Play back the responses of a --record recording offline")
+    replay_parser.add_argument("recording", type=str, help="File written by --record")
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="Playback speed relative to the recorded timing (2 for twice as fast)")
+    replay_parser.add_argument("--fast", action="store_true", help="Play back as fast as possible")
     args = parser.parse_args()
-    debug = False
-    gpterm = GptTerminal(debug=debug, theme=args.theme, api_key=args.api_key, api_key_path=args.api_key_path)
+    if args.prompt is not None:
+        prompt = sys.stdin.read().strip() if args.prompt == '-' else args.prompt
+        exit_code = run_client(prompt, socket_path=args.socket)
+        if exit_code is None:
+            gpterm = GptTerminal(api_key=args.api_key, api_key_path=args.api_key_path)
+            exit_code = run_local(gpterm, prompt)
+        sys.exit(exit_code)
+    gpterm = GptTerminal(debug=args.debug, theme=args.theme, api_key=args.api_key, api_key_path=args.api_key_path,
+                         startup_profile=args.startup_profile, metrics_path=args.metrics,
+                         record_path=args.record)
+    if args.command == "batch":
+        from gpterm.batch import BatchRunner
+        num_errors = BatchRunner(gpterm, concurrency=args.concurrency).run(args.prompts_path, args.out)
+        sys.exit(1 if num_errors else 0)
+    if args.command == "replay":
+        gpterm.replay(args.recording, speed=0 if args.fast else args.speed)
+        sys.exit(0)
+    if args.resume is not None:
+        gpterm.console.print(f"[{gpterm.colors.cinfo}]{gpterm.resume_session(args.resume or None)}[/]", highlight=False)
+    if args.daemon:
+        daemon = GptermDaemon(gpterm, socket_path=args.socket)
+        gpterm.warm_up()
+        gpterm.console.print(f"[{gpterm.colors.cinfo}]gpterm daemon listening on {args.socket}[/]")
+        daemon.serve()
+        sys.exit(0)
     gpterm.run()
 
 
@@ -0,0 +1,150 @@
+import time
+import threading
+from collections import deque
+from gpterm.metrics import percentile
+
+
+class PrefetchedStream:
+    """
+    A completion stream whose first chunks were already read
+    """
+    def __init__(self, completion, iterator, chunks):
+        self.completion = completion
+        self.iterator = iterator
+        self.chunks = chunks
+
+    def __iter__(self):
+        yield from self.chunks
+        self.chunks = []
+        yield from self.iterator
+
+    def close(self):
+        self.completion.close()
+
+
+class HedgeAttempt:
+    def __init__(self, start):
+        self.start = start
+        self.first_token = None  # seconds from the start of the original request
+        self.num_tokens = 0  # streamed up to the first token
+        self.stream = None
+        self.error = None
+
+
+class HedgedCall:
+    """
+    The original request and its duplicate, if one was sent
+    """
+    def __init__(self, on_discard=None):
+        self.start = time.perf_counter()
+        self.on_discard = on_discard
+        self.attempts = [HedgeAttempt(self.start)]
+        self.winner = None
+        self.cancelled = False
+        self.done = threading.Event()
+
+
+class RequestHedger:
+    """
+    Cuts the tail latency of the first token: when a streamed request has no token after a deadline
+    (a percentile of the recent first token times), a duplicate request is sent. Whichever stream produces a token
+    first is used, the other is closed as soon as it answers
+    """
+    def __init__(self, pct=95, default_delay=3.0, min_samples=5, max_samples=100, min_delay=0.2):
+        self.pct = pct
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.samples = deque(maxlen=max_samples)  # seconds to the first token of the original requests
+        self.lock = threading.Lock()
+        self.num_requests = 0
+        self.num_fired = 0  # requests where a duplicate was sent
+        self.num_won = 0  # duplicates that produced the first token before the original request
+        self.saved = 0.0  # seconds of first token latency saved by the duplicates that won
+
+    def deadline(self):
+        if len(self.samples) < self.min_samples:
+            return self.default_delay
+        return max(self.min_delay, percentile(list(self.samples), self.pct))
+
+    def _attempt(self, call, attempt, create, get_response):
+        try:
+            completion = create()
+            iterator = iter(completion)
+            chunks = []
+            for obj in iterator:
+                chunks.append(obj)
+                if get_response(obj) is not None:
+                    attempt.num_tokens += 1
+                    break
+            attempt.first_token = time.perf_counter() - call.start
+        except Exception as e:
+            attempt.error = e
+            call.done.set()
+            return
+        with self.lock:
+            if attempt is call.attempts[0]:
+                # the original request samples its first token time whether it was raced by a duplicate or not,
+                # leaving out the slow ones that were hedged would pull the deadline down with every hedge.
+                # A duplicate doesn't, its time includes the wait for the deadline
+                self.samples.append(attempt.first_token)
+            winner = call.winner
+            if winner is None and not call.cancelled:
+                call.winner = attempt
+                attempt.stream = PrefetchedStream(completion, iterator, chunks)
+            elif winner is not None and attempt is call.attempts[0]:
+                self.saved += attempt.first_token - winner.first_token
+        if call.winner is not attempt:
+            completion.close()
+            self._discard(call, attempt)
+        call.done.set()
+
+    @staticmethod
+    def _discard(call, attempt):
+        if call.on_discard:
+            call.on_discard(attempt.num_tokens)
+
+    def _start(self, call, attempt, create, get_response):
+        threading.Thread(target=self._attempt, args=(call, attempt, create, get_response), daemon=True).start()
+
+    def call(self, create, get_response, on_discard=None):
+        """
+        Run create() (a streamed completion request), hedged. Returns the stream that produced a token first.
+        on_discard(num_tokens) is called for each request that was sent but not used (the slower one, or both if
+        the call is interrupted), with the number of tokens it streamed before it was closed
+        """
+        call = HedgedCall(on_discard)
+        self.num_requests += 1
+        self._start(call, call.attempts[0], create, get_response)
+        try:
+            if not call.done.wait(self.deadline()):
+                self.num_fired += 1
+                hedge = HedgeAttempt(time.perf_counter())
+                with self.lock:
+                    call.attempts.append(hedge)
+                self._start(call, hedge, create, get_response)
+            while True:
+                call.done.wait()
+                with self.lock:
+                    call.done.clear()
+                    if call.winner is not None:
+                        if call.winner is not call.attempts[0]:
+                            self.num_won += 1
+                        return call.winner.stream
+                    if all(attempt.error for attempt in call.attempts):
+                        raise call.attempts[0].error
+        except BaseException:
+            with self.lock:
+                call.cancelled = True
+                winner = call.winner
+            if winner is not None:
+                winner.stream.close()
+                self._discard(call, winner)
+            raise
+
+    def stats(self):
+        if not self.num_requests:
+            return "Hedged requests: none yet"
+        return f"Hedged requests: duplicate sent for {self.num_fired} of {self.num_requests} requests " \
+               f"(deadline now {self.deadline():.2f}s), {self.num_won} answered first, " \
+               f"saving {self.saved:.1f}s of first token latency"
@@ -0,0 +1,136 @@
+from functools import lru_cache
+from pygments.lexer import RegexLexer, ExtendedRegexLexer, LexerContext
+from pygments.lexers import get_lexer_by_name
+from pygments.token import Error, Whitespace
+from pygments.util import ClassNotFound
+from rich.syntax import Syntax
+from rich.text import Text
+
+
+@lru_cache(maxsize=None)
+def lexer_for_language(language):
+    try:
+        return get_lexer_by_name(language)
+    except ClassNotFound:
+        return get_lexer_by_name('text')
+
+
+_TokenType = type(Error)
+
+
+def _context_class(lexer):
+    """
+    The context an ExtendedRegexLexer keeps its state in: the yaml lexer needs its own (with the indentation)
+    """
+    from pygments.lexers.data import YamlLexer, YamlLexerContext
+    return YamlLexerContext if isinstance(lexer, YamlLexer) else LexerContext
+
+
+def _regex_tokens(lexer, text, statestack):
+    """
+    Same as RegexLexer.get_tokens_unprocessed, but continues from and updates the given state stack
+    so that a code block can be lexed one line at a time. It relies on the compiled token definitions of
+    the lexer (pygments < 3, see setup.py), CodeHighlighter falls back to lexing each line on its own
+    """
+    pos = 0
+    tokendefs = lexer._tokens
+    statetokens = tokendefs[statestack[-1]]
+    while True:
+        for rexmatch, action, new_state in statetokens:
+            m = rexmatch(text, pos)
+            if m:
+                if action is not None:
+                    if type(action) is _TokenType:
+                        yield action, m.group()
+                    else:
+                        for _, token_type, value in action(lexer, m):
+                            yield token_type, value
+                pos = m.end()
+                if new_state is not None:
+                    if isinstance(new_state, tuple):
+                        for state in new_state:
+                            if state == '#pop':
+                                if len(statestack) > 1:
+                                    statestack.pop()
+                            elif state == '#push':
+                                statestack.append(statestack[-1])
+                            else:
+                                statestack.append(state)
+                    elif isinstance(new_state, int):
+                        if abs(new_state) >= len(statestack):
+                            del statestack[1:]
+                        else:
+                            del statestack[new_state:]
+                    elif new_state == '#push':
+                        statestack.append(statestack[-1])
+                    statetokens = tokendefs[statestack[-1]]
+                break
+        else:
+            if pos >= len(text):
+                break
+            if text[pos] == '\n':
+                statestack[:] = ['root']
+                statetokens = tokendefs['root']
+                yield Whitespace, '\n'
+            else:
+                yield Error, text[pos]
+            pos += 1
+
+
+class CodeHighlighter:
+    """
+    Highlights a streamed code block line by line, keeping the lexer state between lines
+    so that multi-line strings and comments are colored correctly. A lexer that fails to continue from
+    its state lexes each line of the block on its own
+    """
+    def __init__(self, theme, default_language='python', tab_size=4):
+        self.theme = Syntax.get_theme(theme)
+        self.background_style = self.theme.get_background_style()
+        self.default_language = default_language
+        self.tab_size = tab_size
+        self.styles = {}
+        self.lexer = None
+        self.stack = None
+        self.context = None
+        self.incremental = True
+        self.start()
+
+    def start(self, language=None):
+        self.lexer = lexer_for_language((language or self.default_language).lower())
+        self.stack = ['root']
+        self.context = None
+        self.incremental = isinstance(self.lexer, ExtendedRegexLexer) or \
+            (isinstance(self.lexer, RegexLexer) and isinstance(getattr(self.lexer, '_tokens', None), dict))
+
+    def _incremental_tokens(self, line):
+        if isinstance(self.lexer, ExtendedRegexLexer):
+            if self.context is None:
+                self.context = _context_class(self.lexer)(line, 0)
+            self.context.text, self.context.pos, self.context.end = line, 0, len(line)
+            for _, token_type, value in self.lexer.get_tokens_unprocessed(context=self.context):
+                yield token_type, value
+        else:
+            yield from _regex_tokens(self.lexer, line, self.stack)
+
+    def tokens(self, line):
+        if self.incremental:
+            try:
+                return list(self._incremental_tokens(line))
+            except Exception:
+                self.incremental = False  # the rest of the block is lexed a line at a time, without state
+        return list(self.lexer.get_tokens(line))
+
+    def style_for_token(self, token_type):
+        style = self.styles.get(token_type)
+        if style is None:
+            style = self.styles[token_type] = self.theme.get_style_for_token(token_type)
+        return style
+
+    def highlight(self, line, width=None):
+        text = Text(style=self.background_style)
+        for token_type, value in self.tokens(line.expandtabs(self.tab_size) + '\n'):
+            text.append(value, style=self.style_for_token(token_type))
+        text.rstrip()
+        if width and text.cell_len < width:
+            text.pad_right(width - text.cell_len)  # fill the line with the theme's background, like rich's Syntax
+        return text
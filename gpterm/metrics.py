@@ -0,0 +1,146 @@
+import time
+import json
+from collections import deque
+
+
+def percentile(values, pct):
+    """
+    Nearest rank percentile of a list of numbers, None for an empty list
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class RequestMetrics:
+    """
+    Timings of a single streamed request. Each stream chunk carries one token
+    """
+    def __init__(self, model, prompt_tokens=0):
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.start = time.perf_counter()
+        self.connected = None  # the request returned, the response stream is open
+        self.first_token = None
+        self.last_token = None
+        self.num_tokens = 0
+        self.gaps = []  # seconds between consecutive tokens
+        self.render_times = []  # seconds spent rendering each chunk, without voice
+        self.voice_blocked = 0.0  # seconds the stream loop waited on voice()
+        self.end = None
+        self.cached = False
+        self.resumes = 0  # times the stream dropped and was continued
+        self.error = None
+
+    def on_connected(self):
+        self.connected = time.perf_counter()
+
+    def on_token(self):
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now
+        else:
+            self.gaps.append(now - self.last_token)
+        self.last_token = now
+        self.num_tokens += 1
+
+    def on_render(self, seconds):
+        self.render_times.append(seconds)
+
+    def on_voice(self, seconds):
+        self.voice_blocked += seconds
+
+    def finish(self, error=None):
+        self.end = time.perf_counter()
+        if error is not None:
+            self.error = str(error) or type(error).__name__
+
+    def tokens_per_second(self):
+        if self.num_tokens < 2 or self.last_token == self.first_token:
+            return None
+        return (self.num_tokens - 1) / (self.last_token - self.first_token)
+
+    def to_dict(self):
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 2)
+
+        def since_start(timestamp):
+            return None if timestamp is None else timestamp - self.start
+        tokens_per_second = self.tokens_per_second()
+        return {
+            "time": time.time(),
+            "model": self.model,
+            "cached": self.cached,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.num_tokens,
+            "connect_ms": ms(since_start(self.connected)),
+            "ttft_ms": ms(since_start(self.first_token)),
+            "gap_p50_ms": ms(percentile(self.gaps, 50)),
+            "gap_p95_ms": ms(percentile(self.gaps, 95)),
+            "tokens_per_s": None if tokens_per_second is None else round(tokens_per_second, 2),
+            "render_ms_per_chunk": ms(sum(self.render_times) / len(self.render_times)) if self.render_times else None,
+            "render_p95_ms": ms(percentile(self.render_times, 95)),
+            "voice_blocked_ms": ms(self.voice_blocked),
+            "total_ms": ms(since_start(self.end)),
+            "resumes": self.resumes,
+            "error": self.error,
+        }
+
+
+class MetricsRecorder:
+    """
+    Keeps the metrics of the recent requests in the session for /stats,
+    and appends a json line per request to metrics_path when set
+    """
+    def __init__(self, metrics_path=None, max_records=1000):
+        self.metrics_path = metrics_path
+        self.records = deque(maxlen=max_records)
+        self.current = None
+
+    def start(self, model, prompt_tokens=0):
+        self.current = RequestMetrics(model, prompt_tokens)
+        return self.current
+
+    def finish(self, error=None):
+        if self.current is None:
+            return None
+        self.current.finish(error)
+        record = self.current.to_dict()
+        self.current = None
+        self.records.append(record)
+        if self.metrics_path:
+            try:
+                with open(self.metrics_path, 'a') as fp:
+                    fp.write(json.dumps(record) + "\n")
+            except OSError:
+                pass  # metrics must never break a response
+        return record
+
+    def stats(self):
+        if not self.records:
+            return "No requests yet"
+        last = self.records[-1]
+        lines = [f"Last request ({last['model']}{', cached' if last['cached'] else ''}):",
+                 self._format(last)]
+        if len(self.records) > 1:
+            fields = ["connect_ms", "ttft_ms", "gap_p50_ms", "gap_p95_ms", "tokens_per_s", "render_ms_per_chunk",
+                      "voice_blocked_ms", "total_ms"]
+            median = {field: percentile([r[field] for r in self.records if r[field] is not None], 50)
+                      for field in fields}
+            lines += [f"Session median over {len(self.records)} requests:", self._format(median)]
+        if self.metrics_path:
+            lines.append(f"Metrics are appended to {self.metrics_path}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _format(record):
+        def value(field, unit, precision=0):
+            number = record.get(field)
+            return "-" if number is None else f"{number:.{precision}f}{unit}"
+        return f"  connect {value('connect_ms', ' ms')}, first token {value('ttft_ms', ' ms')}, " \
+               f"inter-token p50/p95 {value('gap_p50_ms', '', 1)}/{value('gap_p95_ms', ' ms', 1)}, " \
+               f"{value('tokens_per_s', ' tokens/s', 1)}\n" \
+               f"  render {value('render_ms_per_chunk', ' ms', 2)} per chunk, " \
+               f"voice blocked {value('voice_blocked_ms', ' ms')}, total {value('total_ms', ' ms')}"
@@ -0,0 +1,84 @@
+from gpterm.tokens import set_encoding_name
+
+
+class ModelInfo:
+    """
+    Capabilities of a model: context window (prompt and response tokens), chat or text completion endpoint,
+    tokenizer (tiktoken encoding name, None to look it up by model name), prices in $ per 1k prompt and completion
+    tokens, and the max tokens of a response (None when only the context window limits it)
+    """
+    __slots__ = ('name', 'context_window', 'chat', 'tokenizer', 'prompt_price', 'completion_price', 'max_output')
+
+    def __init__(self, name, context_window, chat, tokenizer=None, prompt_price=0.0, completion_price=0.0,
+                 max_output=None):
+        self.name = name
+        self.context_window = context_window
+        self.chat = chat
+        self.tokenizer = tokenizer
+        self.prompt_price = prompt_price
+        self.completion_price = completion_price
+        self.max_output = max_output
+
+    def cost(self, prompt_tokens, completion_tokens):
+        return (prompt_tokens * self.prompt_price + completion_tokens * self.completion_price) / 1000
+
+    def describe(self):
+        endpoint = "chat" if self.chat else "text completion"
+        max_output = f", responses up to {self.max_output} tokens" if self.max_output else ""
+        return f"{self.context_window} tokens context, {endpoint} endpoint{max_output}, " \
+               f"${self.prompt_price:g} / ${self.completion_price:g} per 1k prompt / completion tokens"
+
+
+# see: https://platform.openai.com/docs/models and https://openai.com/pricing
+DEFAULT_MODELS = {
+    "gpt-3.5-turbo": dict(context_window=4096, chat=True, tokenizer="cl100k_base",
+                          prompt_price=0.0015, completion_price=0.002),
+    "gpt-3.5-turbo-16k": dict(context_window=16384, chat=True, tokenizer="cl100k_base",
+                              prompt_price=0.003, completion_price=0.004),
+    "gpt-4": dict(context_window=8192, chat=True, tokenizer="cl100k_base", prompt_price=0.03, completion_price=0.06),
+    "gpt-4-32k": dict(context_window=32768, chat=True, tokenizer="cl100k_base",
+                      prompt_price=0.06, completion_price=0.12),
+    "text-davinci-003": dict(context_window=4096, chat=False, tokenizer="p50k_base",
+                             prompt_price=0.02, completion_price=0.02),
+    "text-curie-001": dict(context_window=2048, chat=False, tokenizer="r50k_base",
+                           prompt_price=0.002, completion_price=0.002),
+    "text-babbage-001": dict(context_window=2048, chat=False, tokenizer="r50k_base",
+                             prompt_price=0.0005, completion_price=0.0005),
+    "text-ada-001": dict(context_window=2048, chat=False, tokenizer="r50k_base",
+                         prompt_price=0.0004, completion_price=0.0004),
+}
+
+
+class ModelRegistry:
+    """
+    Model capabilities: the defaults above, updated by the 'models' section of the config (model name to any of
+    the ModelInfo fields), so a new model is set up without code changes. A model that is not listed is assumed
+    to be a chat model if its name starts with gpt- (4096 tokens), and a 2048 tokens text completion model otherwise
+    """
+    def __init__(self, config_models=None):
+        self.models = {}
+        for name, fields in DEFAULT_MODELS.items():
+            self.models[name] = ModelInfo(name, **fields)
+        for name, fields in (config_models or {}).items():
+            known = self.models.get(name) or self._guess(name)
+            merged = {field: getattr(known, field) for field in ModelInfo.__slots__ if field != 'name'}
+            unknown = set(fields or {}) - set(merged)
+            if unknown:
+                raise ValueError(f"unknown fields for model {name} in config: {', '.join(sorted(unknown))}")
+            merged.update(fields or {})
+            self.models[name] = ModelInfo(name, **merged)
+        for info in self.models.values():
+            if info.tokenizer:
+                set_encoding_name(info.name, info.tokenizer)
+
+    @staticmethod
+    def _guess(name):
+        if name.startswith('gpt-'):
+            return ModelInfo(name, context_window=4096, chat=True)
+        return ModelInfo(name, context_window=2048, chat=False)
+
+    def get(self, name):
+        info = self.models.get(name)
+        if info is None:
+            info = self.models[name] = self._guess(name)
+        return info
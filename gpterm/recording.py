@@ -0,0 +1,99 @@
+import json
+import time
+from gpterm.streams import TeeStream
+
+# A recording is a jsonl file. Each response starts with a header object, followed by a [ms, choice] line per
+# stream chunk (ms since the request was sent, choice is the raw choices[0] of the chunk), and ends with
+# {"end": ms}, {"closed": ms} when gpterm stopped reading the stream, or {"error": ..., "at": ms}
+
+
+class RecordedStreamError(Exception):
+    pass
+
+
+class StreamRecorder:
+    """
+    Appends the raw chunks of every streamed response to a recording file, for 'gpterm replay'
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fp = None
+
+    def write(self, item, flush=False):
+        if self.fp is None:
+            self.fp = open(self.path, 'a')
+        self.fp.write(json.dumps(item, separators=(',', ':')) + "\n")
+        if flush:
+            self.fp.flush()
+
+    def record(self, completion, start, model, is_chat, prompt, after_reset):
+        """
+        Pass a completion stream through and write its chunks with their arrival times
+        """
+        self.write({"time": time.time(), "model": model, "chat": is_chat, "prompt": prompt, "after_reset": after_reset})
+
+        def elapsed_ms():
+            return round((time.perf_counter() - start) * 1000, 1)
+        return TeeStream(
+            completion,
+            on_chunk=lambda obj: self.write([elapsed_ms(), obj.choices[0].to_dict_recursive()]),
+            on_end=lambda: self.write({"end": elapsed_ms()}, flush=True),
+            on_error=lambda e: self.write({"error": str(e) or type(e).__name__, "at": elapsed_ms()}, flush=True),
+            on_close=lambda: self.write({"closed": elapsed_ms()}, flush=True))
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
+class ReplayStream:
+    """
+    Plays back the chunks of a recorded response with their original timing divided by speed
+    (0 for as fast as possible)
+    """
+    def __init__(self, chunks, end_event, speed=1.0):
+        self.chunks = chunks
+        self.end_event = end_event
+        self.speed = speed
+        self.closed = False
+
+    def __iter__(self):
+        from openai.util import convert_to_openai_object
+        start = time.perf_counter()
+        for elapsed_ms, choice in self.chunks:
+            if self.closed:
+                return
+            if self.speed:
+                delay = start + elapsed_ms / 1000 / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            yield convert_to_openai_object({"choices": [choice]})
+        if self.end_event and 'error' in self.end_event:
+            raise RecordedStreamError(f"recorded stream error: {self.end_event['error']}")
+
+    def close(self):
+        self.closed = True
+
+
+def read_recording(path):
+    """
+    Yield (header, chunks, end_event) for each response in a recording. end_event is None for a cut off recording
+    """
+    header, chunks, end_event = None, [], None
+    with open(path) as fp:
+        for line in fp:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue  # cut short by an interrupted session
+            if isinstance(item, list):
+                chunks.append(item)
+            elif 'model' in item:
+                if header is not None:
+                    yield header, chunks, end_event
+                header, chunks, end_event = item, [], None
+            else:
+                end_event = item
+    if header is not None:
+        yield header, chunks, end_event
@@ -0,0 +1,56 @@
+import time
+import threading
+
+
+class StreamRenderer:
+    """
+    Buffers streamed response text and writes it to the console at most once per frame, or right away on a newline
+    A background thread writes out text that is left in the buffer when the stream stalls
+    """
+    def __init__(self, console, fps=30):
+        self.console = console
+        self.frame_interval = 1 / fps if fps > 0 else 0
+        self.buffer = []
+        self.style = None
+        self.last_flush = 0
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def start(self):
+        if self.frame_interval and self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def write(self, text, style=None):
+        with self.cond:
+            if style != self.style:
+                self._flush()
+                self.style = style
+            self.buffer.append(text)
+            if '\n' in text or time.monotonic() - self.last_flush >= self.frame_interval:
+                self._flush()
+            else:
+                self.cond.notify()
+
+    def flush(self):
+        with self.cond:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            text = ''.join(self.buffer)
+            self.buffer = []
+            self.console.print(text, style=self.style, markup=False, end='')
+        self.last_flush = time.monotonic()
+
+    def _run(self):
+        with self.cond:
+            while True:
+                if not self.buffer:
+                    self.cond.wait()
+                    continue
+                delay = self.last_flush + self.frame_interval - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                self._flush()
@@ -0,0 +1,99 @@
+from gpterm.cache import chunk_for_delta
+
+
+def overlap_length(previous, new, min_overlap=4):
+    """
+    Length of the longest start of new that previous ends with (0 if shorter than min_overlap)
+    """
+    for length in range(min(len(previous), len(new)), min_overlap - 1, -1):
+        if previous.endswith(new[:length]):
+            return length
+    return 0
+
+
+def is_stream_error(e):
+    """
+    Errors of a connection that dropped while a response was streaming
+    """
+    import openai
+    import requests
+    from gpterm.scheduler import RequestScheduler
+    if isinstance(e, openai.error.OpenAIError):
+        return RequestScheduler.is_retryable(e) or (isinstance(e, openai.error.APIError) and e.http_status is None)
+    return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                          requests.exceptions.Timeout, ConnectionError, TimeoutError))
+
+
+class ResumableStream:
+    """
+    Passes a completion stream through, and when its connection drops, continues with a new request for the rest
+    of the response (resume(partial_text) returns it, or None to give up). A continuation often repeats the end of
+    the partial response, that overlap is dropped. on_overlap is called with the number of chunks of the
+    continuation that were dropped or merged into one, as they aren't passed on
+    """
+    def __init__(self, completion, get_response, is_chat, resume, max_resumes=3, max_overlap_chars=2000,
+                 on_resume=None, on_overlap=None):
+        self.completion = completion
+        self.get_response = get_response
+        self.is_chat = is_chat
+        self.resume = resume
+        self.max_resumes = max_resumes
+        self.max_overlap_chars = max_overlap_chars
+        self.on_resume = on_resume
+        self.on_overlap = on_overlap
+        self.num_resumes = 0
+        self.closed = False
+
+    def __iter__(self):
+        deltas = []
+        completion = self.completion
+        overlap_buffer = None  # deltas of a continuation, until it is long enough to find the overlap
+        while True:
+            try:
+                for obj in completion:
+                    response = self.get_response(obj)
+                    if overlap_buffer is None or response is None:
+                        if response is not None:
+                            deltas.append(response)
+                        yield obj
+                        continue
+                    overlap_buffer.append(response)
+                    if len(''.join(overlap_buffer)) >= min(len(''.join(deltas)), self.max_overlap_chars):
+                        buffered, overlap_buffer = overlap_buffer, None
+                        yield from self._dedupe(buffered, deltas)
+                if overlap_buffer:
+                    yield from self._dedupe(overlap_buffer, deltas)
+                return
+            except Exception as e:
+                if self.closed or self.num_resumes >= self.max_resumes or not is_stream_error(e):
+                    raise
+                if overlap_buffer:  # dropped again before the overlap was found
+                    yield from self._dedupe(overlap_buffer, deltas)
+                partial = ''.join(deltas)
+                completion = self.resume(partial)
+                if completion is None:
+                    raise
+                self.completion = completion
+                self.num_resumes += 1
+                if self.on_resume:
+                    self.on_resume(e)
+                overlap_buffer = [] if partial else None
+
+    def _dedupe(self, overlap_buffer, deltas):
+        partial, buffered = ''.join(deltas), ''.join(overlap_buffer)
+        text = buffered[overlap_length(partial, buffered):]
+        if text == buffered:
+            # text completions may start a continuation with a newline before repeating the overlap
+            stripped = buffered.lstrip()
+            length = overlap_length(partial, stripped)
+            if length:
+                text = stripped[length:]
+        if self.on_overlap:
+            self.on_overlap(len(overlap_buffer) - (1 if text else 0))
+        if text:
+            deltas.append(text)
+            yield chunk_for_delta(text, self.is_chat)
+
+    def close(self):
+        self.closed = True
+        self.completion.close()
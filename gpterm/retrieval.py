@@ -0,0 +1,133 @@
+import re
+import math
+from collections import Counter, defaultdict
+from gpterm.enums import Role
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def terms(text):
+    return [word.lower() for word in _WORD_RE.findall(text)]
+
+
+class TermIndex:
+    """
+    Inverted index of the terms of turns, for BM25 scoring. Turns are added and removed as they enter and leave
+    the candidate turns, so the terms of a turn are only computed once (again if text was added to it), and
+    scoring only visits the turns that have a query term
+    """
+    def __init__(self):
+        self.postings = defaultdict(dict)  # term -> {turn: frequency of the term in the turn}
+        self.docs = {}  # turn -> (length of its text when indexed, number of terms, its distinct terms)
+        self.total_length = 0
+
+    def add(self, turn):
+        text = turn.text()
+        counts = Counter(terms(text))
+        for term, freq in counts.items():
+            self.postings[term][turn] = freq
+        length = sum(counts.values())
+        self.docs[turn] = (len(text), length, tuple(counts))
+        self.total_length += length
+
+    def remove(self, turn):
+        _, length, doc_terms = self.docs.pop(turn)
+        for term in doc_terms:
+            postings = self.postings[term]
+            del postings[turn]
+            if not postings:
+                del self.postings[term]
+        self.total_length -= length
+
+    def sync(self, turns):
+        """
+        Index exactly these turns: drop the ones that left them (evicted, or the context was reset),
+        add the new ones, and index again the ones that text was added to (turn text only grows)
+        """
+        current = set(turns)
+        for turn in [turn for turn in self.docs if turn not in current]:
+            self.remove(turn)
+        for turn in turns:
+            doc = self.docs.get(turn)
+            if doc is not None:
+                if doc[0] == len(turn.text()):
+                    continue
+                self.remove(turn)
+            self.add(turn)
+
+    def scores(self, query, k1=1.5, b=0.75):
+        """
+        BM25 score of each indexed turn that has any of the query terms
+        """
+        num_docs = len(self.docs)
+        avg_length = self.total_length / num_docs if num_docs else 0
+        scores = defaultdict(float)
+        for term in set(query):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for turn, freq in postings.items():
+                length = self.docs[turn][1]
+                scores[turn] += idf * freq * (k1 + 1) / (freq + k1 * (1 - b + b * length / (avg_length or 1)))
+        return scores
+
+
+class ContextRetriever:
+    """
+    Picks the turns of the conversation to send with a prompt: the pinned turns, the most recent turns,
+    and the earlier turns that are most relevant to the prompt (by BM25), each with the turn it belongs with
+    (a prompt with its response), within a token budget. Everything is computed locally, from an index of the
+    terms of the earlier turns that is kept up to date as turns are added and evicted
+    """
+    def __init__(self, top_k=4, recent=4):
+        self.top_k = top_k
+        self.recent = recent
+        self.index = TermIndex()
+
+    @staticmethod
+    def _partner(turns, idx):
+        if turns[idx].role == Role.assistant and idx > 0 and turns[idx - 1].role == Role.user:
+            return idx - 1
+        if turns[idx].role == Role.user and idx + 1 < len(turns) and turns[idx + 1].role == Role.assistant:
+            return idx + 1
+        return None
+
+    def select(self, conversation, max_tokens):
+        """
+        The turns to send, in conversation order
+        """
+        turns = conversation.turns
+        first_candidate = conversation.pinned
+        last_candidate = max(first_candidate, len(turns) - self.recent)
+        if last_candidate > first_candidate and self._partner(turns, last_candidate) == last_candidate - 1:
+            # the recent turns start with a prompt, not with a response without the prompt it answered
+            last_candidate -= 1
+        if last_candidate - first_candidate <= 0:
+            return turns
+        selected = set(range(first_candidate)) | set(range(last_candidate, len(turns)))
+        used = sum(turns[idx].tokens for idx in selected)
+        query = terms(turns[-1].text()) if turns else []
+        candidates = turns[first_candidate:last_candidate]
+        self.index.sync(candidates)
+        scores = self.index.scores(query)
+        ranked = sorted(((scores[turn], idx) for idx, turn in enumerate(candidates, start=first_candidate)
+                         if turn in scores), reverse=True)
+        num_matches = 0
+        for score, idx in ranked:
+            if num_matches >= self.top_k or score <= 0:
+                break
+            if idx in selected:
+                continue
+            group = {idx}
+            partner = self._partner(turns, idx)
+            if partner is not None and first_candidate <= partner < last_candidate:
+                group.add(partner)
+            group -= selected
+            group_tokens = sum(turns[member].tokens for member in group)
+            if used + group_tokens > max_tokens:
+                continue
+            selected |= group
+            used += group_tokens
+            num_matches += 1
+        return [turns[idx] for idx in sorted(selected)]
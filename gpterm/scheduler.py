@@ -0,0 +1,119 @@
+import time
+import random
+import threading
+
+
+class TokenBucket:
+    """
+    Allows 'rate' units per minute. Callers reserve units and get the time they have to wait for them,
+    so concurrent callers queue up instead of all retrying at once
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.per_second = rate / 60
+        self.available = rate
+        self.updated = time.monotonic()
+
+    def reserve(self, amount):
+        now = time.monotonic()
+        self.available = min(self.rate, self.available + (now - self.updated) * self.per_second)
+        self.updated = now
+        self.available -= amount
+        if self.available >= 0:
+            return 0
+        return -self.available / self.per_second
+
+
+class RequestScheduler:
+    """
+    Shared gate in front of the OpenAI API calls. Spaces requests to stay within the requests-per-minute and
+    tokens-per-minute limits (0 for no limit), and retries rate limited and server errors with jittered
+    exponential backoff, honoring the Retry-After header. The prompt tokens of a call are reserved once, however
+    many times it is retried, and the completion tokens are charged with charge() once they are known
+    """
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, max_retries=5, base_delay=1, max_delay=60,
+                 on_retry=None):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.on_retry = on_retry
+        self.lock = threading.Lock()
+        self.blocked_until = 0  # set from a Retry-After, holds back all requests
+        self.num_requests = 0
+        self.num_retries = 0
+
+    def wait_for_capacity(self, tokens=0):
+        """
+        Wait for a request slot, and for tokens (0 on a retry, the tokens were reserved by the first attempt)
+        """
+        with self.lock:
+            delay = max(0, self.blocked_until - time.monotonic())
+            if self.request_bucket:
+                delay = max(delay, self.request_bucket.reserve(1))
+            if self.token_bucket and tokens:
+                delay = max(delay, self.token_bucket.reserve(tokens))
+        if delay > 0:
+            time.sleep(delay)
+
+    def charge(self, tokens):
+        """
+        Count tokens used by a call after it was made (its completion), so the next calls wait for them
+        """
+        if self.token_bucket and tokens:
+            with self.lock:
+                self.token_bucket.reserve(tokens)
+
+    def call(self, create, tokens=0, **kwargs):
+        """
+        tokens: the prompt tokens of the request
+        """
+        import openai
+        attempt = 0
+        while True:
+            self.wait_for_capacity(tokens if attempt == 0 else 0)
+            try:
+                self.num_requests += 1
+                return create(**kwargs)
+            except openai.error.OpenAIError as e:
+                if attempt >= self.max_retries or not self.is_retryable(e):
+                    raise
+                delay = self.retry_delay(e, attempt)
+                self.num_retries += 1
+                if self.on_retry:
+                    self.on_retry(e, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    @staticmethod
+    def is_retryable(e):
+        import openai
+        if isinstance(e, openai.error.RateLimitError):
+            return e.code != 'insufficient_quota'
+        if isinstance(e, (openai.error.ServiceUnavailableError, openai.error.TryAgain, openai.error.Timeout,
+                          openai.error.APIConnectionError)):
+            return True
+        if isinstance(e, openai.error.APIError):
+            return e.http_status is not None and e.http_status >= 500
+        return False
+
+    def retry_delay(self, e, attempt):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = self.retry_after(e)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+            with self.lock:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        return delay
+
+    @staticmethod
+    def retry_after(e):
+        headers = e.headers or {}
+        for key, value in headers.items():
+            if key.lower() == 'retry-after':
+                try:
+                    return float(value)
+                except ValueError:
+                    return None
+        return None
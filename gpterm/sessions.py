@@ -0,0 +1,243 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import NamedTuple, Optional
+from gpterm.enums import Role
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    model TEXT NOT NULL,
+    title TEXT,
+    num_turns INTEGER NOT NULL DEFAULT 0,
+    pinned INTEGER NOT NULL DEFAULT 0  -- number of leading turns that are never evicted (the code format directive)
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS turns_session_seq ON turns(session_id, seq);
+"""
+
+# full text index of the turns, kept up to date by triggers (turns are inserted, and updated when text is added)
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE turns_fts USING fts5(content, content='turns', content_rowid='id');
+CREATE TRIGGER turns_fts_insert AFTER INSERT ON turns BEGIN
+    INSERT INTO turns_fts(rowid, content) VALUES (new.id, new.content);
+END;
+INSERT INTO turns_fts(turns_fts) VALUES ('rebuild');
+"""
+
+# created separately, the index of a database from before turns were updated has no update trigger
+FTS_UPDATE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS turns_fts_update AFTER UPDATE OF content ON turns BEGIN
+    INSERT INTO turns_fts(turns_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    INSERT INTO turns_fts(rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+HIGHLIGHT_START, HIGHLIGHT_END = "\x02", "\x03"
+
+
+def fts_query(terms):
+    """
+    Match all the terms, taken literally (a trailing * matches a prefix)
+    """
+    parts = []
+    for term in terms.split():
+        prefix = term.endswith('*') and len(term) > 1
+        term = term.rstrip('*').replace('"', '""')
+        if term:
+            parts.append(f'"{term}"*' if prefix else f'"{term}"')
+    return ' '.join(parts)
+
+
+class SessionInfo(NamedTuple):
+    id: int
+    created: float
+    updated: float
+    model: str
+    title: Optional[str]
+    num_turns: int
+    pinned: int
+
+
+SESSION_COLUMNS = "id, created, updated, model, title, num_turns, pinned"
+
+
+class StoredTurn:
+    __slots__ = ('seq', 'role', 'content', 'tokens')
+
+    def __init__(self, seq, role, content, tokens):
+        self.seq = seq
+        self.role = Role(role)
+        self.content = content
+        self.tokens = tokens
+
+
+class SessionStore:
+    """
+    Store of the chat sessions in a SQLite database. Turns are written as they complete, with their token counts,
+    so a session is resumed without reading or tokenizing its full history, and rewritten if text is added to them
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.has_fts = False
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.conn is None:
+            db_dir = os.path.dirname(self.path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self.has_fts = self._setup_fts(conn)
+            self.conn = conn
+        return self.conn
+
+    @staticmethod
+    def _setup_fts(conn):
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'turns_fts'").fetchone():
+            try:
+                with conn:
+                    conn.executescript(FTS_SCHEMA)  # also indexes turns stored before the index existed
+            except sqlite3.OperationalError:
+                return False  # sqlite built without FTS5
+        conn.executescript(FTS_UPDATE_TRIGGER)
+        return True
+
+    def create_session(self, model):
+        with self.lock:
+            conn = self._connect()
+            now = time.time()
+            with conn:
+                cursor = conn.execute("INSERT INTO sessions (created, updated, model) VALUES (?, ?, ?)",
+                                      (now, now, model))
+            return cursor.lastrowid
+
+    def append_turns(self, session_id, turns, pinned=0):
+        """
+        turns: (role, content, tokens) tuples, in order. pinned: number of leading turns of the session that are pinned
+        Returns the seq (position in the session) of the first turn
+        """
+        with self.lock:
+            conn = self._connect()
+            now = time.time()
+            with conn:
+                num_turns, title = conn.execute("SELECT num_turns, title FROM sessions WHERE id = ?",
+                                                (session_id,)).fetchone()
+                conn.executemany("INSERT INTO turns (session_id, seq, role, content, tokens, created) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)",
+                                 [(session_id, num_turns + idx, role.value, content, tokens, now)
+                                  for idx, (role, content, tokens) in enumerate(turns)])
+                if title is None:
+                    title = next((content.strip() for idx, (role, content, _) in enumerate(turns, start=num_turns)
+                                  if role == Role.user and idx >= pinned), None)
+                conn.execute("UPDATE sessions SET updated = ?, num_turns = ?, title = ?, pinned = ? WHERE id = ?",
+                             (now, num_turns + len(turns), title, pinned, session_id))
+            return num_turns
+
+    def update_turns(self, session_id, turns):
+        """
+        Rewrite stored turns that text was added to. turns: (seq, content, tokens) tuples
+        """
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("UPDATE turns SET content = ?, tokens = ? WHERE session_id = ? AND seq = ?",
+                                 [(content, tokens, session_id, seq) for seq, content, tokens in turns])
+                conn.execute("UPDATE sessions SET updated = ? WHERE id = ?", (time.time(), session_id))
+
+    def set_pinned(self, session_id, pinned):
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                # a title taken from a turn that is now pinned (the code format directive) is dropped
+                conn.execute("UPDATE sessions SET pinned = ?, title = CASE WHEN num_turns <= ? THEN NULL ELSE title END "
+                             "WHERE id = ?", (pinned, pinned, session_id))
+
+    def session(self, session_id):
+        with self.lock:
+            row = self._connect().execute(f"SELECT {SESSION_COLUMNS} FROM sessions WHERE id = ?",
+                                          (session_id,)).fetchone()
+        return SessionInfo(*row) if row else None
+
+    def list_sessions(self, limit=20):
+        """
+        Most recently updated sessions that have more than their pinned turns
+        """
+        with self.lock:
+            rows = self._connect().execute(
+                f"SELECT {SESSION_COLUMNS} FROM sessions "
+                "WHERE num_turns > pinned ORDER BY updated DESC LIMIT ?", (limit,)).fetchall()
+        return [SessionInfo(*row) for row in rows]
+
+    def last_session_id(self, exclude=None):
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT id FROM sessions WHERE num_turns > pinned AND id IS NOT ? ORDER BY updated DESC LIMIT 1",
+                (exclude,)).fetchone()
+        return row[0] if row else None
+
+    def load_tail(self, session_id, max_tokens):
+        """
+        The pinned turns of a session and the most recent turns that fit in max_tokens with them.
+        Only the rows of those turns are read, newest first
+        """
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute("SELECT pinned FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                raise KeyError(session_id)
+            pinned = [StoredTurn(*turn) for turn in conn.execute(
+                "SELECT seq, role, content, tokens FROM turns WHERE session_id = ? AND seq < ? ORDER BY seq",
+                (session_id, row[0]))]
+            budget = max_tokens - sum(turn.tokens for turn in pinned)
+            tail = []
+            for turn in conn.execute("SELECT seq, role, content, tokens FROM turns "
+                                     "WHERE session_id = ? AND seq >= ? ORDER BY seq DESC", (session_id, row[0])):
+                turn = StoredTurn(*turn)
+                if turn.tokens > budget:
+                    break
+                budget -= turn.tokens
+                tail.append(turn)
+        # don't start with a response without the prompt it answered
+        while tail and tail[-1].role == Role.assistant:
+            tail.pop()
+        return pinned, tail[::-1]
+
+    def search(self, terms, limit=10):
+        """
+        Turns matching all the terms, best matches first: (session_id, seq, role, created, session title, snippet)
+        Matched words in the snippet are between HIGHLIGHT_START and HIGHLIGHT_END
+        """
+        query = fts_query(terms)
+        if not query:
+            return []
+        with self.lock:
+            conn = self._connect()
+            if not self.has_fts:
+                raise RuntimeError("search needs SQLite with FTS5")
+            return conn.execute(
+                "SELECT t.session_id, t.seq, t.role, t.created, s.title, "
+                f"snippet(turns_fts, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 16) "
+                "FROM turns_fts JOIN turns t ON t.id = turns_fts.rowid JOIN sessions s ON s.id = t.session_id "
+                "WHERE turns_fts MATCH ? ORDER BY turns_fts.rank LIMIT ?", (query, limit)).fetchall()
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
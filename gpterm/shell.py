@@ -30,7 +30,17 @@ class ShellHandler(cmd.Cmd):
             "/abort": self.handle_exit,
             "/save": self.handle_save,
             "/reset": self.handle_reset,
+            "/sessions": self.handle_sessions,
+            "/resume": self.handle_resume,
+            "/search": self.handle_search,
+            "/cache": self.handle_cache,
+            "/usage": self.handle_usage,
+            "/stats": self.handle_stats,
+            "/compare": self.handle_compare,
             "/context": self.handle_context,
+            "/context-summary": self.handle_context_summary,
+            "/hedge": self.handle_hedge,
+            "/retrieval": self.handle_retrieval,
             "/theme": self.handle_theme,
             "/code": self.handle_code,
             "/advanced": self.handle_advanced,
@@ -41,6 +51,7 @@ class ShellHandler(cmd.Cmd):
             "/model": self.handle_model,
             "/temperature": self.handle_temperature,
             "/block": self.handle_block,
+            "/file": self.handle_file,
             "/image": self.handle_image,
             "/image-size": self.handle_image_size,
             "/image-view": self.handle_image_view,
@@ -122,12 +133,62 @@ class ShellHandler(cmd.Cmd):
         return msg
 
     def handle_reset(self, _):
+        self.gpterm.new_session()
         self.gpterm.reset_context(prompt="", submit=True)
         msg = f"[bold red]*** Chat context reset ***[/]"
         return msg
 
+    def handle_sessions(self, _):
+        return self.gpterm.format_sessions()
+
+    def handle_resume(self, command):
+        if len(command) == 1:
+            return self.gpterm.resume_session()
+        try:
+            return self.gpterm.resume_session(int(command[1]))
+        except ValueError:
+            return "Command format: /resume [session id]"
+
+    def handle_search(self, command):
+        if len(command) < 2:
+            return "Command format: /search <terms>"
+        return self.gpterm.search_sessions(' '.join(command[1:]))
+
+    def handle_usage(self, _):
+        return self.gpterm.format_usage()
+
+    def handle_cache(self, command):
+        if len(command) == 2:
+            if command[1] != "clear":
+                return "Command format: /cache [clear]"
+            self.gpterm.response_cache.clear()
+            self.gpterm.similar_cache.clear()
+            return "Response cache cleared"
+        return f"{self.gpterm.response_cache.stats()}\n{self.gpterm.similar_cache.stats()}"
+
+    def handle_stats(self, _):
+        msg = self.gpterm.metrics.stats()
+        if self.gpterm.cfg.hedge_requests or self.gpterm.hedger.num_requests:
+            msg += f"\n{self.gpterm.hedger.stats()}"
+        return msg
+
     def handle_context(self, _):
-        self.gpterm.print_info(f"{self.gpterm.conversation_formatted}")
+        self.gpterm.print_info(self.gpterm.format_conversation())
+
+    def handle_context_summary(self, _):
+        on = self.gpterm.toggle_context_summary()
+        msg = f"Context summary = {on}"
+        return msg
+
+    def handle_hedge(self, _):
+        on = self.gpterm.toggle_hedge_requests()
+        msg = f"Hedged requests = {on}"
+        return msg
+
+    def handle_retrieval(self, _):
+        on = self.gpterm.toggle_retrieval()
+        msg = f"Retrieval = {on}"
+        return msg
 
     def handle_theme(self, _):
         theme = self.gpterm.toggle_theme()
@@ -176,15 +237,29 @@ class ShellHandler(cmd.Cmd):
         return msg
 
     def handle_model(self, command):
-        msg = f"Command format: /model <mode_name>\nCurrent model: {model_name_for_print(self.gpterm.cfg.model)}"
+        msg = f"Command format: /model <mode_name>\nCurrent model: {model_name_for_print(self.gpterm.cfg.model)}: " \
+              f"{self.gpterm.model_info.describe()}"
         if len(command) == 2:
             self.gpterm.cfg.model = model_from_alias(command[1])
+            self.gpterm.resolve_model()
             msg = self.handle_reset(None)
             self.gpterm.calc_max_tokens()
             self.gpterm.update_shell_prompt()
             msg += f"\nGPT Model set to {model_name_for_print(self.gpterm.cfg.model)}"
         return msg
 
+    def handle_compare(self, command):
+        msg = "Command format: /compare <model>,<model>[,...] [prompt]\nWithout a prompt the last prompt is used"
+        if len(command) < 2:
+            return msg
+        models = [model_from_alias(model) for model in command[1].split(',') if model]
+        if len(models) < 2:
+            return msg
+        prompt = ' '.join(command[2:]) or self.gpterm.prompt.strip()
+        if not prompt:
+            return "No prompt to compare yet\n" + msg
+        self.gpterm.compare_models(models, prompt)
+
     def handle_temperature(self, command):
         msg = "Command format: /temperature <value between 0-1>"
         if len(command) == 2:
@@ -202,6 +277,14 @@ class ShellHandler(cmd.Cmd):
         if prompt:
             self.gpterm.submit_prompt(prompt)
 
+    def handle_file(self, command):
+        if len(command) < 2:
+            return "Command format: /file <path> [question]"
+        path = os.path.expanduser(command[1])
+        if not os.path.isfile(path):
+            return f"File not found: {path}"
+        self.gpterm.submit_file(path, ' '.join(command[2:]))
+
     def handle_image(self, _):
         prompt = self.get_multiline(instruction="Enter multi-line input to describe image")
         if prompt:
@@ -249,7 +332,8 @@ class ShellHandler(cmd.Cmd):
         return msg
 
     def handle_code_initial(self, _):
-        self.gpterm.apply_code_format_directive()
+        if len(self.gpterm.conversation) == 0:  # a resumed session already has it
+            self.gpterm.apply_code_format_directive()
 
     def handle_command(self, command):
         if not command:
@@ -0,0 +1,32 @@
+class TeeStream:
+    """
+    Passes a completion stream through and hands each chunk to on_chunk. on_end is called when the stream was read
+    to its end, on_error with the exception of a stream that failed, and on_close when the reader stopped early
+    with close()
+    """
+    def __init__(self, completion, on_chunk, on_end=None, on_error=None, on_close=None):
+        self.completion = completion
+        self.on_chunk = on_chunk
+        self.on_end = on_end
+        self.on_error = on_error
+        self.on_close = on_close
+        self.closed = False
+
+    def __iter__(self):
+        try:
+            for obj in self.completion:
+                self.on_chunk(obj)
+                yield obj
+        except Exception as e:
+            if self.on_error:
+                self.on_error(e)
+            raise
+        if not self.closed and self.on_end:
+            self.on_end()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.on_close:
+                self.on_close()
+        self.completion.close()
@@ -0,0 +1,78 @@
+_encodings = {}
+_encoding_names = {}  # model -> tiktoken encoding name, set by the model registry
+_encoding_override = None
+
+
+def use_encoding(encoding):
+    """
+    Use encoding (an object with encode and decode) for every model instead of tiktoken's, or None to go back
+    to tiktoken. Benchmarks and tests use a local stand-in, so they don't download the tiktoken files
+    """
+    global _encoding_override
+    _encoding_override = encoding
+
+
+def set_encoding_name(model, encoding_name):
+    if _encoding_names.get(model) != encoding_name:
+        _encoding_names[model] = encoding_name
+        _encodings.pop(model, None)
+
+
+def encoding_for_model(model):
+    # tiktoken.encoding_for_model is costly to call per prompt, keep one encoder per model
+    if _encoding_override is not None:
+        return _encoding_override
+    encoding = _encodings.get(model)
+    if encoding is None:
+        import tiktoken  # slow to import, loaded on first use
+        encoding_name = _encoding_names.get(model)
+        try:
+            encoding = tiktoken.get_encoding(encoding_name) if encoding_name else tiktoken.encoding_for_model(model)
+        except (KeyError, ValueError):
+            encoding = tiktoken.get_encoding("cl100k_base")
+        _encodings[model] = encoding
+    return encoding
+
+
+def prompt_overhead(model, num_messages=1):
+    if model.startswith('gpt-3.5') or model.startswith('gpt-4'):
+        # tokens for each message header ("role": "user", "content": ) + response header (assistant)
+        return 4 * num_messages + 2
+    return 0
+
+
+class TokenLedger:
+    """
+    Running token count of the conversation. Every piece of text is encoded once, when it is added
+    """
+    def __init__(self, model):
+        self.model = model
+        self.encoding = None  # loaded on first use
+        self.total = 0
+
+    def reset(self, model=None):
+        if model and model != self.model:
+            self.model = model
+            self.encoding = None
+        self.total = 0
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.encoding is None:
+            self.encoding = encoding_for_model(self.model)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def add(self, text):
+        num_tokens = self.count(text)
+        self.total += num_tokens
+        return num_tokens
+
+    def add_counted(self, num_tokens):
+        self.total += num_tokens
+
+    def remove(self, num_tokens):
+        self.total -= num_tokens
+
+    def prompt_tokens(self, num_messages=1):
+        return self.total + prompt_overhead(self.model, num_messages)
@@ -0,0 +1,134 @@
+import os
+import datetime
+import sqlite3
+import threading
+from gpterm.utils import alias_for_model
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    day TEXT NOT NULL,  -- local date, YYYY-MM-DD
+    model TEXT NOT NULL,
+    session_id INTEGER NOT NULL,  -- 0 when sessions are not saved
+    requests INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, model, session_id)
+) WITHOUT ROWID;
+"""
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class UsageLedger:
+    """
+    Persistent totals of the requests, prompt and completion tokens and cost ($) per day, model and session,
+    in a SQLite database. Each request updates a single row, and the total of the current day is kept in memory
+    for the budget checks, so the ledger costs one small write per request
+    """
+    def __init__(self, path, soft_budget=0.0, hard_budget=0.0):
+        self.path = path
+        self.soft_budget = soft_budget  # $ per day, 0 for no budget
+        self.hard_budget = hard_budget
+        self.conn = None
+        self.day = None
+        self.day_cost = 0.0
+        self.warned_day = None  # the soft budget warning is shown once a day
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.conn is None:
+            db_dir = os.path.dirname(self.path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self.conn = conn
+        return self.conn
+
+    @staticmethod
+    def today():
+        return datetime.date.today().isoformat()
+
+    def _roll_day(self, conn):
+        today = self.today()
+        if self.day != today:
+            self.day = today
+            row = conn.execute("SELECT SUM(cost) FROM usage WHERE day = ?", (today,)).fetchone()
+            self.day_cost = row[0] or 0.0
+
+    def add(self, model, session_id, prompt_tokens, completion_tokens, cost, requests=1):
+        with self.lock:
+            conn = self._connect()
+            self._roll_day(conn)
+            with conn:
+                conn.execute("INSERT INTO usage (day, model, session_id, requests, prompt_tokens, completion_tokens, cost) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (day, model, session_id) DO UPDATE SET "
+                             "requests = requests + excluded.requests, prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                             "completion_tokens = completion_tokens + excluded.completion_tokens, "
+                             "cost = cost + excluded.cost",
+                             (self.day, model, session_id or 0, requests, prompt_tokens, completion_tokens, cost))
+            self.day_cost += cost
+
+    def check(self, prompt_cost=0.0):
+        """
+        Before a request: raises BudgetExceeded if it would go over the hard budget of the day.
+        Returns a warning the first time the day's soft budget is passed, else None
+        """
+        with self.lock:
+            self._roll_day(self._connect())
+            if self.hard_budget and self.day_cost + prompt_cost > self.hard_budget:
+                raise BudgetExceeded(f"daily budget of ${self.hard_budget:.2f} reached (${self.day_cost:.4f} spent "
+                                     f"today). Raise daily_hard_budget in the config to continue")
+            if self.soft_budget and self.day_cost + prompt_cost > self.soft_budget and self.warned_day != self.day:
+                self.warned_day = self.day
+                return f"${self.day_cost:.4f} spent today, over the soft daily budget of ${self.soft_budget:.2f}"
+        return None
+
+    def _totals(self, conn, where, params):
+        return conn.execute("SELECT COALESCE(SUM(requests), 0), COALESCE(SUM(prompt_tokens), 0), "
+                            f"COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(cost), 0) FROM usage WHERE {where}",
+                            params).fetchone()
+
+    @staticmethod
+    def _format(label, totals):
+        requests, prompt_tokens, completion_tokens, cost = totals
+        return f"{label:<20} {requests:>5} requests {prompt_tokens:>9,} in {completion_tokens:>9,} out  ${cost:.4f}"
+
+    def report(self, session_id=None, days=7):
+        with self.lock:
+            conn = self._connect()
+            self._roll_day(conn)
+            since = (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+            lines = [self._format(f"Today ({self.day})", self._totals(conn, "day = ?", (self.day,)))]
+            if session_id:
+                lines.append(self._format(f"Session {session_id}", self._totals(conn, "session_id = ?", (session_id,))))
+            lines.append(self._format(f"Last {days} days", self._totals(conn, "day >= ?", (since,))))
+            lines.append(self._format("All time", self._totals(conn, "1", ())))
+            by_model = conn.execute("SELECT model, SUM(requests), SUM(prompt_tokens), SUM(completion_tokens), "
+                                    "SUM(cost) FROM usage WHERE day >= ? GROUP BY model ORDER BY SUM(cost) DESC",
+                                    (since,)).fetchall()
+            by_day = conn.execute("SELECT day, SUM(requests), SUM(prompt_tokens), SUM(completion_tokens), SUM(cost) "
+                                  "FROM usage WHERE day >= ? GROUP BY day ORDER BY day DESC", (since,)).fetchall()
+        if by_model:
+            lines.append(f"By model, last {days} days:")
+            lines += [self._format(f"  {alias_for_model(row[0])}", row[1:]) for row in by_model]
+        if len(by_day) > 1:
+            lines.append("By day:")
+            lines += [self._format(f"  {row[0]}", row[1:]) for row in by_day]
+        budgets = [f"{name} ${budget:.2f}" for name, budget in (("soft", self.soft_budget), ("hard", self.hard_budget))
+                   if budget]
+        if budgets:
+            lines.append(f"Daily budget: {', '.join(budgets)}")
+        lines.append(f"Usage is kept in {self.path}")
+        return "\n".join(lines)
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
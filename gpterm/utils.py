@@ -1,23 +1,24 @@
+import time
+import threading
+from contextlib import contextmanager
 
-def model_from_alias(alias):
-    # see: https://beta.openai.com/docs/models
-    alias_to_model = {'chatgpt': "gpt-3.5-turbo",
-                      'davinci': "text-davinci-003",
-                      'curie': "text-curie-001",
-                      'babbage': "text-babbage-001",
-                      'ada': "text-ada-001"}
 
-    return alias_to_model.get(alias, alias)
+# see: https://beta.openai.com/docs/models
+ALIAS_TO_MODEL = {'chatgpt': "gpt-3.5-turbo",
+                  'gpt4': "gpt-4",
+                  'davinci': "text-davinci-003",
+                  'curie': "text-curie-001",
+                  'babbage': "text-babbage-001",
+                  'ada': "text-ada-001"}
+MODEL_TO_ALIAS = {model: alias for alias, model in ALIAS_TO_MODEL.items()}
 
 
-def alias_for_model(model):
-    model_to_alias = {"gpt-3.5-turbo": 'chatgpt',
-                      "text-davinci-003": 'davinci',
-                      "text-curie-001": 'curie',
-                      "text-babbage-001": 'babbage',
-                      "text-ada-001": 'ada'}
+def model_from_alias(alias):
+    return ALIAS_TO_MODEL.get(alias, alias)
 
-    return model_to_alias.get(model, model)
+
+def alias_for_model(model):
+    return MODEL_TO_ALIAS.get(model, model)
 
 
 def model_name_for_print(model):
@@ -26,3 +27,53 @@ def model_name_for_print(model):
     if model_alias != model:
         model_name_print = f"{model_alias} ({model})"
     return model_name_print
+
+
+def gpterm_version():
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        return version('gpterm')
+    except PackageNotFoundError:
+        return "(dev)"
+
+
+class StartupProfile:
+    """
+    Records how long each startup phase takes, including phases that run in background threads
+    """
+    def __init__(self, start_time, enabled=False):
+        self.start_time = start_time
+        self.enabled = enabled
+        self.phases = []
+        self.running = set()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        background = threading.current_thread() is not threading.main_thread()
+        start = time.perf_counter()
+        with self.lock:
+            self.running.add(name)
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.running.discard(name)
+                self.phases.append((name, (start - self.start_time) * 1000, (end - start) * 1000, background))
+
+    def mark(self, name):
+        with self.lock:
+            self.phases.append((name, (time.perf_counter() - self.start_time) * 1000, 0, False))
+
+    def report(self):
+        lines = [f"{'phase':<28} {'start ms':>9} {'took ms':>9}"]
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+            running = sorted(self.running)
+        for name, start_ms, took_ms, background in phases:
+            label = f"{name} (background)" if background else name
+            lines.append(f"{label:<28} {start_ms:>9.1f} {took_ms:>9.1f}")
+        for name in running:
+            lines.append(f"{name + ' (background)':<28} {'running':>9}")
+        return '\n'.join(lines)
@@ -0,0 +1,158 @@
+import os
+import queue
+import shlex
+import tempfile
+import threading
+import subprocess
+
+
+class SayBackend:
+    """
+    macOS text to speech. Sentences are rendered to an audio file with 'say -o' ahead of time and played with 'afplay',
+    so the next sentence is synthesized while the current one plays. Voice over mode speaks directly with 'say -i'
+    """
+    def __init__(self, cfg):
+        self.cfg = cfg
+
+    def synthesize(self, text):
+        if self.cfg.voice_over:
+            return None
+        fd, audio_path = tempfile.mkstemp(prefix="gpterm-voice-", suffix=".aiff")
+        os.close(fd)
+        try:
+            subprocess.check_call(['say', '-v', self.cfg.voice_name, '-o', audio_path, text])
+        except Exception:
+            os.remove(audio_path)
+            raise
+        return audio_path
+
+    def play(self, text, audio_path):
+        if audio_path is None:
+            command = ['say', '-v', self.cfg.voice_name, text]
+            if self.cfg.voice_over:
+                command.insert(1, '-i')
+            return subprocess.Popen(command)
+        return subprocess.Popen(['afplay', audio_path])
+
+    def cleanup(self, audio_path):
+        if audio_path and os.path.exists(audio_path):
+            os.remove(audio_path)
+
+
+class CommandBackend:
+    """
+    Speaks with any command that takes the text as its last argument (e.g. 'espeak -s 160')
+    """
+    def __init__(self, command):
+        self.command = shlex.split(command)
+
+    def synthesize(self, text):
+        return None
+
+    def play(self, text, audio_path):
+        return subprocess.Popen(self.command + [text])
+
+    def cleanup(self, audio_path):
+        pass
+
+
+def voice_backend_for_config(cfg):
+    if cfg.voice_command:
+        return CommandBackend(cfg.voice_command)
+    return SayBackend(cfg)
+
+
+class VoiceEngine:
+    """
+    Speaks sentences in the background. A synthesizer thread prepares the next sentence while a player thread speaks
+    the current one, so reading the response stream doesn't wait for speech
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.sentences = queue.Queue()
+        self.synthesized = queue.Queue(maxsize=1)
+        self.cond = threading.Condition()
+        self.pending = 0
+        self.generation = 0
+        self.process = None
+        self.failed = False  # speech was interrupted or returned an error, the response should be aborted
+        self.error = None
+        self.threads = [threading.Thread(target=self._synthesize_loop, daemon=True),
+                        threading.Thread(target=self._play_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def speak(self, text):
+        with self.cond:
+            if self.failed:
+                return
+            self.pending += 1
+            self.sentences.put((self.generation, text))
+
+    def wait(self):
+        try:
+            with self.cond:
+                while self.pending > 0:
+                    self.cond.wait(0.1)
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+
+    def stop(self):
+        with self.cond:
+            self.generation += 1
+            self.pending = 0
+            self.cond.notify_all()
+            process = self.process
+        if process and process.poll() is None:
+            process.terminate()
+
+    def reset(self):
+        with self.cond:
+            self.failed = False
+            self.error = None
+
+    def _done(self, generation, failed=False, error=None):
+        with self.cond:
+            if generation != self.generation:
+                return
+            if failed:
+                self.failed = True
+                self.error = self.error or error
+                self.generation += 1  # drop sentences that were already queued
+                self.pending = 0
+            else:
+                self.pending -= 1
+            self.cond.notify_all()
+
+    def _synthesize_loop(self):
+        while True:
+            generation, text = self.sentences.get()
+            if generation != self.generation:
+                continue
+            try:
+                audio_path = self.backend.synthesize(text)
+            except subprocess.CalledProcessError:
+                self._done(generation, failed=True)
+                continue
+            except Exception as e:
+                self._done(generation, failed=True, error=e)
+                continue
+            self.synthesized.put((generation, text, audio_path))
+
+    def _play_loop(self):
+        while True:
+            generation, text, audio_path = self.synthesized.get()
+            try:
+                with self.cond:
+                    if generation != self.generation:
+                        continue
+                    self.process = self.backend.play(text, audio_path)
+                rc = self.process.wait()
+                self.process = None
+                self._done(generation, failed=rc != 0)
+            except Exception as e:
+                self.process = None
+                self._done(generation, failed=True, error=e)
+            finally:
+                self.backend.cleanup(audio_path)
@@ -17,7 +17,9 @@ setup(
         'openai>=0.27.2',
         'tiktoken>=0.3.2',
         'rich>=13.3.1',
+        'pygments>=2.14.0,<3',
         'pyyaml>=6.0',
+        'requests>=2.20',
     ],
     classifiers=[
         "Programming Language :: Python :: 3",
@@ -0,0 +1,57 @@
+import io
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fake_openai import FakeOpenAI, FakeEncoding  # noqa: E402
+from gpterm.tokens import use_encoding  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fake_encoding():
+    """
+    Count tokens with the fake backend's encoding, so the tests don't download the tiktoken files
+    """
+    use_encoding(FakeEncoding())
+    yield
+    use_encoding(None)
+
+
+@pytest.fixture
+def fake_openai():
+    backend = FakeOpenAI(response="Hello there, this is the fake backend.", tokens_per_second=0,
+                         first_token_delay=0, connect_delay=0).install()
+    yield backend
+    backend.uninstall()
+
+
+@pytest.fixture
+def gpterm(tmp_path):
+    """
+    A GptTerminal with default settings that keeps its files in tmp_path, doesn't read the user's config and
+    doesn't warm up a connection. Its console output is in gpterm.console.file
+    """
+    from rich.console import Console
+    from gpterm.config import Config
+    from gpterm.gpt_terminal import GptTerminal
+    from gpterm.shell import ShellHandler
+    cfg = Config(os.devnull)
+    cfg.use_voice = False
+    cfg.use_cache = False
+    cfg.use_code_format = False
+    cfg.context_summary = False
+    cfg.save_sessions = False
+    cfg.track_usage = False
+    cfg.cache_path = str(tmp_path / "cache")
+    cfg.session_db_path = str(tmp_path / "sessions.db")
+    cfg.usage_db_path = str(tmp_path / "usage.db")
+    terminal = GptTerminal(config=cfg, warm_up_connection=False)
+    terminal._console = Console(file=io.StringIO(), force_terminal=True, width=100)
+    terminal.shell = ShellHandler()
+    terminal.shell.set_gpt_terminal(terminal)
+    terminal.reset_context(prompt="", submit=False)
+    return terminal
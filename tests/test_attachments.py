@@ -0,0 +1,80 @@
+import time
+import pytest
+from fake_openai import FakeEncoding
+from gpterm.attachments import iter_file_chunks, FileMapReduce
+
+MODEL = "gpt-3.5-turbo"
+
+
+def write(tmp_path, text):
+    path = tmp_path / "file.txt"
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_empty_file(tmp_path):
+    assert list(iter_file_chunks(write(tmp_path, ""), MODEL, 10)) == []
+
+
+def test_chunks_are_split_at_line_ends(tmp_path):
+    lines = [f"line {idx} has a few words\n" for idx in range(100)]
+    chunks = list(iter_file_chunks(write(tmp_path, ''.join(lines)), MODEL, 40))
+    assert ''.join(chunks) == ''.join(lines)
+    assert len(chunks) > 1
+    assert all(chunk.endswith("\n") for chunk in chunks)
+    assert all(len(FakeEncoding().encode(chunk)) <= 40 for chunk in chunks)
+
+
+@pytest.mark.parametrize("window", [8, 100, 1 << 20])
+def test_long_lines_and_multibyte_text_across_windows(tmp_path, window):
+    text = "é€字 " * 500 + "\nshort line\n" + "x " * 300 + "no line end"
+    chunks = list(iter_file_chunks(write(tmp_path, text), MODEL, 25, window=window))
+    assert ''.join(chunks) == text
+    assert all(len(FakeEncoding().encode(chunk)) <= 25 for chunk in chunks)
+
+
+class Progress:
+    def update(self, task, total=None):
+        pass
+
+    def advance(self, task):
+        pass
+
+
+def test_interrupt_cancels_the_queued_prompts(gpterm, tmp_path):
+    class Slow(FileMapReduce):
+        def _notes(self, prompt):
+            sent.append(prompt)
+            time.sleep(0.1)
+            return prompt
+
+    def prompts():
+        yield from ["prompt 0", "prompt 1", "prompt 2"]
+        raise KeyboardInterrupt  # Ctrl+C while prompt 1 is sent and prompt 2 is queued
+
+    sent = []
+    map_reduce = Slow(gpterm, write(tmp_path, "text"), "question", workers=1)
+    start = time.perf_counter()
+    with pytest.raises(KeyboardInterrupt):
+        map_reduce._run_bounded(prompts(), Progress(), None)
+    assert time.perf_counter() - start < 0.2  # didn't wait for the running prompt either
+    time.sleep(0.3)
+    assert sent == ["prompt 0", "prompt 1"]
+
+
+def test_file_question_is_answered_from_the_notes_of_each_part(gpterm, fake_openai, tmp_path):
+    def respond(kwargs):
+        prompt = kwargs["messages"][-1]["content"]
+        if prompt.startswith("This is part"):
+            return f"notes on {prompt.split()[3]}"
+        return "the answer"
+    fake_openai.response = respond
+    lines = [f"line {idx} has a few words\n" for idx in range(100)]
+    gpterm.submit_file(write(tmp_path, ''.join(lines)), "what is in it?")
+    prompts = [kwargs["messages"][-1]["content"] for kwargs in fake_openai.requests]
+    map_prompts = [prompt for prompt in prompts if prompt.startswith("This is part")]
+    assert len(map_prompts) >= 1
+    final = prompts[-1]
+    assert all(f"notes on {idx}" in final for idx in range(1, len(map_prompts) + 1))
+    assert final.rstrip().endswith("what is in it?")
+    assert gpterm.conversation.turns[-1].text().strip() == "the answer"
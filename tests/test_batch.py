@@ -0,0 +1,42 @@
+import json
+from gpterm.batch import read_completed_ids, read_prompts
+
+
+def test_read_completed_ids(tmp_path):
+    out = tmp_path / "out.jsonl"
+    out.write_text('\n'.join([
+        json.dumps({"id": "1", "response": "ok"}),
+        json.dumps({"id": "2", "error": "rate limited"}),
+        json.dumps({"response": "no id"}),
+        json.dumps({"id": None, "response": "null id"}),
+        json.dumps(["not", "a", "result"]),
+        json.dumps({"id": "3", "response": "ok"}),
+        '{"id": "4", "resp',  # cut short by an interrupted run
+    ]))
+    assert read_completed_ids(str(out)) == {"1", "3"}
+
+
+def test_read_completed_ids_without_output(tmp_path):
+    assert read_completed_ids(str(tmp_path / "missing.jsonl")) == set()
+
+
+def test_read_prompts(tmp_path):
+    prompts = tmp_path / "prompts.jsonl"
+    prompts.write_text('"first"\n\n{"id": "x", "prompt": "second"}\nplain text\n')
+    assert read_prompts(str(prompts)) == [("1", "first"), ("x", "second"), ("4", "plain text")]
+
+
+def test_batch_run_and_resume(gpterm, fake_openai, tmp_path):
+    from gpterm.batch import BatchRunner
+    prompts = tmp_path / "prompts.jsonl"
+    prompts.write_text('\n'.join(json.dumps({"id": str(idx), "prompt": f"question {idx}"}) for idx in range(6)))
+    out = tmp_path / "out.jsonl"
+    fake_openai.fail_requests = 2
+    gpterm.scheduler.max_retries = 0
+    assert BatchRunner(gpterm, concurrency=3).run(str(prompts), str(out)) == 2
+    assert len(read_completed_ids(str(out))) == 4
+    assert BatchRunner(gpterm, concurrency=3).run(str(prompts), str(out)) == 0
+    assert read_completed_ids(str(out)) == {str(idx) for idx in range(6)}
+    assert len(fake_openai.requests) == 8
+    results = [json.loads(line) for line in out.read_text().splitlines()]
+    assert all(result["response"] == fake_openai.response for result in results if "error" not in result)
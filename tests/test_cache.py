@@ -0,0 +1,167 @@
+import os
+import time
+from gpterm.cache import ResponseCache, ReplayedStream, SimilarPromptCache, chunk_for_delta
+
+
+def texts(stream):
+    return [obj.choices[0].delta.get('content') for obj in stream]
+
+
+def test_key_ignores_surrounding_whitespace_only():
+    key = ResponseCache.key("gpt-4", 0, [{"role": "user", "content": " hello \n"}])
+    assert key == ResponseCache.key("gpt-4", 0, [{"role": "user", "content": "hello"}])
+    assert key != ResponseCache.key("gpt-4", 0, [{"role": "user", "content": "Hello"}])
+    assert key != ResponseCache.key("gpt-4", 0.5, [{"role": "user", "content": "hello"}])
+    assert key != ResponseCache.key("gpt-3.5-turbo", 0, [{"role": "user", "content": "hello"}])
+
+
+def test_put_and_get(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    assert cache.get("k") is None
+    cache.put("k", ["Hel", "lo"], True)
+    assert texts(cache.get("k")) == ["Hel", "lo"]
+    assert (cache.hits, cache.misses) == (1, 1)
+    # a new instance finds the entries on disk
+    assert texts(ResponseCache(str(tmp_path)).get("k")) == ["Hel", "lo"]
+
+
+def test_evicts_the_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_entries=2)
+    cache.put("a", ["a"], True)
+    cache.put("b", ["b"], True)
+    cache.get("a")
+    cache.put("c", ["c"], True)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert sorted(os.listdir(tmp_path)) == ["a.json", "c.json"]
+
+
+def test_evicts_past_max_size(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_mb=0.001)
+    for idx in range(5):
+        cache.put(str(idx), ["x" * 400], True)
+    assert cache.total_bytes <= 1024 * 1024 * 0.001
+    assert cache.get("4") is not None and cache.get("0") is None
+
+
+def test_index_order_is_kept_across_instances(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put("old", ["1"], True)
+    cache.put("new", ["2"], True)
+    os.utime(tmp_path / "old.json", (time.time() - 100, time.time() - 100))
+    reloaded = ResponseCache(str(tmp_path), max_entries=1)
+    reloaded.put("newest", ["3"], True)
+    assert reloaded.get("old") is None and reloaded.get("newest") is not None
+
+
+def test_unreadable_entry_is_a_miss(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put("k", ["a"], True)
+    (tmp_path / "k.json").write_text("{not json")
+    assert cache.get("k") is None
+    assert "k" not in cache.entries
+
+
+def test_record_caches_complete_streams_only(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+
+    def get_response(obj):
+        return obj.choices[0].delta.get('content')
+    completion = ReplayedStream(["a", "b", "c"], True)
+    assert texts(cache.record("full", completion, get_response, True)) == ["a", "b", "c"]
+    assert texts(cache.get("full")) == ["a", "b", "c"]
+    stream = cache.record("aborted", ReplayedStream(["a", "b"], True), get_response, True)
+    for _ in stream:
+        stream.close()
+    assert cache.get("aborted") is None
+
+
+def test_text_completion_chunks():
+    assert chunk_for_delta("hi", False).choices[0].text == "hi"
+    assert "content" not in chunk_for_delta(None, True).choices[0].delta
+
+
+def test_repeated_prompt_is_answered_from_the_cache(gpterm, fake_openai):
+    gpterm.cfg.use_cache = True
+    gpterm.cfg.use_similar_cache = False
+    gpterm.cfg.temperature = 0
+    gpterm.submit_prompt("what is the answer?")
+    first = gpterm.conversation.turns[-1].text()
+    gpterm.reset_context(prompt="", submit=False)
+    gpterm.submit_prompt("what is the answer?")
+    assert len(fake_openai.requests) == 1
+    assert gpterm.conversation.turns[-1].text() == first
+    assert gpterm.response_cache.hits == 1
+
+
+PARAPHRASES = [
+    ("How can I reverse a list in Python?", "How do I reverse a list in Python?"),
+    ("What is the capital of France?", "what's the capital of france"),
+    ("Write a function that checks if a number is prime", "write a function to check if a number is prime"),
+    ("Please summarize the following text for me", "Summarize the following text"),
+    ("how to convert a string to an int in javascript", "How do I convert a string to an int in JavaScript?"),
+]
+
+DIFFERENT = [
+    ("How do I reverse a list in Python?", "How do I reverse a list in Rust?"),
+    ("How do I sort a list in Python?", "How do I reverse a list in Python?"),
+    ("convert a string to an int", "convert an int to a string"),
+    ("What is the capital of France?", "What is the capital of Spain?"),
+    ("How do I undo the last git commit?", "How do I amend the last git commit?"),
+    ("What's the difference between a list and a tuple in Python?",
+     "What's the difference between a list and a set in Python?"),
+]
+
+
+def similar_cache(tmp_path):
+    response_cache = ResponseCache(str(tmp_path))
+    return response_cache, SimilarPromptCache(response_cache)
+
+
+def test_similar_prompts_match_paraphrases(tmp_path):
+    response_cache, cache = similar_cache(tmp_path)
+    for idx, (prompt, _) in enumerate(PARAPHRASES):
+        cache.add("scope", prompt, f"key{idx}")
+    for idx, (_, paraphrase) in enumerate(PARAPHRASES):
+        match = cache.lookup("scope", paraphrase)
+        assert match is not None and match.key == f"key{idx}", paraphrase
+        assert match.similarity >= cache.threshold
+
+
+def test_similar_prompts_dont_match_other_questions(tmp_path):
+    for idx, (prompt, other) in enumerate(DIFFERENT):
+        _, cache = similar_cache(tmp_path / str(idx))
+        cache.add("scope", prompt, "key")
+        assert cache.lookup("scope", other) is None, other
+
+
+def test_similar_prompts_are_scoped(tmp_path):
+    _, cache = similar_cache(tmp_path)
+    cache.add("scope", "How can I reverse a list in Python?", "key")
+    assert cache.lookup("other scope", "How can I reverse a list in Python?") is None
+    assert cache.lookup("scope", "reverse it") is None  # too short to match
+
+
+def test_similar_prompt_index_survives_a_restart_and_drops_old_signatures(tmp_path):
+    response_cache, cache = similar_cache(tmp_path)
+    cache.add("scope", "How can I reverse a list in Python?", "key")
+    with open(cache.path, 'a') as fp:
+        fp.write('{"key":"old","scope":"scope","prompt":"How do I reverse a list in Python?","time":%f,'
+                 '"signature":[1,2,3]}\n' % time.time())
+    _, cache = similar_cache(tmp_path)
+    assert cache.lookup("scope", "How do I reverse a list in Python?").key == "key"
+    assert list(cache.entries) == ["key"]
+    with open(cache.path) as fp:
+        assert len(fp.readlines()) == 1  # rewritten without the entry of the earlier version
+
+
+def test_paraphrased_prompt_is_offered_the_cached_response(gpterm, fake_openai, monkeypatch):
+    gpterm.cfg.use_cache = True
+    gpterm.cfg.temperature = 0
+    gpterm.submit_prompt("How can I reverse a list in Python?")
+    gpterm.reset_context(prompt="", submit=False)
+    monkeypatch.setattr(gpterm.console, "input", lambda prompt: "y")
+    gpterm.submit_prompt("How do I reverse a list in Python?")
+    assert len(fake_openai.requests) == 1
+    assert gpterm.conversation.turns[-1].text().strip() == fake_openai.response
+    assert gpterm.similar_cache.used == 1
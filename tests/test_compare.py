@@ -0,0 +1,47 @@
+from gpterm.compare import ModelComparison
+
+
+def by_model(kwargs):
+    return f"answer from {kwargs['model']}"
+
+
+def test_compare_streams_every_model(gpterm, fake_openai):
+    fake_openai.response = by_model
+    turns = len(gpterm.conversation.turns)
+    comparison = ModelComparison(gpterm, ["gpt-3.5-turbo", "gpt-4"], "what is a monad?")
+    comparison.run()
+    assert sorted(kwargs["model"] for kwargs in fake_openai.requests) == ["gpt-3.5-turbo", "gpt-4"]
+    for answer in comparison.answers:
+        assert answer.error is None
+        assert answer.text() == f"answer from {answer.model}"
+        assert answer.metrics.to_dict()["completion_tokens"] > 0
+    output = gpterm.console.file.getvalue()
+    assert "Model comparison" in output
+    assert len(gpterm.conversation.turns) == turns  # the conversation is left alone
+
+
+def test_compare_shows_a_failed_model_next_to_the_others(gpterm, fake_openai):
+    gpterm.scheduler.max_retries = 0
+
+    def fail_one(kwargs):
+        if kwargs["model"] == "gpt-4":
+            raise ValueError("model is down")
+        return by_model(kwargs)
+    fake_openai.response = fail_one
+    comparison = ModelComparison(gpterm, ["gpt-3.5-turbo", "gpt-4"], "what is a monad?")
+    comparison.run()
+    answers = {answer.model: answer for answer in comparison.answers}
+    assert answers["gpt-4"].error == "model is down"
+    assert answers["gpt-3.5-turbo"].text() == "answer from gpt-3.5-turbo"
+
+
+def test_compare_command(gpterm, fake_openai):
+    gpterm.shell.handle_command("/compare gpt-3.5-turbo,gpt-4 hello there")
+    assert [kwargs["messages"][-1]["content"] for kwargs in fake_openai.requests] == ["hello there"] * 2
+    assert "Model comparison" in gpterm.console.file.getvalue()
+
+
+def test_compare_command_needs_two_models_and_a_prompt(gpterm, fake_openai):
+    assert "Command format" in gpterm.shell.handle_compare(["/compare", "gpt-4"])
+    assert "No prompt" in gpterm.shell.handle_compare(["/compare", "gpt-4,gpt-3.5-turbo"])
+    assert fake_openai.requests == []
@@ -0,0 +1,105 @@
+import random
+from gpterm.conversation import Conversation
+from gpterm.enums import Role
+from gpterm.tokens import TokenLedger
+
+
+def make_conversation(num_turns, model="gpt-3.5-turbo", seed=0):
+    rng = random.Random(seed)
+    conversation = Conversation(TokenLedger(model))
+    conversation.add("Format code blocks\n", Role.user)
+    conversation.add("Ok\n", Role.assistant)
+    conversation.pin()
+    for idx in range(num_turns):
+        role = Role.user if idx % 2 == 0 else Role.assistant
+        conversation.add(' '.join(f"word{rng.randint(0, 99)}" for _ in range(rng.randint(1, 40))), role)
+    return conversation
+
+
+def recount(conversation):
+    return conversation.prompt_tokens(list(conversation.turns))
+
+
+def test_evict_fits_the_budget_and_keeps_the_pinned_turns():
+    conversation = make_conversation(200)
+    pinned = conversation.turns[0]
+    last = conversation.turns[-1]
+    evicted = conversation.evict(500)
+    assert evicted
+    assert conversation.turns[0] is pinned and conversation.turns[-1] is last
+    assert conversation.prompt_tokens() <= 500
+    assert conversation.prompt_tokens() == recount(conversation)
+    assert conversation.num_messages() == len(conversation.turns)
+
+
+def test_evict_does_not_start_with_a_response():
+    conversation = make_conversation(51)
+    conversation.evict(300)
+    assert conversation.turns[conversation.pinned].role == Role.user
+
+
+def test_evict_keeps_the_last_turn():
+    conversation = make_conversation(10)
+    conversation.evict(0)
+    assert len(conversation.turns) == conversation.pinned + 1
+
+
+def test_evict_nothing_when_the_prompt_fits():
+    conversation = make_conversation(10)
+    assert conversation.evict(conversation.prompt_tokens()) == []
+
+
+def test_counts_messages_without_walking_the_turns():
+    conversation = Conversation(TokenLedger("gpt-3.5-turbo"))
+    conversation.add("a question", Role.user)
+    conversation.add("an answer", Role.assistant)
+    conversation.add("   ", Role.user)  # a whitespace turn is not sent as a message
+    assert conversation.num_messages() == 2
+    conversation.add("now with text", Role.user)
+    assert conversation.num_messages() == 3
+    conversation.set_summary("earlier things", conversation.generation)
+    assert conversation.num_messages() == 4
+    conversation.evict(0)
+    assert conversation.num_messages() == 2
+
+
+def test_reset_with_code_format_pins_only_the_directive(gpterm):
+    gpterm.cfg.use_code_format = True
+    gpterm.reset_context(prompt="what is a monad?", submit=False)
+    turns = gpterm.conversation.turns
+    assert gpterm.conversation.pinned == 1
+    assert turns[0].text().strip() == gpterm.code_format_directive.strip()
+    assert [turn.text() for turn in turns[1:]] == ["\nwhat is a monad?\n"]
+
+
+def test_reset_without_code_format(gpterm):
+    gpterm.reset_context(prompt="hello", submit=False)
+    assert gpterm.conversation.pinned == 0
+    assert [turn.text() for turn in gpterm.conversation.turns] == ["\nhello\n"]
+
+
+def test_aborted_response_adds_no_empty_turn(gpterm, fake_openai):
+    def abort(obj):
+        gpterm.abort_response = True
+        return None
+    gpterm.get_response = abort
+    gpterm.submit_prompt("tell me a story")
+    assert [turn.role for turn in gpterm.conversation.turns] == [Role.user]
+    assert gpterm.conversation.turns[0].text() == "\ntell me a story\n"
+
+
+def test_aborted_response_keeps_its_partial_text(gpterm, fake_openai):
+    get_response = gpterm.get_response
+    chunks = []
+
+    def abort_after_three(obj):
+        chunks.append(obj)
+        if len(chunks) == 4:
+            gpterm.abort_response = True
+        return get_response(obj)
+    gpterm.get_response = abort_after_three
+    gpterm.submit_prompt("tell me a story")
+    turns = gpterm.conversation.turns
+    assert [turn.role for turn in turns] == [Role.user, Role.assistant]
+    assert turns[1].text().strip() and turns[1].text().endswith("\n")
+    assert fake_openai.response.startswith(turns[1].text().strip())
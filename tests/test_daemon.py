@@ -0,0 +1,85 @@
+import os
+import json
+import stat
+import socket
+import threading
+import pytest
+from gpterm.daemon import GptermDaemon, run_client, run_local, connect
+
+
+@pytest.fixture
+def daemon(gpterm, fake_openai, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # a relative socket path, also keeps it short
+    server = GptermDaemon(gpterm, socket_path="gpterm.sock")
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join(5)
+
+
+def current_umask():
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def test_leaves_the_umask_alone(gpterm, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    before = current_umask()
+    server = GptermDaemon(gpterm, socket_path="gpterm.sock")
+    server.server_close()
+    assert current_umask() == before
+
+
+def test_serves_prompts_on_a_private_socket(daemon, fake_openai, capsys):
+    assert stat.S_IMODE(os.stat("gpterm.sock").st_mode) == 0o600
+    assert run_client("hello", socket_path="gpterm.sock") == 0
+    out, err = capsys.readouterr()
+    assert out.strip() == fake_openai.response
+    assert err == ""
+
+
+def test_refuses_a_second_daemon(daemon, gpterm):
+    with pytest.raises(RuntimeError):
+        GptermDaemon(gpterm, socket_path="gpterm.sock")
+
+
+def test_no_daemon(tmp_path):
+    assert run_client("hello", socket_path=str(tmp_path / "missing.sock")) is None
+    assert connect(str(tmp_path / "missing.sock")) is None
+
+
+def test_client_reports_errors(daemon, fake_openai, gpterm, capsys):
+    fake_openai.fail_requests = 10
+    gpterm.scheduler.max_retries = 0
+    assert run_client("hello", socket_path="gpterm.sock") == 1
+    assert "rate limited" in capsys.readouterr().err
+
+
+def serve_once(path, lines):
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+
+    def serve():
+        conn, _ = listener.accept()
+        with conn:
+            conn.recv(4096)
+            for line in lines:
+                conn.sendall((json.dumps(line) + "\n").encode())
+        listener.close()
+    threading.Thread(target=serve, daemon=True).start()
+
+
+def test_client_fails_on_a_truncated_response(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    serve_once("cut.sock", [{"delta": "partial"}])
+    assert run_client("hello", socket_path="cut.sock") == 1
+    out, err = capsys.readouterr()
+    assert out.startswith("partial") and "before the response was complete" in err
+
+
+def test_run_local(gpterm, fake_openai, capsys):
+    assert run_local(gpterm, "hello") == 0
+    assert capsys.readouterr().out.strip() == fake_openai.response
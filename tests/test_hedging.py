@@ -0,0 +1,103 @@
+import time
+import threading
+import pytest
+from gpterm.hedging import RequestHedger
+
+
+class SlowStream:
+    def __init__(self, name, delay):
+        self.name = name
+        self.delay = delay
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        time.sleep(self.delay)
+        yield f"{self.name} 1"
+        yield f"{self.name} 2"
+
+    def close(self):
+        self.closed.set()
+
+
+class Backend:
+    """
+    create() returns streams whose first token takes the next of delays
+    """
+    def __init__(self, *delays):
+        self.delays = list(delays)
+        self.streams = []
+        self.lock = threading.Lock()
+
+    def create(self):
+        with self.lock:
+            stream = SlowStream(f"request {len(self.streams)}", self.delays[len(self.streams) % len(self.delays)])
+            self.streams.append(stream)
+        return stream
+
+
+def get_response(obj):
+    return obj
+
+
+def wait_for_samples(hedger, count):
+    deadline = time.monotonic() + 5
+    while len(hedger.samples) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(hedger.samples) == count
+
+
+def test_no_duplicate_before_the_deadline():
+    hedger = RequestHedger(default_delay=1.0)
+    backend = Backend(0)
+    assert list(hedger.call(backend.create, get_response)) == ["request 0 1", "request 0 2"]
+    assert len(backend.streams) == 1 and hedger.num_fired == 0
+    wait_for_samples(hedger, 1)
+
+
+def test_duplicate_wins_and_the_original_is_closed():
+    hedger = RequestHedger(default_delay=0.05)
+    backend = Backend(0.5, 0)
+    assert list(hedger.call(backend.create, get_response)) == ["request 1 1", "request 1 2"]
+    assert hedger.num_fired == 1 and hedger.num_won == 1
+    original = backend.streams[0]
+    assert original.closed.wait(5)
+    assert not backend.streams[1].closed.is_set()
+    # the original's first token time is sampled even though it lost, the duplicate's isn't
+    wait_for_samples(hedger, 1)
+    assert hedger.samples[0] >= 0.5
+    assert hedger.saved > 0.3
+
+
+def test_original_wins_and_the_duplicate_is_closed():
+    hedger = RequestHedger(default_delay=0.05)
+    backend = Backend(0.15, 1.0)
+    assert list(hedger.call(backend.create, get_response)) == ["request 0 1", "request 0 2"]
+    assert hedger.num_fired == 1 and hedger.num_won == 0
+    assert backend.streams[1].closed.wait(5)
+    wait_for_samples(hedger, 1)
+
+
+def test_deadline_follows_slow_requests_that_were_hedged():
+    # every request is slower than the default deadline, so every request is hedged until there are samples.
+    # The deadline has to rise to the real first token time instead of staying low and duplicating every request
+    hedger = RequestHedger(default_delay=0.02, min_samples=3, pct=50)
+    backend = Backend(0.1)
+    for i in range(3):
+        list(hedger.call(backend.create, get_response))
+        wait_for_samples(hedger, i + 1)
+    assert hedger.num_fired == 3
+    assert hedger.deadline() >= 0.1
+    fired = hedger.num_fired
+    for _ in range(3):
+        list(hedger.call(backend.create, get_response))
+    assert hedger.num_fired == fired
+
+
+def test_error_of_both_attempts_is_raised():
+    hedger = RequestHedger(default_delay=0.01)
+
+    def create():
+        time.sleep(0.05)
+        raise ValueError("no answer")
+    with pytest.raises(ValueError):
+        hedger.call(create, get_response)
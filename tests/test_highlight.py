@@ -0,0 +1,63 @@
+import pytest
+from pygments.token import String, Comment
+from gpterm.highlight import CodeHighlighter
+
+
+@pytest.fixture
+def highlighter():
+    return CodeHighlighter("monokai")
+
+
+def token_types(highlighter, line, text):
+    return {token_type for token_type, value in highlighter.tokens(line + '\n') if text in value}
+
+
+def test_python(highlighter):
+    highlighter.start("python")
+    assert highlighter.highlight("def f(x):  # comment").plain == "def f(x):  # comment"
+    assert any(token_type in Comment for token_type in token_types(highlighter, "x = 1  # note", "# note"))
+
+
+def test_multi_line_string_state_is_kept_between_lines(highlighter):
+    highlighter.start("python")
+    highlighter.tokens('text = """first line\n')
+    assert any(token_type in String for token_type in token_types(highlighter, "def not_code():", "def"))
+    highlighter.tokens('end of string"""\n')
+    assert not any(token_type in String for token_type in token_types(highlighter, "def code():", "def"))
+
+
+def test_yaml(highlighter):
+    highlighter.start("yaml")
+    lines = ["services:", "  web:", "    image: nginx  # the server", "    ports:", "      - \"80:80\""]
+    assert [highlighter.highlight(line).plain for line in lines] == lines
+    assert highlighter.incremental
+
+
+def test_a_failing_lexer_falls_back_to_single_lines(highlighter, monkeypatch):
+    highlighter.start("python")
+
+    def fail(line):
+        raise AttributeError("no state")
+        yield
+    monkeypatch.setattr(highlighter, "_incremental_tokens", fail)
+    assert highlighter.highlight("x = 1").plain == "x = 1"
+    assert not highlighter.incremental
+
+
+def test_yaml_block_streams_to_the_end(gpterm, fake_openai):
+    fake_openai.response = "Config:\n```yaml\nkey: value\nlist:\n  - a\n```\nDone."
+    gpterm.submit_prompt("show yaml")
+    output = gpterm.console.file.getvalue()
+    assert "got error" not in output
+    assert "Done." in output
+    assert gpterm.conversation.turns[-1].text().strip().endswith("Done.")
+
+
+def test_highlighter_errors_print_plain_code(gpterm, fake_openai, monkeypatch):
+    def fail(line, width=None):
+        raise RuntimeError("broken lexer")
+    monkeypatch.setattr(gpterm.code_highlighter, "highlight", fail)
+    fake_openai.response = "```python\nprint('hi')\n```\nDone."
+    gpterm.submit_prompt("show code")
+    output = gpterm.console.file.getvalue()
+    assert "print('hi')" in output and "Done." in output
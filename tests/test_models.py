@@ -0,0 +1,46 @@
+import pytest
+from gpterm.models import ModelRegistry
+from gpterm.config import Config
+
+
+def test_defaults():
+    registry = ModelRegistry()
+    assert registry.get("gpt-4").context_window == 8192
+    assert registry.get("gpt-4").chat
+    assert not registry.get("text-davinci-003").chat
+
+
+def test_unlisted_models_are_guessed():
+    registry = ModelRegistry()
+    assert registry.get("gpt-5").chat
+    assert registry.get("gpt-5").context_window == 4096
+    assert not registry.get("my-text-model").chat
+    assert registry.get("my-text-model").context_window == 2048
+
+
+def test_config_overrides_the_defaults():
+    registry = ModelRegistry({"gpt-4": {"context_window": 128000, "max_output": 4096},
+                              "local-model": {"chat": True, "context_window": 32000}})
+    gpt4 = registry.get("gpt-4")
+    assert (gpt4.context_window, gpt4.max_output, gpt4.prompt_price) == (128000, 4096, 0.03)
+    assert registry.get("local-model").chat
+
+
+def test_cost():
+    info = ModelRegistry().get("gpt-4")
+    assert info.cost(1000, 1000) == pytest.approx(0.09)
+
+
+def test_unknown_fields_are_rejected():
+    with pytest.raises(ValueError):
+        ModelRegistry({"gpt-4": {"contxt_window": 1}})
+
+
+def test_config_drops_invalid_models(tmp_path, capsys):
+    path = tmp_path / "config.yaml"
+    path.write_text("models:\n  gpt-4:\n    contxt_window: 1\n  local-model:\n    context_window: 1000\n")
+    config = Config(str(path))
+    config.load()
+    assert config.models == {"local-model": {"context_window": 1000}}
+    assert "contxt_window" in capsys.readouterr().out
+    ModelRegistry(config.models)
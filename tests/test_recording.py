@@ -0,0 +1,122 @@
+import json
+import pytest
+from openai.util import convert_to_openai_object
+from gpterm.recording import StreamRecorder, ReplayStream, RecordedStreamError, read_recording
+from gpterm.streams import TeeStream
+
+
+def chunks(*deltas):
+    return [convert_to_openai_object({"choices": [{"delta": {"content": d}, "index": 0}]}) for d in deltas]
+
+
+class Stream:
+    def __init__(self, objs, error=None):
+        self.objs = objs
+        self.error = error
+        self.closed = False
+
+    def __iter__(self):
+        yield from self.objs
+        if self.error:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+def test_tee_stream_events():
+    events = []
+    tee = TeeStream(Stream(chunks("a", "b")), on_chunk=lambda obj: events.append(obj.choices[0].delta.content),
+                    on_end=lambda: events.append("end"), on_close=lambda: events.append("closed"))
+    assert len(list(tee)) == 2
+    assert events == ["a", "b", "end"]
+
+    events.clear()
+    stream = Stream(chunks("a", "b"))
+    tee = TeeStream(stream, on_chunk=lambda obj: events.append("chunk"), on_end=lambda: events.append("end"),
+                    on_close=lambda: events.append("closed"))
+    for _ in tee:
+        tee.close()
+        tee.close()
+        break
+    assert events == ["chunk", "closed"]
+    assert stream.closed
+
+    events.clear()
+    tee = TeeStream(Stream(chunks("a"), error=ValueError("dropped")), on_chunk=lambda obj: None,
+                    on_end=lambda: events.append("end"), on_error=lambda e: events.append(str(e)))
+    with pytest.raises(ValueError):
+        list(tee)
+    assert events == ["dropped"]
+
+
+def record(path, stream, prompt="hi", read=None):
+    recorder = StreamRecorder(path)
+    tee = recorder.record(stream, 0, "gpt-test", True, prompt, False)
+    try:
+        if read is None:
+            list(tee)
+        else:
+            read(tee)
+    finally:
+        recorder.close()
+
+
+def test_record_and_read_back(tmp_path):
+    path = tmp_path / "rec.jsonl"
+    record(path, Stream(chunks("Hel", "lo")))
+    record(path, Stream(chunks("x"), error=ValueError("dropped")), prompt="second", read=lambda tee: pytest.raises(
+        ValueError, list, tee))
+
+    def stop_early(tee):
+        for _ in tee:
+            tee.close()
+            break
+    record(path, Stream(chunks("y", "z")), prompt="third", read=stop_early)
+    responses = list(read_recording(path))
+    assert [header["prompt"] for header, _, _ in responses] == ["hi", "second", "third"]
+    header, recorded, end_event = responses[0]
+    assert header["model"] == "gpt-test" and header["chat"] is True
+    assert [choice["delta"]["content"] for _, choice in recorded] == ["Hel", "lo"]
+    assert "end" in end_event
+    assert responses[1][2]["error"] == "dropped"
+    assert "closed" in responses[2][2] and len(responses[2][1]) == 1
+
+
+def test_read_recording_skips_a_cut_off_line(tmp_path):
+    path = tmp_path / "rec.jsonl"
+    record(path, Stream(chunks("a")))
+    with open(path, 'a') as fp:
+        fp.write(json.dumps({"model": "gpt-test", "chat": True, "prompt": "cut"}) + "\n")
+        fp.write('[12.0, {"delta": {"cont')
+    responses = list(read_recording(path))
+    assert len(responses) == 2
+    assert responses[1][1] == [] and responses[1][2] is None
+
+
+def test_replay_stream():
+    recorded = [[0, {"delta": {"content": "a"}}], [5, {"delta": {"content": "b"}}]]
+    assert [obj.choices[0].delta.content for obj in ReplayStream(recorded, {"end": 5}, speed=0)] == ["a", "b"]
+    with pytest.raises(RecordedStreamError):
+        list(ReplayStream(recorded, {"error": "dropped", "at": 5}, speed=0))
+    stream = ReplayStream(recorded, {"end": 5}, speed=0)
+    for obj in stream:
+        stream.close()
+    assert obj.choices[0].delta.content == "a"
+
+
+def test_recorded_session_replays_offline(gpterm, fake_openai, tmp_path):
+    path = tmp_path / "rec.jsonl"
+    gpterm.recorder = StreamRecorder(path)
+    gpterm.submit_prompt("say hello")
+    gpterm.recorder.close()
+    gpterm.recorder = None
+    assert len(fake_openai.requests) == 1
+
+    gpterm.reset_context(prompt="", submit=False)
+    gpterm.get_response = None  # replay picks the endpoint from the recording
+    gpterm.replay(path, speed=0)
+    assert len(fake_openai.requests) == 1
+    assert gpterm.get_response == gpterm.get_chat_response
+    assert gpterm.conversation.turns[-1].text().strip() == fake_openai.response
+    assert fake_openai.response in gpterm.console.file.getvalue()
@@ -0,0 +1,60 @@
+import time
+from gpterm.render import StreamRenderer
+
+
+class FakeConsole:
+    def __init__(self):
+        self.prints = []
+
+    def print(self, text, style=None, markup=True, end='\n'):
+        self.prints.append((text, style))
+
+
+def test_buffers_text_within_a_frame():
+    console = FakeConsole()
+    renderer = StreamRenderer(console, fps=1)
+    renderer.last_flush = time.monotonic()
+    for word in ["one ", "two ", "three"]:
+        renderer.write(word)
+    assert console.prints == []
+    renderer.flush()
+    assert console.prints == [("one two three", None)]
+
+
+def test_writes_on_a_newline():
+    console = FakeConsole()
+    renderer = StreamRenderer(console, fps=1)
+    renderer.last_flush = time.monotonic()
+    renderer.write("a line")
+    renderer.write(" ends\n")
+    assert console.prints == [("a line ends\n", None)]
+
+
+def test_style_change_writes_the_buffered_text():
+    console = FakeConsole()
+    renderer = StreamRenderer(console, fps=1)
+    renderer.last_flush = time.monotonic()
+    renderer.write("plain ")
+    renderer.write("bold", style="bold")
+    renderer.flush()
+    assert console.prints == [("plain ", None), ("bold", "bold")]
+
+
+def test_background_thread_writes_stalled_text():
+    console = FakeConsole()
+    renderer = StreamRenderer(console, fps=50)
+    renderer.start()
+    renderer.last_flush = time.monotonic()
+    renderer.write("stalled")
+    deadline = time.monotonic() + 2
+    while not console.prints and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert console.prints == [("stalled", None)]
+
+
+def test_without_frames_every_write_is_printed():
+    console = FakeConsole()
+    renderer = StreamRenderer(console, fps=0)
+    renderer.write("a")
+    renderer.write("b")
+    assert console.prints == [("a", None), ("b", None)]
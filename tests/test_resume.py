@@ -0,0 +1,55 @@
+import openai
+import pytest
+from gpterm.resume import ResumableStream, overlap_length
+
+FULL = "The quick brown fox jumps over the lazy dog. Then it runs away into the forest and hides."
+
+
+def chat_response(obj):
+    delta = obj.choices[0].delta
+    return delta.content if 'content' in delta else None
+
+
+def stream(fake_openai):
+    return fake_openai.create(True, {"stream": True, "messages": []})
+
+
+def test_overlap_length():
+    assert overlap_length("the quick brown fox", "brown fox jumps") == 9
+    assert overlap_length("the quick brown fox", "jumps over") == 0
+    assert overlap_length("abc", "c d") == 0  # shorter than min_overlap
+
+
+def test_resumes_a_dropped_stream_and_drops_the_overlap(fake_openai):
+    fake_openai.response = FULL
+    fake_openai.fail_after_chunks = 6
+    partials = []
+
+    def resume(partial):
+        partials.append(partial)
+        fake_openai.fail_after_chunks = None
+        fake_openai.response = FULL[len(partial) - 10:]  # the continuation repeats the end of the partial response
+        return stream(fake_openai)
+    resumable = ResumableStream(stream(fake_openai), chat_response, True, resume)
+    text = ''.join(response for response in map(chat_response, resumable) if response)
+    assert text == FULL
+    assert len(partials) == 1 and FULL.startswith(partials[0])
+    assert resumable.num_resumes == 1
+
+
+def test_gives_up_after_max_resumes(fake_openai):
+    fake_openai.response = FULL
+    fake_openai.fail_after_chunks = 3
+    resumable = ResumableStream(stream(fake_openai), chat_response, True, lambda partial: stream(fake_openai),
+                                max_resumes=2)
+    with pytest.raises(openai.error.APIConnectionError):
+        list(resumable)
+    assert resumable.num_resumes == 2
+
+
+def test_does_not_resume_after_close(fake_openai):
+    fake_openai.response = FULL
+    resumable = ResumableStream(stream(fake_openai), chat_response, True, lambda partial: pytest.fail("resumed"))
+    for _ in resumable:
+        resumable.close()
+    assert resumable.num_resumes == 0
@@ -0,0 +1,127 @@
+import math
+from collections import Counter
+import gpterm.retrieval as retrieval
+from gpterm.conversation import Conversation
+from gpterm.enums import Role
+from gpterm.retrieval import ContextRetriever, TermIndex, terms
+from gpterm.tokens import TokenLedger
+
+TOPICS = ["how do I sort a list in python", "sorted returns a new list",
+          "what is the capital of france", "paris is the capital",
+          "explain rust ownership", "each value has a single owner",
+          "best pizza toppings", "mushrooms and olives",
+          "how do I reverse a string in python", "use slicing with a step of minus one"]
+
+
+def make_conversation(texts, pinned=()):
+    conversation = Conversation(TokenLedger("gpt-3.5-turbo"))
+    for idx, text in enumerate(list(pinned) + list(texts)):
+        conversation.add(text + "\n", Role.user if idx % 2 == 0 else Role.assistant)
+        if idx == len(pinned) - 1:
+            conversation.pin()
+    return conversation
+
+
+def bm25_reference(query, documents, k1=1.5, b=0.75):
+    counts = [Counter(document) for document in documents]
+    avg_length = sum(len(document) for document in documents) / len(documents)
+    doc_freq = Counter(term for count in counts for term in count)
+    scores = []
+    for document, count in zip(documents, counts):
+        score = 0.0
+        for term in set(query):
+            freq = count.get(term)
+            if freq:
+                idf = math.log(1 + (len(documents) - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+                score += idf * freq * (k1 + 1) / (freq + k1 * (1 - b + b * len(document) / avg_length))
+        scores.append(score)
+    return scores
+
+
+def test_index_scores_match_bm25():
+    conversation = make_conversation(TOPICS)
+    index = TermIndex()
+    index.sync(conversation.turns)
+    query = terms("sort a python list")
+    scores = index.scores(query)
+    expected = bm25_reference(query, [terms(turn.text()) for turn in conversation.turns])
+    assert [round(scores.get(turn, 0.0), 9) for turn in conversation.turns] == [round(s, 9) for s in expected]
+
+
+def test_index_follows_added_text_and_removed_turns():
+    conversation = make_conversation(TOPICS)
+    turns = conversation.turns
+    index = TermIndex()
+    index.sync(turns)
+    assert "paris" in index.postings
+    conversation.add("the city of light\n", Role.assistant)  # text added to the last turn
+    index.sync(turns[4:])
+    assert "paris" not in index.postings and "sort" not in index.postings
+    assert "light" in index.postings
+    assert index.total_length == sum(len(terms(turn.text())) for turn in turns[4:])
+
+
+def test_terms_are_computed_once_per_turn(monkeypatch):
+    calls = []
+
+    def counting_terms(text):
+        calls.append(text)
+        return terms(text)
+    monkeypatch.setattr(retrieval, "terms", counting_terms)
+    conversation = make_conversation(TOPICS + ["python question"])
+    retriever = ContextRetriever(top_k=2, recent=2)
+    retriever.select(conversation, 10000)
+    calls.clear()
+    conversation.add("the answer\n", Role.assistant)
+    conversation.add("another python question\n", Role.user)
+    retriever.select(conversation, 10000)
+    # the query, and the two turns that left the recent turns
+    assert len(calls) == 3
+
+
+def test_selects_relevant_pairs_and_the_recent_turns():
+    conversation = make_conversation(TOPICS + ["which city is the capital of france"])
+    selected = ContextRetriever(top_k=1, recent=1).select(conversation, 10000)
+    assert [turn.text().strip() for turn in selected] == \
+        ["what is the capital of france", "paris is the capital", "which city is the capital of france"]
+
+
+def test_recent_turns_start_with_a_prompt():
+    conversation = make_conversation(TOPICS + ["unrelated"], pinned=["Format code blocks", "Ok"])
+    # the last 4 turns would start with a response, its prompt is sent with it
+    selected = ContextRetriever(top_k=0, recent=4).select(conversation, 10000)
+    assert [turn.text().strip() for turn in selected] == \
+        ["Format code blocks", "Ok", "best pizza toppings", "mushrooms and olives",
+         "how do I reverse a string in python", "use slicing with a step of minus one", "unrelated"]
+
+
+def test_recent_turns_with_the_prompt_ahead_of_a_response():
+    conversation = make_conversation(TOPICS + ["unrelated"])
+    selected = ContextRetriever(top_k=0, recent=2).select(conversation, 10000)
+    assert selected[0].role == Role.user
+    assert [turn.text().strip() for turn in selected] == \
+        ["how do I reverse a string in python", "use slicing with a step of minus one", "unrelated"]
+
+
+def test_evicted_turns_leave_the_index():
+    conversation = make_conversation(TOPICS + ["capital of france"])
+    retriever = ContextRetriever(top_k=1, recent=1)
+    retriever.select(conversation, 10000)
+    evicted = conversation.evict(conversation.prompt_tokens() - 30)
+    assert evicted
+    retriever.select(conversation, 10000)
+    assert not any(turn in retriever.index.docs for turn in evicted)
+
+
+def test_requests_send_only_the_selected_turns(gpterm, fake_openai):
+    gpterm.cfg.use_retrieval = True
+    fake_openai.response = "noted"
+    for prompt in ["what is the capital of france", "explain rust ownership", "best pizza toppings",
+                   "how do I sort a list", "which is the capital of france again"]:
+        gpterm.submit_prompt(prompt)
+    messages = fake_openai.requests[-1]["messages"]
+    contents = [message["content"] for message in messages]
+    assert "what is the capital of france" in contents
+    assert "explain rust ownership" not in contents
+    assert messages[-1]["content"] == "which is the capital of france again"
+    assert gpterm.tokens_saved > 0
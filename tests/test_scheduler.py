@@ -0,0 +1,63 @@
+import time
+import openai
+import pytest
+from gpterm.scheduler import RequestScheduler
+
+
+def chat_create(**kwargs):
+    return openai.ChatCompletion.create(**kwargs)
+
+
+def test_retries_rate_limited_requests(fake_openai):
+    fake_openai.fail_requests = 2
+    retries = []
+    scheduler = RequestScheduler(max_retries=3, base_delay=0.01, on_retry=lambda e, delay: retries.append(delay))
+    response = scheduler.call(chat_create, model="gpt-3.5-turbo", messages=[{"role": "user", "content": "hi"}])
+    assert response.choices[0].message.content == fake_openai.response
+    assert len(fake_openai.requests) == 3
+    assert scheduler.num_retries == 2
+    assert len(retries) == 2
+
+
+def test_waits_for_retry_after(fake_openai):
+    fake_openai.fail_requests = 1  # the fake rate limit error has a Retry-After of 0.1s
+    scheduler = RequestScheduler(max_retries=3, base_delay=0.001)
+    start = time.monotonic()
+    scheduler.call(chat_create, model="gpt-3.5-turbo", messages=[])
+    assert time.monotonic() - start >= 0.1
+    assert scheduler.blocked_until > start
+
+
+def test_gives_up_after_max_retries(fake_openai):
+    fake_openai.fail_requests = 5
+    scheduler = RequestScheduler(max_retries=2, base_delay=0.001)
+    with pytest.raises(openai.error.RateLimitError):
+        scheduler.call(chat_create, model="gpt-3.5-turbo", messages=[])
+    assert len(fake_openai.requests) == 3
+
+
+def test_does_not_retry_insufficient_quota():
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        raise openai.error.RateLimitError("out of credits", code='insufficient_quota')
+    with pytest.raises(openai.error.RateLimitError):
+        RequestScheduler(base_delay=0.001).call(create)
+    assert len(calls) == 1
+
+
+def test_retry_after_header():
+    e = openai.error.RateLimitError("slow down", headers={"Retry-After": "2.5"})
+    assert RequestScheduler.retry_after(e) == 2.5
+    assert RequestScheduler.retry_after(openai.error.RateLimitError("slow down")) is None
+
+
+def test_prompt_tokens_are_reserved_once(fake_openai):
+    fake_openai.fail_requests = 2
+    scheduler = RequestScheduler(tokens_per_minute=6000, base_delay=0.001)
+    scheduler.call(chat_create, tokens=1000, model="gpt-3.5-turbo", messages=[])
+    available = scheduler.token_bucket.available
+    assert 5000 <= available < 5500  # less than a second of refill while retrying
+    scheduler.charge(500)
+    assert available - 500 <= scheduler.token_bucket.available < available - 400
@@ -0,0 +1,144 @@
+import sqlite3
+import pytest
+from gpterm.enums import Role
+from gpterm.sessions import SessionStore, fts_query, HIGHLIGHT_START, HIGHLIGHT_END
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SessionStore(str(tmp_path / "db" / "sessions.db"))
+    yield store
+    store.close()
+
+
+def test_append_and_load_the_tail(store):
+    session_id = store.create_session("gpt-4")
+    assert store.append_turns(session_id, [(Role.user, "directive", 5), (Role.assistant, "ok", 1)], pinned=2) == 0
+    turns = [(Role.user, f"question {idx}", 10) if idx % 2 == 0 else (Role.assistant, f"answer {idx}", 10)
+             for idx in range(10)]
+    assert store.append_turns(session_id, turns, pinned=2) == 2
+    session = store.session(session_id)
+    assert session.num_turns == 12 and session.pinned == 2 and session.title == "question 0"
+    pinned, tail = store.load_tail(session_id, max_tokens=36)
+    assert [turn.content for turn in pinned] == ["directive", "ok"]
+    # 30 tokens are left for the tail: the last 3 turns, less the response that would start it
+    assert [turn.content for turn in tail] == ["question 8", "answer 9"]
+    assert [turn.seq for turn in tail] == [10, 11]
+
+
+def test_update_turns(store):
+    session_id = store.create_session("gpt-4")
+    store.append_turns(session_id, [(Role.user, "hello", 1), (Role.assistant, "hi", 1)])
+    store.update_turns(session_id, [(1, "hi there", 2)])
+    _, tail = store.load_tail(session_id, 100)
+    assert [(turn.content, turn.tokens) for turn in tail] == [("hello", 1), ("hi there", 2)]
+
+
+def test_list_sessions_skips_sessions_with_only_pinned_turns(store):
+    empty = store.create_session("gpt-4")
+    store.append_turns(empty, [(Role.user, "directive", 5)], pinned=1)
+    first = store.create_session("gpt-4")
+    store.append_turns(first, [(Role.user, "first", 1)])
+    second = store.create_session("gpt-3.5-turbo")
+    store.append_turns(second, [(Role.user, "second", 1)])
+    assert [session.id for session in store.list_sessions()] == [second, first]
+    assert store.last_session_id() == second
+    assert store.last_session_id(exclude=second) == first
+
+
+def test_set_pinned_drops_a_title_from_a_pinned_turn(store):
+    session_id = store.create_session("gpt-4")
+    store.append_turns(session_id, [(Role.user, "directive", 5)])
+    assert store.session(session_id).title == "directive"
+    store.set_pinned(session_id, 1)
+    assert store.session(session_id).title is None
+
+
+def test_load_tail_of_a_missing_session(store):
+    with pytest.raises(KeyError):
+        store.load_tail(42, 100)
+
+
+def test_conversation_is_stored_and_resumed(gpterm, fake_openai):
+    gpterm.session_store = SessionStore(gpterm.cfg.session_db_path)
+    gpterm.submit_prompt("what is a monad?")
+    session_id = gpterm.session_id
+    assert session_id is not None
+    assert all(turn.stored for turn in gpterm.conversation.turns)
+
+    gpterm.new_session()
+    gpterm.reset_context(prompt="", submit=False)
+    assert "Resumed session" in gpterm.resume_session()
+    assert gpterm.session_id == session_id
+    assert [turn.text().strip() for turn in gpterm.conversation.turns] == ["what is a monad?", fake_openai.response]
+
+    gpterm.submit_prompt("and a functor?")
+    _, tail = gpterm.session_store.load_tail(session_id, 1000)
+    assert [turn.content.strip() for turn in tail] == ["what is a monad?", fake_openai.response, "and a functor?",
+                                                       fake_openai.response]
+    assert str(session_id) in gpterm.format_sessions()
+
+
+def test_turns_are_kept_until_the_store_accepts_them(gpterm, fake_openai):
+    class Broken(SessionStore):
+        fail = True
+
+        def append_turns(self, *args, **kwargs):
+            if self.fail:
+                raise sqlite3.OperationalError("database is locked")
+            return super().append_turns(*args, **kwargs)
+
+    gpterm.session_store = Broken(gpterm.cfg.session_db_path)
+    gpterm.submit_prompt("what is a monad?")
+    assert not any(turn.stored for turn in gpterm.conversation.turns)
+    Broken.fail = False
+    gpterm.submit_prompt("and a functor?")
+    _, tail = gpterm.session_store.load_tail(gpterm.session_id, 1000)
+    assert len(tail) == 4
+
+
+def test_fts_query_takes_terms_literally():
+    assert fts_query('monad "quoted" prefix* *') == '"monad" """quoted""" "prefix"*'
+    assert fts_query("   ") == ""
+
+
+def test_search_matches_all_terms_and_highlights_them(store):
+    first = store.create_session("gpt-4")
+    store.append_turns(first, [(Role.user, "how do I reverse a list in python?", 9),
+                               (Role.assistant, "use reversed() or slicing", 5)])
+    second = store.create_session("gpt-4")
+    store.append_turns(second, [(Role.user, "reverse a string in rust", 5)])
+    results = store.search("reverse python")
+    assert [(session_id, seq) for session_id, seq, *_ in results] == [(first, 0)]
+    session_id, seq, role, created, title, snippet = results[0]
+    assert role == Role.user.value and title == "how do I reverse a list in python?"
+    assert f"{HIGHLIGHT_START}reverse{HIGHLIGHT_END}" in snippet
+    assert {result[0] for result in store.search("revers*")} == {first, second}
+    assert store.search("AND OR (") == []  # operators are searched for as words, not parsed
+
+
+def test_search_finds_text_added_to_a_stored_turn(store):
+    session_id = store.create_session("gpt-4")
+    store.append_turns(session_id, [(Role.user, "hello", 1), (Role.assistant, "hi", 1)])
+    store.update_turns(session_id, [(1, "hi, let's talk about monads", 6)])
+    assert [result[1] for result in store.search("monads")] == [1]
+    assert store.search("hi")[0][1] == 1
+
+
+def test_turns_stored_before_the_index_are_indexed(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SessionStore(path)
+    session_id = store.create_session("gpt-4")
+    store.append_turns(session_id, [(Role.user, "an old question about monads", 5)])
+    store.conn.executescript("DROP TABLE turns_fts; DROP TRIGGER turns_fts_insert; DROP TRIGGER turns_fts_update;")
+    store.close()
+    store = SessionStore(path)
+    assert len(store.search("monads")) == 1
+    store.close()
+
+
+def test_search_command(gpterm, fake_openai):
+    gpterm.session_store = SessionStore(gpterm.cfg.session_db_path)
+    gpterm.submit_prompt("what is a monad?")
+    assert "monad" in gpterm.search_sessions("monad")
+    assert "No matches" in gpterm.search_sessions("functor")
@@ -0,0 +1,121 @@
+import time
+import pytest
+from gpterm.hedging import RequestHedger
+from gpterm.usage import UsageLedger, BudgetExceeded
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = UsageLedger(str(tmp_path / "usage.db"), soft_budget=0.01, hard_budget=0.02)
+    yield ledger
+    ledger.close()
+
+
+def test_totals_are_kept_per_day_model_and_session(ledger):
+    ledger.add("gpt-3.5-turbo", 1, 100, 50, 0.001)
+    ledger.add("gpt-3.5-turbo", 1, 200, 10, 0.002)
+    ledger.add("gpt-4", 2, 10, 10, 0.003)
+    rows = ledger.conn.execute("SELECT model, session_id, requests, prompt_tokens, completion_tokens FROM usage "
+                               "ORDER BY model").fetchall()
+    assert rows == [("gpt-3.5-turbo", 1, 2, 300, 60), ("gpt-4", 2, 1, 10, 10)]
+    assert ledger.day_cost == pytest.approx(0.006)
+
+
+def test_soft_budget_warns_once_a_day(ledger):
+    assert ledger.check() is None
+    ledger.add("gpt-4", 1, 100, 100, 0.011)
+    assert "soft daily budget" in ledger.check()
+    assert ledger.check() is None
+
+
+def test_hard_budget_blocks_requests(ledger):
+    ledger.add("gpt-4", 1, 100, 100, 0.015)
+    ledger.check(0.001)
+    with pytest.raises(BudgetExceeded):
+        ledger.check(0.01)
+
+
+def test_day_total_is_read_back(tmp_path, ledger):
+    ledger.add("gpt-4", 1, 100, 100, 0.015)
+    ledger.close()
+    reopened = UsageLedger(ledger.path, hard_budget=0.02)
+    with pytest.raises(BudgetExceeded):
+        reopened.check(0.01)
+    reopened.close()
+
+
+def test_report(ledger):
+    ledger.add("gpt-3.5-turbo", 3, 1000, 500, 0.0025)
+    report = ledger.report(session_id=3)
+    assert "Session 3" in report
+    assert "chatgpt" in report
+    assert "Daily budget: soft $0.01, hard $0.02" in report
+
+
+FULL = "The quick brown fox jumps over the lazy dog. Then it runs away into the forest and hides."
+
+
+def ledger_totals(gpterm):
+    return gpterm.usage.conn.execute("SELECT SUM(requests), SUM(prompt_tokens), SUM(completion_tokens) "
+                                     "FROM usage").fetchone()
+
+
+def test_continuation_requests_are_recorded(gpterm, fake_openai):
+    gpterm.usage = UsageLedger(gpterm.cfg.usage_db_path)
+    fake_openai.fail_after_chunks = 6
+
+    def respond(kwargs):
+        if kwargs["messages"][-1]["content"] == gpterm.resume_directive:
+            fake_openai.fail_after_chunks = None
+            partial = kwargs["messages"][-2]["content"]
+            return FULL[FULL.index(partial) + len(partial) - 10:]  # repeats the end of the partial response
+        return FULL
+    fake_openai.response = respond
+    gpterm.submit_prompt("tell me about the fox")
+    assert gpterm.conversation.turns[-1].text().strip() == FULL
+    requests, prompt_tokens, completion_tokens = ledger_totals(gpterm)
+    assert requests == 2 == len(fake_openai.requests)
+    # the continuation's prompt (with the partial response) on top of the first request's
+    assert prompt_tokens > 2 * gpterm.metrics.records[-1]["prompt_tokens"]
+    # every chunk streamed by both requests is billed: the 6 before the drop and all of the continuation's
+    assert completion_tokens == 6 + len(fake_openai.deltas(respond(fake_openai.requests[-1])))
+
+
+def test_overlap_chunks_are_reported():
+    from gpterm.resume import ResumableStream
+    from openai.util import convert_to_openai_object
+    import openai
+
+    def stream(deltas, fail=False):
+        for delta in deltas:
+            yield convert_to_openai_object({"choices": [{"delta": {"content": delta}}]})
+        if fail:
+            raise openai.error.APIConnectionError("dropped")
+
+    def chat_response(obj):
+        return obj.choices[0].delta.get("content")
+    overlaps = []
+    resumable = ResumableStream(stream(["The ", "quick ", "brown ", "fox "], fail=True), chat_response, True,
+                                lambda partial: stream(["brown ", "fox ", "jumps"]), on_overlap=overlaps.append)
+    passed = [chat_response(obj) for obj in resumable]
+    assert ''.join(passed) == "The quick brown fox jumps"
+    # the 3 continuation chunks were passed on as 1
+    assert overlaps == [2]
+    assert len(passed) + sum(overlaps) == 4 + 3
+
+
+def test_the_losing_hedged_request_is_recorded(gpterm, fake_openai):
+    gpterm.usage = UsageLedger(gpterm.cfg.usage_db_path)
+    gpterm.cfg.hedge_requests = True
+    gpterm.hedger = RequestHedger(default_delay=0.02)
+    fake_openai.first_token_delay = 0.1
+    gpterm.submit_prompt("tell me about the fox")
+    assert len(fake_openai.requests) == 2
+    deadline = time.monotonic() + 5
+    while ledger_totals(gpterm)[0] != 2 and time.monotonic() < deadline:
+        time.sleep(0.01)  # the losing request is closed when its first token arrives
+    requests, prompt_tokens, completion_tokens = ledger_totals(gpterm)
+    assert requests == 2
+    response_tokens = len(fake_openai.deltas(fake_openai.response))
+    assert completion_tokens == response_tokens + 1
+    assert prompt_tokens % 2 == 0 and prompt_tokens > 0  # the same prompt twice
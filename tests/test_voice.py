@@ -0,0 +1,110 @@
+import threading
+from gpterm.voice import VoiceEngine, CommandBackend
+
+
+class FakeProcess:
+    def __init__(self, backend, text):
+        self.backend = backend
+        self.text = text
+        self.rc = None
+
+    def wait(self):
+        self.backend.release.wait(5)
+        if self.rc is None:
+            self.rc = 1 if self.text in self.backend.failing else 0
+        return self.rc
+
+    def poll(self):
+        return self.rc
+
+    def terminate(self):
+        self.rc = -15
+        self.backend.terminated.append(self.text)
+        self.backend.release.set()
+
+
+class FakeBackend:
+    """
+    Plays a sentence until release is set
+    """
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.synthesized = []
+        self.played = []
+        self.cleaned = []
+        self.terminated = []
+        self.release = threading.Event()
+
+    def synthesize(self, text):
+        self.synthesized.append(text)
+        return f"{text}.aiff"
+
+    def play(self, text, audio_path):
+        self.played.append(text)
+        return FakeProcess(self, text)
+
+    def cleanup(self, audio_path):
+        self.cleaned.append(audio_path)
+
+
+def wait_until(condition):
+    event = threading.Event()
+    for _ in range(500):
+        if condition():
+            return True
+        event.wait(0.01)
+    return False
+
+
+def test_speaks_in_order_and_synthesizes_ahead():
+    backend = FakeBackend()
+    engine = VoiceEngine(backend)
+    for sentence in ["one", "two", "three"]:
+        engine.speak(sentence)
+    # "one" is playing, "two" is synthesized meanwhile
+    assert wait_until(lambda: backend.played == ["one"] and "two" in backend.synthesized)
+    backend.release.set()
+    engine.wait()
+    assert backend.played == ["one", "two", "three"]
+    assert backend.cleaned == ["one.aiff", "two.aiff", "three.aiff"]
+    assert not engine.failed
+
+
+def test_failure_drops_the_queued_sentences():
+    backend = FakeBackend(failing={"two"})
+    backend.release.set()
+    engine = VoiceEngine(backend)
+    for sentence in ["one", "two", "three", "four"]:
+        engine.speak(sentence)
+    engine.wait()
+    assert engine.failed
+    assert "four" not in backend.played
+    engine.speak("five")  # ignored until reset
+    engine.reset()
+    engine.speak("six")
+    engine.wait()
+    assert backend.played[-1] == "six" and "five" not in backend.played
+
+
+def test_stop_terminates_the_playing_sentence():
+    backend = FakeBackend()
+    engine = VoiceEngine(backend)
+    engine.speak("long sentence")
+    engine.speak("next")
+    assert wait_until(lambda: backend.played == ["long sentence"])
+    engine.stop()
+    engine.wait()
+    assert backend.terminated == ["long sentence"]
+    assert wait_until(lambda: len(backend.cleaned) >= 1)
+    assert "next" not in backend.played
+
+
+def test_command_backend():
+    engine = VoiceEngine(CommandBackend("true"))
+    engine.speak("hello")
+    engine.wait()
+    assert not engine.failed
+    engine = VoiceEngine(CommandBackend("false"))
+    engine.speak("hello")
+    engine.wait()
+    assert engine.failed